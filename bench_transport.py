@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark de la capa HTTP: requests por segundo contra un servidor local
+
+Envía el mismo número de requests de /api/generate con distintas
+configuraciones de transporte (pool por defecto de requests, pool del tamaño
+de la concurrencia, cuerpos con gzip y el cliente httpx que usa OpenAI) y
+muestra requests/s, latencias, conexiones TCP abiertas y bytes enviados.
+
+Por defecto arranca el servidor simulado de ollama_stub.py con latencia 0, de
+modo que lo que se mide es solo el coste del transporte; con --url se mide
+contra un servidor real (sin contar conexiones).
+
+Uso:
+    python bench_transport.py --requests 500 --concurrency 16 --payload-kb 200
+"""
+
+import argparse
+import base64
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from classify_images_with_ollama import OllamaImageClassifier, encode_json_payload
+from ollama_stub import StubOllamaServer
+from transport import DEFAULT_POOL_SIZE, TransportConfig
+
+
+def make_body(payload_kb: int) -> bytes:
+    """Request de /api/generate con una "imagen" base64 de payload_kb (bytes aleatorios, como un JPEG)"""
+    image = base64.b64encode(os.urandom(payload_kb * 1024 * 3 // 4))
+    return encode_json_payload({"model": "bench", "prompt": "Describe la imagen.", "images": [image],
+                                "stream": False})
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_case(send, requests_count: int, concurrency: int) -> Dict:
+    """Ejecuta `send()` requests_count veces con `concurrency` hilos"""
+    latencies = []
+
+    def one(_):
+        start = time.perf_counter()
+        status = send()
+        latencies.append(time.perf_counter() - start)
+        return status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(one, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": requests_count / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "errors": sum(1 for status in statuses if status != 200)
+    }
+
+
+def requests_sender(url: str, config: TransportConfig, body: bytes):
+    classifier = OllamaImageClassifier(ollama_url=url, transport=config)
+    sent, _ = config.encode_body(body)
+    return (lambda: classifier._post("/api/generate", body, timeout=60).status_code), len(sent)
+
+
+def httpx_sender(url: str, config: TransportConfig, body: bytes):
+    client = config.openai_http_client()
+    data, headers = config.encode_body(body)
+    return (lambda: client.post(f"{url}/api/generate", content=data, headers=headers).status_code), len(data)
+
+
+def benchmark(requests_count: int, concurrency: int, payload_kb: int, url: Optional[str] = None,
+              latency: float = 0.0) -> List[Dict]:
+    """Mide cada configuración de transporte; devuelve una fila de resultados por caso"""
+    body = make_body(payload_kb)
+    cases = [
+        ("requests, pool por defecto", requests_sender, TransportConfig(pool_size=DEFAULT_POOL_SIZE)),
+        ("requests, pool = concurrencia", requests_sender, TransportConfig(pool_size=concurrency)),
+        ("requests, pool + gzip", requests_sender, TransportConfig(pool_size=concurrency, gzip_requests=True)),
+    ]
+    try:
+        import httpx  # noqa: F401
+        cases.append(("httpx (cliente OpenAI)", httpx_sender, TransportConfig(pool_size=concurrency)))
+    except ImportError:
+        print("⚠️ httpx no está instalado; se omite el caso del cliente OpenAI")
+
+    rows = []
+    for name, make_sender, config in cases:
+        server = None if url else StubOllamaServer(base_latency=latency, capacity=concurrency).start()
+        try:
+            send, body_bytes = make_sender(url or server.url, config, body)
+            row = run_case(send, requests_count, concurrency)
+        finally:
+            if server is not None:
+                server.stop()
+        row.update(case=name, connections=server.connections if server is not None else None,
+                   sent_mb=body_bytes * requests_count / 2**20)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark de transporte HTTP")
+    parser.add_argument("--requests", type=int, default=300, help="Requests por caso")
+    parser.add_argument("--concurrency", type=int, default=16, help="Hilos enviando a la vez")
+    parser.add_argument("--payload-kb", type=int, default=200, help="Tamaño del base64 de la imagen")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latencia del servidor simulado")
+    parser.add_argument("--url", default=None, help="Servidor real en lugar del simulado")
+    args = parser.parse_args()
+
+    print(f"🏁 {args.requests} requests x {args.concurrency} hilos, cuerpo de {args.payload_kb} KB\n")
+    for row in benchmark(args.requests, args.concurrency, args.payload_kb, args.url, args.latency):
+        connections = f" | {row['connections']} conexiones" if row["connections"] is not None else ""
+        print(f"{row['case']:<32} {row['rps']:8.1f} req/s | p50 {row['p50_ms']:7.1f} ms | "
+              f"p95 {row['p95_ms']:7.1f} ms | {row['sent_mb']:7.1f} MB enviados{connections} | "
+              f"{row['errors']} errores")
+
+
+if __name__ == "__main__":
+    main()
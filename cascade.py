@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Cascada de modelos: un modelo barato clasifica primero y solo los ítems
+dudosos se escalan al modelo grande
+
+La confianza del modelo barato se decide con señales baratas de obtener:
+
+- validez: la respuesta existe y se puede parsear (y no es "NA", si se pide)
+- acuerdo: con samples=2 se piden dos muestras y deben coincidir
+- logprobs: probabilidad media por token de la respuesta (solo OpenAI)
+
+Una fracción opcional de los ítems confiables (audit_rate) se envía también
+al modelo grande, sin cambiar el resultado, para medir el acuerdo entre
+niveles en el tráfico que no se escala.
+"""
+
+import random
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from self_consistency import answers_agree, parse_score
+
+
+class CascadeStats:
+    """Contadores de escalado y de acuerdo entre niveles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.escalated = 0
+        self.reasons = Counter()
+        self.compared = Counter()  # "escalated" / "audit" -> ítems comparados
+        self.agreed = Counter()
+
+    def record(self, reason: Optional[str], audited: bool = False, agreed: Optional[bool] = None):
+        """
+        Registra un ítem
+
+        Args:
+            reason: Motivo de escalado o None si resolvió el modelo barato
+            audited: True si un ítem confiable se envió también al modelo grande
+            agreed: Si ambos niveles coincidieron (None si no se compararon)
+        """
+        with self._lock:
+            self.items += 1
+            if reason is not None:
+                self.escalated += 1
+                self.reasons[reason] += 1
+            if agreed is not None:
+                kind = "audit" if audited else "escalated"
+                self.compared[kind] += 1
+                self.agreed[kind] += int(agreed)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            agreement = {kind: round(self.agreed[kind] / self.compared[kind], 4)
+                         for kind in self.compared if self.compared[kind]}
+            return {
+                "items": self.items,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / self.items, 4) if self.items else 0.0,
+                "reasons": dict(self.reasons),
+                "compared": dict(self.compared),
+                "tier_agreement": agreement
+            }
+
+    def print_summary(self):
+        metrics = self.metrics()
+        if not metrics["items"]:
+            return
+        print(f"\n🪜 CASCADA: {metrics['escalated']}/{metrics['items']} escalados "
+              f"({metrics['escalation_rate']:.1%}) | motivos: {metrics['reasons']}")
+        for kind, value in metrics["tier_agreement"].items():
+            label = "ítems escalados" if kind == "escalated" else "auditoría de ítems confiables"
+            print(f"   Acuerdo entre niveles en {label}: {value:.1%} ({metrics['compared'][kind]} ítems)")
+
+
+class Cascade:
+    """
+    Configuración de una cascada barato -> caro
+
+    Args:
+        cheap_model: Modelo que clasifica primero
+        samples: Muestras del modelo barato (2 activa la señal de acuerdo)
+        escalate_na: Escalar cuando el modelo barato responde "NA"
+        tolerance: Diferencia máxima entre puntuaciones para considerar acuerdo
+        min_confidence: Probabilidad media por token mínima (logprobs, solo OpenAI)
+        audit_rate: Fracción de ítems confiables que también se envían al modelo grande
+        seed: Semilla de la selección de auditoría
+    """
+
+    def __init__(self, cheap_model: str, samples: int = 1, escalate_na: bool = True,
+                 tolerance: float = 5.0, min_confidence: Optional[float] = None,
+                 audit_rate: float = 0.0, seed: Optional[int] = None):
+        self.cheap_model = cheap_model
+        self.samples = max(1, samples)
+        self.escalate_na = escalate_na
+        self.tolerance = tolerance
+        self.min_confidence = min_confidence
+        self.audit_rate = audit_rate
+        self.stats = CascadeStats()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_audit(self) -> bool:
+        if self.audit_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.audit_rate
+
+    def image_escalation(self, answers: List[Optional[str]], parser=None) -> Optional[str]:
+        """
+        Motivo para escalar las respuestas del modelo barato a una imagen (None si son confiables)
+        """
+        if not answers or any(not answer for answer in answers):
+            return "sin_respuesta"
+        if parser is not None and not all(parser.parse(answer).ok for answer in answers):
+            return "parseo"
+        if self.escalate_na and any(parse_score(answer) == "NA" for answer in answers):
+            return "na"
+        if len(answers) > 1 and not answers_agree(answers, self.tolerance):
+            return "desacuerdo"
+        return None
+
+    def labels_escalation(self, labels: List[Tuple[str, str, str]],
+                          confidences: Optional[List[Optional[float]]] = None) -> Optional[str]:
+        """
+        Motivo para escalar las etiquetas (sense, reference, attribution) de una frase
+        """
+        if not labels or any("ERROR" in label for label in labels):
+            return "parseo"
+        if self.escalate_na and any(label[0] in ("NA", "") for label in labels):
+            return "na"
+        if len(set(labels)) > 1:
+            return "desacuerdo"
+        if self.min_confidence is not None and confidences:
+            known = [c for c in confidences if c is not None]
+            if known and min(known) < self.min_confidence:
+                return "logprobs"
+        return None
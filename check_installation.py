@@ -1,11 +1,58 @@
 #!/usr/bin/env python3
 """
 Script para verificar que todas las dependencias estén instaladas correctamente
+
+Con --throughput mide además el rendimiento alcanzable con el Ollama configurado
+(codificación de imágenes, red, carga del modelo, latencia y saturación) y
+recomienda la configuración (ver throughput_check.py). Con --stub las medidas se
+hacen contra el servidor simulado de ollama_stub.py, sin red.
+
+Uso:
+    python check_installation.py
+    python check_installation.py --throughput --max-image-size 1024
+    python check_installation.py --throughput --stub
 """
 
+import argparse
+import os
 import sys
 from pathlib import Path
 
+from cli_env import env_default
+
+parser = argparse.ArgumentParser(description="Verifica la instalación y, con --throughput, el rendimiento alcanzable")
+parser.add_argument("--throughput", action="store_true",
+                    help="Medir codificación, red, carga del modelo, latencia y saturación de Ollama")
+parser.add_argument("--stub", action="store_true",
+                    help="Medir contra el servidor simulado de ollama_stub.py (sin red ni GPU)")
+parser.add_argument("--url", default=env_default("OLLAMA_URL", "http://localhost:11434"),
+                    help="URL del servidor Ollama [OLLAMA_URL]")
+parser.add_argument("--model", default=env_default("OLLAMA_MODEL", "gemma3:27b-it-qat"),
+                    help="Modelo de Ollama [OLLAMA_MODEL]")
+parser.add_argument("--prompt-file", default=env_default("OLLAMA_PROMPT_FILE", "prompt_capital-erotico.txt"),
+                    help="Prompt de los requests de prueba [OLLAMA_PROMPT_FILE]")
+parser.add_argument("--max-image-size", type=int, default=env_default("OLLAMA_MAX_IMAGE_SIZE", None, int),
+                    help="Lado máximo de las imágenes enviadas [OLLAMA_MAX_IMAGE_SIZE]")
+parser.add_argument("--jpeg-quality", type=int, default=env_default("OLLAMA_JPEG_QUALITY", 75, int),
+                    help="Calidad JPEG de las imágenes enviadas [OLLAMA_JPEG_QUALITY]")
+parser.add_argument("--pool-size", type=int, default=env_default("OLLAMA_POOL_SIZE", None, int),
+                    help="Pool de conexiones configurado [OLLAMA_POOL_SIZE]")
+parser.add_argument("--max-concurrency", type=int, default=16, help="Máximo de requests en vuelo a probar")
+parser.add_argument("--requests-per-level", type=int, default=0,
+                    help="Requests por nivel de concurrencia, 0 = 2 por hilo (mínimo 8)")
+parser.add_argument("--encode-seconds", type=float, default=0.5,
+                    help="Segundos de medida por tamaño de imagen")
+parser.add_argument("--stub-latency", type=float, default=0.2, help="Segundos por request del servidor simulado")
+parser.add_argument("--stub-capacity", type=int, default=4, help="Requests en paralelo del servidor simulado")
+args = parser.parse_args()
+
+stub = None
+if args.stub:
+    from ollama_stub import StubOllamaServer
+    stub = StubOllamaServer(base_latency=args.stub_latency, capacity=args.stub_capacity,
+                            models=[args.model]).start()
+    args.url = stub.url
+
 print("="*70)
 print("VERIFICACIÓN DE INSTALACIÓN")
 print("="*70)
@@ -80,7 +127,6 @@ except ImportError:
 
 # 4. Verificar API key de OpenAI
 print("\n4. Verificando configuración de OpenAI...")
-import os
 api_key = os.getenv('OPENAI_API_KEY')
 if api_key:
     print(f"   ✅ OPENAI_API_KEY configurada (longitud: {len(api_key)} caracteres)")
@@ -89,13 +135,15 @@ else:
     warnings.append("Configura: export OPENAI_API_KEY='tu-api-key'")
 
 # 5. Verificar Ollama
-print("\n5. Verificando instalación de Ollama...")
+print(f"\n5. Verificando instalación de Ollama ({args.url}{', simulado' if stub else ''})...")
+ollama_ok = False
 try:
     import requests
-    response = requests.get("http://localhost:11434/api/tags", timeout=5)
+    response = requests.get(f"{args.url}/api/tags", timeout=5)
     if response.status_code == 200:
         models = response.json().get("models", [])
         print(f"   ✅ Ollama está ejecutándose")
+        ollama_ok = True
         print(f"   📦 Modelos instalados: {len(models)}")
         for model in models:
             print(f"      - {model['name']}")
@@ -125,6 +173,34 @@ for file in required_files:
         print(f"   ❌ {file} no encontrado")
         errors.append(f"Archivo faltante: {file}")
 
+# 7. Diagnóstico de rendimiento
+if args.throughput:
+    print("\n7. Midiendo el rendimiento alcanzable...")
+    if not ollama_ok:
+        print("   ⚠️ Se omite: Ollama no responde")
+        warnings.append("Sin diagnóstico de rendimiento: Ollama no responde (prueba --stub)")
+    else:
+        try:
+            from throughput_check import run_diagnostics
+            prompt_path = Path(args.prompt_file)
+            if prompt_path.exists():
+                prompt = prompt_path.read_text(encoding='utf-8').strip()
+            else:
+                from classify_images_with_ollama import create_example_prompt
+                prompt = create_example_prompt()
+            report = run_diagnostics(args.url, args.model, prompt, args.max_image_size, args.jpeg_quality,
+                                     args.max_concurrency, args.requests_per_level, args.encode_seconds,
+                                     args.pool_size)
+            warnings.extend(line[2:].strip() for line in report["recommendations"] if line.startswith("❌"))
+        except ImportError as e:
+            print(f"   ❌ No se puede medir: {e}")
+            errors.append("pip install -r requirements.txt")
+        except Exception as e:
+            print(f"   ❌ Error durante el diagnóstico: {e}")
+            warnings.append("Diagnóstico de rendimiento incompleto")
+if stub is not None:
+    stub.stop()
+
 # Resumen
 print("\n" + "="*70)
 print("RESUMEN")
@@ -3,23 +3,201 @@
 Script para clasificar imágenes usando modelos de visión en Ollama
 """
 
+import argparse
 import requests
 import base64
 from io import BytesIO
 from PIL import Image
 from tqdm import tqdm
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import time
 import gc
 import os
+import sys
 import json
-from typing import Dict, List, Optional, Union
+import re
+import uuid
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
+from cli_env import env_default, parse_flag
+from incremental import (file_fingerprint, file_stat, label_changes, plan_incremental, prompt_hash,
+                         write_diff_report)
+from image_limits import (DEFAULT_MAX_DOWNLOAD_BYTES, DEFAULT_MAX_PIXELS, DecodeMemoryGate, ImageLimits,
+                          decoded_bytes, fetch_limited, limit_worker_memory, open_bounded)
+from ollama_options import PREFIX_USER_MESSAGE, OllamaOptions, PrefixCacheStats, parse_keep_alive
+from profiling import add_profile_arguments, checkpoint as memory_checkpoint, run_profiled
+from self_consistency import aggregate_text_answers, answers_agree, sample_with_early_stopping
+from scheduler import BATCH, INTERACTIVE, DeadlineExpired, PriorityScheduler, request_class
+from sharding import parse_shard, select_shard, shard_key
+from shutdown import (EXIT_INTERRUPTED, GracefulShutdown, add_shutdown_arguments, clear_resume_marker,
+                      ignore_interrupts, read_resume_marker, resume_marker_path, run_stages, write_resume_marker)
+from transport import DEFAULT_CONNECT_TIMEOUT, TransportConfig
+from replay import add_replay_arguments, archive_from_args, install_session, replay_mode
+from usage import BudgetExceeded, add_budget_arguments, tracker_from_args
+
 # Configuración por defecto
 DEFAULT_MODEL = "gemma3:27b-it-qat"
 DEFAULT_OLLAMA_URL = "http://localhost:11434"
+DEFAULT_JPEG_QUALITY = 75  # Calidad por defecto de Pillow
+DEADLINE_ERROR = "Plazo vencido"
+# Respuestas con las que el servidor avisa de que está saturado (Ollama: 503 con la cola llena)
+OVERLOAD_STATUSES = (429, 503)
+
+
+def encode_image_to_base64(img: Image.Image, max_size: Optional[int] = None,
+                           quality: int = DEFAULT_JPEG_QUALITY) -> bytes:
+    """
+    Convierte una imagen PIL a JPEG y la codifica en base64
+    
+    Args:
+        img: Imagen PIL
+        max_size: Lado máximo en píxeles (None para no redimensionar)
+        quality: Calidad JPEG
+        
+    Returns:
+        Bytes ASCII con la imagen en base64
+    """
+    img = img.convert("RGB")
+    if max_size:
+        img.thumbnail((max_size, max_size))
+    with BytesIO() as output_buffer:
+        img.save(output_buffer, format="JPEG", quality=quality)
+        return base64.b64encode(output_buffer.getvalue())
+
+
+def encode_image_file(file_path: Union[str, Path, BytesIO], max_size: Optional[int] = None,
+                      quality: int = DEFAULT_JPEG_QUALITY, limits: Optional[ImageLimits] = None,
+                      memory_gate: Optional[DecodeMemoryGate] = None) -> Optional[bytes]:
+    """
+    Carga y codifica un archivo de imagen (función de módulo para usar en un pool de procesos)
+    
+    La cabecera se comprueba contra `limits` antes de decodificar (ver image_limits)
+    y, con `memory_gate`, la decodificación espera a que haya memoria disponible.
+    
+    Returns:
+        Bytes ASCII con la imagen en base64 o None si falla
+    """
+    try:
+        with open_bounded(file_path, limits) as img:
+            with memory_gate.reserve(decoded_bytes(img)) if memory_gate is not None else nullcontext():
+                return encode_image_to_base64(img, max_size, quality)
+    except MemoryError:
+        print(f"Error cargando imagen {getattr(file_path, 'name', file_path)}: memoria insuficiente (tope del worker)")
+        return None
+    except Exception as e:
+        print(f"Error cargando imagen {getattr(file_path, 'name', file_path)}: {str(e)}")
+        return None
+
+
+def init_preprocess_worker(max_bytes: Optional[int]):
+    """Inicializador de los procesos de preprocesado: tope de memoria y Ctrl-C solo en el proceso principal"""
+    ignore_interrupts()
+    limit_worker_memory(max_bytes)
+
+
+def read_results(results_file: Union[str, Path]) -> List[Dict]:
+    """Lee un archivo de resultados JSON o JSONL (un registro por línea)"""
+    with open(results_file, 'r', encoding='utf-8') as f:
+        if str(results_file).endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def write_results(results: List[Dict], output_file: Union[str, Path]):
+    """Escribe resultados en JSON o, si la extensión es .jsonl, en JSONL"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        if str(output_file).endswith(".jsonl"):
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        else:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+
+
+def encode_json_payload(payload: Dict) -> bytes:
+    """
+    Serializa un payload JSON insertando las imágenes en bytes sin pasar por str
+    
+    Las imágenes pueden ser str o buffers (bytes/memoryview, p. ej. tomados de
+    un ImageStore mapeado en memoria); el base64 no necesita escape JSON, así
+    que los buffers se copian tal cual en el cuerpo del request. Se admiten las
+    imágenes de /api/generate ("images") y las de cada mensaje de /api/chat.
+    """
+    containers = [payload] + list(payload.get("messages") or [])
+    images = [image for container in containers for image in container.get("images") or []]
+    if all(isinstance(image, str) for image in images):
+        return json.dumps(payload).encode('utf-8')
+    
+    token = uuid.uuid4().hex
+    markers = iter(f"__image_{token}_{i}__" for i in range(len(images)))
+    
+    def with_markers(container: Dict) -> Dict:
+        if not container.get("images"):
+            return container
+        return dict(container, images=[next(markers) for _ in container["images"]])
+    
+    marked = with_markers(payload)
+    if payload.get("messages"):
+        marked = dict(marked, messages=[with_markers(message) for message in payload["messages"]])
+    body = json.dumps(marked).encode('utf-8')
+    parts = []
+    for i, image in enumerate(images):
+        before, body = body.split(f"__image_{token}_{i}__".encode('ascii'), 1)
+        parts.append(before)
+        parts.append(image.encode('ascii') if isinstance(image, str) else image)
+    parts.append(body)
+    return b"".join(parts)
+
+
+BATCH_INSTRUCTIONS = """
+
+You will receive {count} images, numbered 1 to {count} in the order they are attached.
+Apply the instructions above to each image independently.
+Answer with exactly {count} lines, one per image, in the format "<number>: <answer>" (for example "1: ..."), and nothing else."""
+
+INDEXED_ANSWER_PATTERN = re.compile(
+    r'^\s*(?:\*\*)?(?:image|imagen)?\s*#?\[?(\d+)\]?(?:\*\*)?\s*[:.)\-](?:\*\*)?\s*(.*?)\s*$', re.IGNORECASE)
+
+
+def build_batch_prompt(prompt: str, count: int) -> str:
+    """Añade al prompt las instrucciones para responder a varias imágenes numeradas"""
+    return prompt.rstrip() + BATCH_INSTRUCTIONS.format(count=count)
+
+
+def parse_indexed_answers(text: str, count: int) -> Optional[List[str]]:
+    """
+    Extrae las respuestas "<n>: <respuesta>" de un lote
+    
+    Returns:
+        Lista de `count` respuestas en orden, o None si faltan, sobran o se repiten índices
+    """
+    answers: Dict[int, str] = {}
+    for line in text.strip().splitlines():
+        match = INDEXED_ANSWER_PATTERN.match(line)
+        if not match:
+            continue
+        index = int(match.group(1))
+        if index in answers or not match.group(2):
+            return None
+        answers[index] = match.group(2)
+    if sorted(answers) != list(range(1, count + 1)):
+        return None
+    return [answers[i] for i in range(1, count + 1)]
+
+
+def ollama_usage(response: Dict) -> Dict:
+    """Uso de tokens y duraciones (en segundos) de una respuesta de /api/generate o /api/chat"""
+    return {
+        "prompt_tokens": response.get("prompt_eval_count", 0),
+        "completion_tokens": response.get("eval_count", 0),
+        "total_duration_s": response.get("total_duration", 0) / 1e9,
+        "load_duration_s": response.get("load_duration", 0) / 1e9,
+        "prompt_eval_duration_s": response.get("prompt_eval_duration", 0) / 1e9,
+        "eval_duration_s": response.get("eval_duration", 0) / 1e9
+    }
 
 
 class OllamaImageClassifier:
@@ -27,48 +205,128 @@ class OllamaImageClassifier:
     Clasificador de imágenes usando Ollama con modelos de visión
     """
     
-    def __init__(self, model_name: str = DEFAULT_MODEL, ollama_url: str = DEFAULT_OLLAMA_URL):
+    def __init__(self, model_name: str = DEFAULT_MODEL, ollama_url: str = DEFAULT_OLLAMA_URL,
+                 max_image_size: Optional[int] = None,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY,
+                 image_store=None,
+                 concurrency_limiter=None,
+                 result_parser=None,
+                 request_timeout: float = 120,
+                 max_retries: int = 3,
+                 usage_tracker=None,
+                 cascade=None,
+                 images_per_request: int = 1,
+                 image_limits: Optional[ImageLimits] = None,
+                 decode_memory_bytes: Optional[int] = None,
+                 worker_memory_bytes: Optional[int] = None,
+                 transport: Optional[TransportConfig] = None,
+                 scheduler=None,
+                 batch_deadline: Optional[float] = None,
+                 defer_expired: bool = True,
+                 options: Optional[OllamaOptions] = None,
+                 prefix_reuse: bool = False,
+                 shutdown: Optional[GracefulShutdown] = None,
+                 queue_size: Optional[int] = None,
+                 samples: int = 1,
+                 initial_samples: int = 2):
         """
         Inicializa el clasificador
         
         Args:
             model_name: Nombre del modelo de Ollama a usar
             ollama_url: URL del servidor Ollama
+            max_image_size: Lado máximo de las imágenes enviadas (None para no redimensionar)
+            jpeg_quality: Calidad JPEG de las imágenes enviadas
+            image_store: ImageStore opcional con imágenes ya codificadas (con el mismo
+                max_image_size y jpeg_quality; si no, ValueError)
+            concurrency_limiter: AdaptiveConcurrencyLimiter opcional que regula los requests en vuelo
+            result_parser: Parser opcional de result_parsers que convierte cada respuesta
+                en campos tipados (score, is_na, parsed, parse_error)
+            request_timeout: Segundos máximos de espera por cada request de clasificación
+            max_retries: Intentos por imagen antes de marcarla como ERROR
+            usage_tracker: UsageTracker opcional que acumula tokens y aplica un presupuesto
+            cascade: Cascade opcional; un modelo barato clasifica primero y model_name
+                solo recibe los ítems poco confiables
+            images_per_request: Si es > 1, las imágenes se envían en lotes de ese tamaño
+                en un solo request de /api/chat (útil con miniaturas)
+            image_limits: Topes de píxeles y de bytes descargados por imagen (ver image_limits)
+            decode_memory_bytes: Memoria máxima de las decodificaciones simultáneas en este proceso
+            worker_memory_bytes: Tope de memoria de cada proceso de preprocesado (RLIMIT_AS)
+            transport: TransportConfig con el tamaño del pool, los timeouts de conexión
+                y la compresión de los cuerpos (ver transport.py)
+            scheduler: PriorityScheduler opcional que reparte los requests en vuelo entre
+                clases (las consultas interactivas pasan delante del lote)
+            batch_deadline: Segundos que puede esperar en cola cada imagen de un lote
+                antes de descartarse con error "Plazo vencido" (requiere scheduler)
+            defer_expired: Reintentar al final del lote, sin plazo, las imágenes descartadas
+            options: OllamaOptions con num_ctx, num_predict, temperature, num_thread y
+                keep_alive, que se envían en cada request (ver ollama_options.py)
+            prefix_reuse: Enviar el prompt como mensaje de sistema de /api/chat, igual en
+                todos los requests, para que Ollama reutilice su evaluación (caché KV)
+            shutdown: GracefulShutdown opcional; tras Ctrl-C o SIGTERM no se empiezan más
+                imágenes y process_directory guarda lo clasificado y un marcador de reanudación
+            queue_size: Imágenes en cola entre las etapas de carga, inferencia y escritura
+                (por defecto 2 por worker; ver shutdown.run_stages)
+            samples: Si es > 1 (y sin cascada), cada imagen se clasifica con
+                auto-consistencia de hasta `samples` muestras (ver classify_image_consistent)
+            initial_samples: Muestras de la primera ronda de la auto-consistencia
         """
         self.model_name = model_name
         self.ollama_url = ollama_url
+        self.max_image_size = max_image_size
+        self.jpeg_quality = jpeg_quality
+        if image_store is not None and (image_store.max_image_size, image_store.jpeg_quality) != (
+                max_image_size, jpeg_quality):
+            raise ValueError(f"El ImageStore '{image_store.store_dir}' se abrió con "
+                             f"max_image_size={image_store.max_image_size}, jpeg_quality={image_store.jpeg_quality} "
+                             f"y el clasificador usa max_image_size={max_image_size}, jpeg_quality={jpeg_quality}")
+        self.image_store = image_store
+        self.concurrency_limiter = concurrency_limiter
+        self.result_parser = result_parser
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.usage_tracker = usage_tracker
+        self.cascade = cascade
+        self.images_per_request = images_per_request
+        self.image_limits = image_limits or ImageLimits()
+        self.memory_gate = DecodeMemoryGate(decode_memory_bytes) if decode_memory_bytes else None
+        self.worker_memory_bytes = worker_memory_bytes
+        self.transport = transport or TransportConfig()
+        self.scheduler = scheduler
+        self.batch_deadline = batch_deadline
+        self.defer_expired = defer_expired
+        self.options = options or OllamaOptions()
+        self.prefix_reuse = prefix_reuse
+        self.prefix_stats = PrefixCacheStats()
+        self.shutdown = shutdown
+        self.queue_size = queue_size
+        self.samples = samples
+        self.initial_samples = initial_samples
         self.session = self._create_retry_session()
         
     def _create_retry_session(self, retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
-        """Crea una sesión con capacidad de reintentos"""
-        session = requests.Session()
-        retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=[500, 502, 503, 504],
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        return session
+        """Crea una sesión con capacidad de reintentos y el pool de self.transport"""
+        return self.transport.build_session(retries, backoff_factor)
     
     def check_connection(self) -> bool:
         """Verifica si Ollama está funcionando y el modelo está disponible"""
         try:
             print("🔍 Verificando conexión con Ollama...")
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=10)
+            response = self.session.get(f"{self.ollama_url}/api/tags", timeout=self.transport.timeouts(10))
             if response.status_code == 200:
                 models = response.json().get("models", [])
                 model_names = [model["name"] for model in models]
                 print(f"✅ Conexión exitosa. Modelos disponibles: {model_names}")
                 
-                if self.model_name in model_names:
-                    print(f"✅ Modelo {self.model_name} encontrado")
+                required = [self.model_name]
+                if self.cascade is not None:
+                    required.append(self.cascade.cheap_model)
+                missing = [name for name in required if name not in model_names]
+                if not missing:
+                    print(f"✅ Modelo {', '.join(required)} encontrado")
                     return True
                 else:
-                    print(f"⚠️ Advertencia: Modelo {self.model_name} no encontrado")
+                    print(f"⚠️ Advertencia: Modelo {', '.join(missing)} no encontrado")
                     print("Modelos disponibles:")
                     for name in model_names:
                         print(f"  - {name}")
@@ -94,22 +352,17 @@ class OllamaImageClassifier:
             String base64 de la imagen o None si falla
         """
         try:
-            response = requests.get(url, timeout=10)
-            if response.status_code != 200:
-                return None
+            data = fetch_limited(url, self.image_limits.max_download_bytes, timeout=10)
+            with BytesIO(data) as buffer:
+                buffer.name = url
+                payload = encode_image_file(buffer, self.max_image_size, self.jpeg_quality,
+                                            self.image_limits, self.memory_gate)
             
-            with BytesIO(response.content) as buffer:
-                img = Image.open(buffer).convert("RGB")
-                output_buffer = BytesIO()
-                img.save(output_buffer, format="JPEG")
-                base64_str = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
-                
-                # Limpiar memoria
-                img.close()
-                output_buffer.close()
-                gc.collect()
-                
-                return base64_str
+            # Limpiar memoria
+            del data
+            gc.collect()
+            
+            return payload.decode('ascii') if payload is not None else None
         except Exception as e:
             print(f"Error descargando imagen desde {url}: {str(e)}")
             return None
@@ -129,69 +382,323 @@ class OllamaImageClassifier:
             if not file_path.exists():
                 print(f"Error: El archivo {file_path} no existe")
                 return None
-                
-            img = Image.open(file_path).convert("RGB")
-            output_buffer = BytesIO()
-            img.save(output_buffer, format="JPEG")
-            base64_str = base64.b64encode(output_buffer.getvalue()).decode('utf-8')
+            
+            payload = encode_image_file(file_path, self.max_image_size, self.jpeg_quality,
+                                        self.image_limits, self.memory_gate)
             
             # Limpiar memoria
-            img.close()
-            output_buffer.close()
             gc.collect()
             
-            return base64_str
+            return payload.decode('ascii') if payload is not None else None
         except Exception as e:
             print(f"Error cargando imagen {file_path}: {str(e)}")
             return None
     
-    def classify_image(self, base64_image: str, prompt: str, max_retries: int = 3) -> Optional[str]:
+    def _load_payload(self, file_path: Path) -> Optional[Union[str, memoryview]]:
+        """
+        Devuelve la imagen en base64, desde el ImageStore si está vigente
+        o cargándola y codificándola si no
+        """
+        if self.image_store is not None:
+            payload = self.image_store.get(file_path)
+            if payload is not None:
+                return payload
+        return self.load_local_image_as_base64(file_path)
+    
+    def classify_image(self, base64_image: Union[str, bytes, memoryview], prompt: str,
+                       max_retries: Optional[int] = None) -> Optional[str]:
         """
         Clasifica una imagen usando el modelo de Ollama
         
         Args:
-            base64_image: Imagen codificada en base64
+            base64_image: Imagen codificada en base64 (str o buffer de bytes ASCII)
             prompt: Prompt de clasificación
-            max_retries: Número máximo de reintentos
+            max_retries: Número máximo de reintentos (por defecto self.max_retries)
             
         Returns:
             Respuesta del modelo o None si falla
         """
-        payload = {
-            "model": self.model_name,
-            "prompt": prompt,
-            "images": [base64_image],
-            "stream": False
-        }
+        return self.classify_image_detailed(base64_image, prompt, max_retries)[0]
+    
+    def classify_image_detailed(self, base64_image: Union[str, bytes, memoryview], prompt: str,
+                                max_retries: Optional[int] = None,
+                                model: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict]]:
+        """
+        Como classify_image, pero devuelve también el uso de tokens informado por Ollama
+        
+        `model` permite usar otro modelo en este request (por defecto self.model_name).
+        
+        Returns:
+            Tupla (respuesta o None, uso o None) donde el uso tiene prompt_tokens,
+            completion_tokens y las duraciones del servidor en segundos
+        
+        Raises:
+            BudgetExceeded: si hay usage_tracker y el request superaría el presupuesto
+            DeadlineExpired: si hay scheduler y el plazo del request vence en la cola
+        """
+        max_retries = max_retries or self.max_retries
+        model = model or self.model_name
+        endpoint, body = self._build_request(model, prompt, [base64_image])
         
+        tracker = self.usage_tracker
+        if tracker is not None:
+            tracker.acquire()
         for attempt in range(max_retries):
             try:
                 print(f"    Intento {attempt + 1}/{max_retries}...")
-                response = self.session.post(
-                    f"{self.ollama_url}/api/generate", 
-                    json=payload,
-                    timeout=120
-                )
+                response = self._post(endpoint, body, timeout=self.request_timeout)
                 if response.status_code == 200:
-                    result = response.json()["response"].strip()
+                    data = response.json()
+                    result = (data["message"]["content"] if "message" in data else data["response"]).strip()
+                    usage = ollama_usage(data)
+                    self.prefix_stats.record(usage)
+                    if tracker is not None:
+                        tracker.record(model, usage["prompt_tokens"], usage["completion_tokens"],
+                                       usage["prompt_eval_duration_s"] + usage["eval_duration_s"])
                     print(f"    ✅ Respuesta recibida exitosamente")
-                    return result
+                    return result, usage
                 else:
                     print(f"    ❌ Error HTTP {response.status_code}: {response.text}")
+            except DeadlineExpired:
+                if tracker is not None:
+                    tracker.release()
+                raise
             except Exception as e:
                 print(f"    ❌ Error en intento {attempt + 1}: {str(e)}")
                 if attempt == max_retries - 1:
                     print(f"    🚫 Error después de {max_retries} intentos: {str(e)}")
-                    return None
+                    break
                 print(f"    ⏳ Esperando {2 ** attempt} segundos antes del siguiente intento...")
                 time.sleep(2 ** attempt)
         
-        return None
+        if tracker is not None:
+            tracker.release()
+        return None, None
+    
+    def classify_images_batch(self, base64_images: List[Union[str, bytes, memoryview]], prompt: str,
+                              max_retries: Optional[int] = None) -> Tuple[Optional[List[str]], Optional[Dict]]:
+        """
+        Clasifica varias imágenes en un solo request de /api/chat
+        
+        El prompt se evalúa una vez por lote y se pide una respuesta numerada por
+        imagen. El timeout del request es request_timeout por imagen.
+        
+        Returns:
+            Tupla (respuestas en el orden de las imágenes, uso del request); las
+            respuestas son None si el request falla o el número de respuestas no
+            coincide con el de imágenes
+        """
+        max_retries = max_retries or self.max_retries
+        _, body = self._build_request(self.model_name, prompt, base64_images, batch=True)
+        
+        tracker = self.usage_tracker
+        if tracker is not None:
+            tracker.acquire()
+        for attempt in range(max_retries):
+            try:
+                print(f"    Intento {attempt + 1}/{max_retries} (lote de {len(base64_images)})...")
+                response = self._post("/api/chat", body, timeout=self.request_timeout * len(base64_images))
+                if response.status_code == 200:
+                    data = response.json()
+                    usage = ollama_usage(data)
+                    self.prefix_stats.record(usage)
+                    if tracker is not None:
+                        tracker.record(self.model_name, usage["prompt_tokens"], usage["completion_tokens"],
+                                       usage["prompt_eval_duration_s"] + usage["eval_duration_s"])
+                    answers = parse_indexed_answers(data["message"]["content"], len(base64_images))
+                    if answers is None:
+                        print(f"    ⚠️ La respuesta no trae {len(base64_images)} respuestas numeradas")
+                    return answers, usage
+                else:
+                    print(f"    ❌ Error HTTP {response.status_code}: {response.text}")
+            except DeadlineExpired:
+                if tracker is not None:
+                    tracker.release()
+                raise
+            except Exception as e:
+                print(f"    ❌ Error en intento {attempt + 1}: {str(e)}")
+                if attempt == max_retries - 1:
+                    break
+                time.sleep(2 ** attempt)
+        
+        if tracker is not None:
+            tracker.release()
+        return None, None
+    
+    def _build_request(self, model: str, prompt: str, images: List[Union[str, bytes, memoryview]],
+                       batch: bool = False) -> Tuple[str, bytes]:
+        """
+        Endpoint y cuerpo de un request de clasificación, con las opciones de self.options
+        
+        Con prefix_reuse el prompt va como mensaje de sistema de /api/chat, antes de
+        las imágenes, para que todos los requests compartan el mismo prefijo.
+        """
+        if self.prefix_reuse:
+            instruction = BATCH_INSTRUCTIONS.format(count=len(images)).strip() if batch else PREFIX_USER_MESSAGE
+            endpoint = "/api/chat"
+            payload = {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": instruction, "images": list(images)}
+                ],
+                "stream": False
+            }
+        elif batch:
+            endpoint = "/api/chat"
+            payload = {
+                "model": model,
+                "messages": [{
+                    "role": "user",
+                    "content": build_batch_prompt(prompt, len(images)),
+                    "images": list(images)
+                }],
+                "stream": False
+            }
+        else:
+            endpoint = "/api/generate"
+            payload = {
+                "model": model,
+                "prompt": prompt,
+                "images": list(images),
+                "stream": False
+            }
+        return endpoint, encode_json_payload(self.options.apply(payload))
+    
+    def classify_image_cascade(self, base64_image: Union[str, bytes, memoryview],
+                               prompt: str) -> Tuple[Optional[str], Optional[Dict], Dict]:
+        """
+        Clasifica con el modelo barato de self.cascade y escala a self.model_name si no es confiable
+        
+        Returns:
+            Tupla (respuesta, uso del nivel que respondió, detalle de la cascada)
+        """
+        cascade = self.cascade
+        cheap = [self.classify_image_detailed(base64_image, prompt, model=cascade.cheap_model)
+                 for _ in range(cascade.samples)]
+        answers = [answer for answer, _ in cheap]
+        reason = cascade.image_escalation(answers, self.result_parser)
+        audited = reason is None and cascade.should_audit()
+        info = {"cheap_model": cascade.cheap_model, "cheap_answers": answers, "escalation_reason": reason}
+        
+        cheap_answer = aggregate_text_answers(answers) if reason is None else None
+        if reason is None and not audited:
+            cascade.stats.record(None)
+            info["tier"] = "cheap"
+            return cheap_answer, cheap[0][1], info
+        
+        print(f"    🪜 Escalando a {self.model_name}" + (f" ({reason})" if reason else " (auditoría)"))
+        response, usage = self.classify_image_detailed(base64_image, prompt)
+        agreed = None
+        if response and answers[0]:
+            agreed = answers_agree([cheap_answer or answers[0], response], cascade.tolerance)
+        cascade.stats.record(reason, audited, agreed)
+        if audited:
+            # En la auditoría se conserva la respuesta barata; la cara solo se compara
+            info["tier"] = "cheap"
+            info["audit_answer"] = response
+            return cheap_answer, cheap[0][1], info
+        info["tier"] = "expensive"
+        return response, usage, info
+    
+    def _post(self, endpoint: str, body: bytes, timeout: float) -> requests.Response:
+        """
+        Envía un request JSON a Ollama, pasando por el limitador de concurrencia si hay uno
+        
+        El limitador recibe la latencia de cada respuesta y se entera de los timeouts y
+        de la saturación del servidor (OVERLOAD_STATUSES o conexión rechazada).
+        """
+        body, headers = self.transport.encode_body(body)
+        with self.scheduler.slot() if self.scheduler is not None else nullcontext():
+            return self._send(endpoint, body, headers, timeout)
+    
+    def _send(self, endpoint: str, body: bytes, headers: Dict[str, str], timeout: float) -> requests.Response:
+        limiter = self.concurrency_limiter
+        if limiter is not None:
+            limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{self.ollama_url}{endpoint}",
+                data=body,
+                headers=headers,
+                timeout=self.transport.timeouts(timeout)
+            )
+        except requests.exceptions.Timeout:
+            if limiter is not None:
+                limiter.release(timed_out=True)
+            raise
+        except requests.exceptions.ConnectionError:
+            if limiter is not None:
+                limiter.release(overloaded=True)
+            raise
+        except Exception:
+            if limiter is not None:
+                limiter.release(failed=True)
+            raise
+        if limiter is not None:
+            if response.status_code in OVERLOAD_STATUSES:
+                limiter.release(overloaded=True)
+            else:
+                limiter.release(time.perf_counter() - start, failed=response.status_code != 200)
+        return response
+    
+    def get_metrics(self) -> Dict:
+        """Métricas de ejecución del clasificador"""
+        metrics = {"model": self.model_name}
+        if self.concurrency_limiter is not None:
+            metrics["concurrency"] = self.concurrency_limiter.metrics()
+        if self.usage_tracker is not None:
+            metrics["usage"] = self.usage_tracker.summary()
+        if self.cascade is not None:
+            metrics["cascade"] = self.cascade.stats.metrics()
+        if self.scheduler is not None:
+            metrics["scheduler"] = self.scheduler.metrics()
+        metrics["prompt_eval"] = self.prefix_stats.metrics()
+        return metrics
+    
+    def classify_image_consistent(self, base64_image: Union[str, bytes, memoryview], prompt: str,
+                                  k: int = 5, initial: int = 2,
+                                  score_method: str = "median",
+                                  tolerance: float = 5.0) -> Optional[str]:
+        """
+        Clasifica una imagen con auto-consistencia: varias muestras en paralelo agregadas
+        
+        Se piden primero `initial` muestras; si coinciden (todas NA, puntuaciones a
+        menos de `tolerance` puntos o el mismo texto) se devuelve sin pedir más.
+        Si no, se completan hasta k muestras.
+        
+        Args:
+            base64_image: Imagen codificada en base64
+            prompt: Prompt de clasificación
+            k: Número máximo de muestras
+            initial: Muestras de la primera ronda
+            score_method: "median" o "trimmed_mean" para puntuaciones 0-100
+            tolerance: Diferencia máxima entre puntuaciones para considerar acuerdo
+            
+        Returns:
+            Respuesta agregada ("NA", puntuación o texto más votado) o None si todas fallan
+        """
+        answers = sample_with_early_stopping(
+            lambda: self.classify_image(base64_image, prompt),
+            k=k,
+            initial=initial,
+            agree_fn=lambda samples: answers_agree(samples, tolerance)
+        )
+        print(f"    🗳️ {len(answers)} muestras: {answers}")
+        return aggregate_text_answers(answers, score_method)
     
     def process_directory(self, directory_path: Union[str, Path], 
                          prompt: str,
                          output_file: str = "classification_results.json",
-                         image_extensions: Optional[set] = None) -> List[Dict]:
+                         image_extensions: Optional[set] = None,
+                         max_workers: int = 1,
+                         parse_retries: int = 1,
+                         shard: Optional[Union[str, Tuple[int, int]]] = None,
+                         preprocess_processes: int = 0,
+                         resume: bool = False,
+                         checkpoint_every: int = 0,
+                         incremental: bool = False) -> List[Dict]:
         """
         Procesa todas las imágenes en un directorio
         
@@ -200,10 +707,459 @@ class OllamaImageClassifier:
             prompt: Prompt de clasificación a usar
             output_file: Nombre del archivo de salida JSON
             image_extensions: Extensiones de imagen a procesar (por defecto: jpg, jpeg, png, webp, bmp, gif)
+            max_workers: Imágenes procesadas en paralelo (con un limitador adaptativo
+                actúa como techo y el limitador decide cuántas van en vuelo)
+            parse_retries: Pasadas extra solo sobre las imágenes cuya respuesta no
+                se pudo parsear (requiere result_parser)
+            shard: Fragmento a procesar, "i/N" o (i, N), asignado por hash de la ruta
+                relativa (ver sharding.py); útil para repartir un corpus entre procesos o nodos
+            preprocess_processes: Si es > 1, las imágenes se decodifican y codifican en un
+                pool de procesos con ese número de procesos
+            resume: Reutilizar los resultados válidos de output_file y de su checkpoint
+                y clasificar solo las imágenes que faltan o fallaron
+            checkpoint_every: Si es > 0, cada resultado se añade a "<output_file>.partial.jsonl"
+                (volcado a disco cada N imágenes) para poder reanudar tras una interrupción
+            incremental: Reutilizar los resultados de output_file obtenidos con el mismo prompt,
+                modelo y contenido de imagen, clasificar solo las imágenes nuevas, cambiadas,
+                con otra configuración o fallidas, y escribir "<output_file>.diff.json" con las
+                etiquetas que cambiaron (ver incremental.py)
+            
+        Returns:
+            Lista de diccionarios con resultados
+        """
+        image_files = self._list_images(directory_path, image_extensions)
+        if not image_files:
+            return []
+        
+        if shard is not None:
+            index, count = parse_shard(shard) if isinstance(shard, str) else shard
+            image_files = select_shard(image_files, directory_path, index, count)
+            print(f"🧩 Fragmento {index}/{count}: {len(image_files)} imágenes")
+        
+        plan = None
+        # Con el input_stat de los registros anteriores no se vuelven a hashear las imágenes sin cambios
+        previous = self._load_previous(output_file)
+        if incremental:
+            fingerprints = {str(f): file_fingerprint(f, previous.get(str(f))) for f in image_files}
+            plan = plan_incremental(fingerprints, previous, prompt, self.model_name, self._is_failed)
+            plan.print_summary()
+            completed: Dict[str, Dict] = plan.reused
+        else:
+            # Los registros con error o sin parsear no cuentan como completados
+            completed = {path: record for path, record in previous.items()
+                         if not self._is_failed(record)} if resume else {}
+        pending_files = [f for f in image_files if str(f) not in completed]
+        marker_file = resume_marker_path(output_file)
+        if resume:
+            marker = read_resume_marker(marker_file)
+            if marker is not None:
+                print(f"📌 La ejecución anterior se interrumpió el {marker['interrupted_at']} ({marker['reason']})")
+            print(f"⏭️ Reanudando: {len(image_files) - len(pending_files)} imágenes ya clasificadas, "
+                  f"{len(pending_files)} pendientes")
+        
+        checkpoint_file = self._checkpoint_path(output_file)
+        checkpoint = open(checkpoint_file, 'a', encoding='utf-8') if checkpoint_every > 0 else None
+        written = 0
+        
+        def record_result(result: Dict):
+            nonlocal written
+            if shard is not None:
+                # Clave del reparto, independiente de dónde monte cada nodo el directorio (ver sharding.merge_results)
+                result["shard_key"] = shard_key(result["path"], directory_path)
+            if checkpoint is None:
+                return
+            checkpoint.write(json.dumps(result, ensure_ascii=False) + "\n")
+            written += 1
+            if written % checkpoint_every == 0:
+                checkpoint.flush()
+                memory_checkpoint(f"checkpoint de {written} imágenes")
+        
+        on_result = record_result if checkpoint is not None or shard is not None else None
+        try:
+            results = self._classify_files(pending_files, prompt, max_workers, preprocess_processes,
+                                           on_result=on_result, deadline=self.batch_deadline, previous=previous)
+            
+            # Las imágenes cuyo plazo venció en cola se aplazan al final, ya sin plazo
+            expired = [i for i, r in enumerate(results) if r is not None and r.get("error") == DEADLINE_ERROR]
+            if expired and self.defer_expired and not self._stopping():
+                print(f"\n⌛ Reintentando {len(expired)} imágenes aplazadas por plazo vencido")
+                deferred = self._classify_files([pending_files[i] for i in expired], prompt, max_workers,
+                                                on_result=on_result, previous=previous)
+                for i, result in zip(expired, deferred):
+                    results[i] = result or results[i]
+            
+            # Reintentar solo las respuestas que no se pudieron parsear
+            for retry in range(parse_retries if self.result_parser is not None else 0):
+                failed = [i for i, r in enumerate(results) if r is not None and r.get("parse_error")]
+                if not failed or self._stopping():
+                    break
+                print(f"\n🔁 Reintento de parseo {retry + 1}/{parse_retries}: {len(failed)} imágenes")
+                retried = self._classify_files([pending_files[i] for i in failed], prompt, max_workers,
+                                               on_result=on_result, deadline=self.batch_deadline,
+                                               previous=previous)
+                for i, result in zip(failed, retried):
+                    results[i] = result or results[i]
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        
+        new_results = {str(f): r for f, r in zip(pending_files, results) if r is not None}
+        unfinished = [str(f) for f in pending_files if str(f) not in new_results]
+        if self._stopping() and unfinished:
+            # Parada ordenada: lo clasificado queda en el checkpoint y la salida final no se toca
+            if checkpoint is None:
+                write_results(list(completed.values()) + list(new_results.values()), checkpoint_file)
+            write_resume_marker(marker_file, self.shutdown, len(completed) + len(new_results), unfinished,
+                                checkpoint_file)
+            return [completed.get(str(f)) or new_results[str(f)] for f in image_files
+                    if str(f) in completed or str(f) in new_results]
+        if completed:
+            results = [completed.get(str(f)) or new_results[str(f)] for f in image_files]
+        
+        # Guardar resultados
+        memory_checkpoint("clasificación terminada")
+        self._save_results(results, output_file)
+        if checkpoint is not None and Path(output_file).exists():
+            Path(checkpoint_file).unlink(missing_ok=True)
+        clear_resume_marker(marker_file)
+        if plan is not None:
+            changes = label_changes(plan, new_results, lambda r: r.get("parsed", r.get("classification")))
+            write_diff_report(changes, plan, f"{Path(output_file).with_suffix('')}.diff.json")
+        
+        if self.concurrency_limiter is not None:
+            metrics = self.concurrency_limiter.metrics()
+            print(f"📈 Concurrencia adaptativa: límite final {metrics['limit']} "
+                  f"(evolución {metrics['limit_history']}, timeouts {metrics['timeouts']}, "
+                  f"sobrecargas {metrics['overloads']})")
+        if self.cascade is not None:
+            self.cascade.stats.print_summary()
+        if self.scheduler is not None:
+            self.scheduler.print_summary()
+        if self.prefix_reuse:
+            self.prefix_stats.print_summary()
+        
+        return results
+    
+    def _classify_files(self, image_files: List[Path], prompt: str, max_workers: int = 1,
+                        preprocess_processes: int = 0,
+                        on_result: Optional[Callable[[Dict], None]] = None,
+                        deadline: Optional[float] = None,
+                        previous: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        Clasifica una lista de imágenes con max_workers requests en paralelo, manteniendo el orden
+        
+        La carga, la inferencia y la escritura van en etapas con colas acotadas
+        (ver shutdown.run_stages), así que la carga no se adelanta más de
+        queue_size imágenes a los requests aunque el servidor vaya lento.
+        Con images_per_request > 1 las imágenes se agrupan en lotes de un solo request.
+        `on_result` se llama desde el hilo principal con cada resultado según termina.
+        Los requests van con prioridad de lote y, si se indica `deadline`, con ese
+        plazo en segundos desde que la imagen empieza a procesarse. Si se pide la
+        parada, las imágenes no empezadas quedan como None en la lista. `previous`
+        (registros anteriores por ruta) permite reutilizar la huella de las
+        imágenes sin cambios al sellar la procedencia.
+        """
+        total = len(image_files)
+        previous = previous or {}
+        if preprocess_processes > 1:
+            items = self._iter_encoded(image_files, preprocess_processes)
+        else:
+            items = ((path, None) for path in image_files)
+        
+        # Unidades de trabajo: listas de (índice, ruta, payload) que van en un mismo request
+        group_size = self.images_per_request if self.cascade is None and self.samples <= 1 else 1
+        indexed = ((i, path, payload) for i, (path, payload) in enumerate(items))
+        units = iter(lambda: list(islice(indexed, max(1, group_size))), [])
+        
+        results: List[Optional[Dict]] = [None] * total
+        digest = prompt_hash(prompt)
+        
+        def load(unit: List[Tuple[int, Path, Optional[Union[str, bytes]]]]) -> List[Tuple]:
+            # Un payload vacío marca la imagen que no se pudo cargar
+            return [(index, path, payload if payload is not None else (self._load_payload(path) or b""))
+                    for index, path, payload in unit]
+        
+        def run(unit: List[Tuple[int, Path, Optional[Union[str, bytes]]]]) -> List[Dict]:
+            with request_class(BATCH, time.monotonic() + deadline if deadline else None):
+                if len(unit) == 1:
+                    index, path, payload = unit[0]
+                    unit_results = [self._classify_file(path, prompt, index + 1, total, payload)]
+                else:
+                    unit_results = self._classify_group(unit, prompt, total)
+            for (_, path, _), result in zip(unit, unit_results):
+                self._stamp_provenance(result, path, digest, previous.get(str(path)))
+            return unit_results
+        
+        def store(unit: List, unit_results: List[Dict]):
+            for (index, _, _), result in zip(unit, unit_results):
+                results[index] = result
+                if on_result is not None:
+                    on_result(result)
+        
+        run_stages(units, run, store, max_workers, load=load, queue_size=self.queue_size,
+                   shutdown=self.shutdown)
+        return results
+    
+    def _classify_group(self, unit: List[Tuple[int, Path, Optional[Union[str, bytes]]]], prompt: str,
+                        total: int) -> List[Dict]:
+        """
+        Clasifica un lote de imágenes en un solo request de /api/chat
+        
+        Si la respuesta no trae exactamente una respuesta por imagen, cada imagen
+        se clasifica por separado.
+        """
+        records: Dict[int, Dict] = {}
+        loaded = []
+        for index, path, payload in unit:
+            base64_img = self._load_payload(path) if payload is None else payload
+            if base64_img:
+                loaded.append((index, path, base64_img))
+            else:
+                print(f"❌ Error: No se pudo cargar la imagen {path.name}")
+                records[index] = self._error_record(path, "No se pudo cargar la imagen")
+        
+        answers, usage = None, None
+        if len(loaded) > 1 and not (self.usage_tracker is not None and self.usage_tracker.exhausted):
+            print(f"\n{'='*60}")
+            print(f"📦 LOTE DE {len(loaded)} IMÁGENES ({loaded[0][0] + 1}-{loaded[-1][0] + 1}/{total}): "
+                  f"{', '.join(path.name for _, path, _ in loaded)}")
+            print('='*60)
+            try:
+                answers, usage = self.classify_images_batch([image for _, _, image in loaded], prompt)
+            except (BudgetExceeded, DeadlineExpired) as e:
+                print(f"⛔ {e}")
+        
+        if answers is None:
+            if len(loaded) > 1:
+                print("↩️ Clasificando las imágenes del lote por separado")
+            for index, path, base64_img in loaded:
+                records[index] = self._classify_file(path, prompt, index + 1, total, base64_img)
+        else:
+            # El uso del request se reparte entre las imágenes del lote
+            share = {key: value / len(loaded) if isinstance(value, float) else round(value / len(loaded))
+                     for key, value in usage.items()}
+            share["batch_size"] = len(loaded)
+            for (index, path, _), answer in zip(loaded, answers):
+                print(f"📊 {path.name}: {answer[:100]}")
+                records[index] = self._make_record(path, answer, share)
+        return [records[index] for index, _, _ in unit]
+    
+    def _stamp_provenance(self, result: Dict, image_path: Path, digest: str, previous: Optional[Dict] = None):
+        """
+        Añade al registro el prompt, el modelo y la huella de la imagen con que se obtuvo
+        
+        Si el registro anterior (`previous`) tiene el mismo input_stat se reutiliza su huella.
+        """
+        result["prompt_hash"] = digest
+        result["model"] = self.model_name
+        try:
+            result["input_fingerprint"] = file_fingerprint(image_path, previous)
+            result["input_stat"] = file_stat(image_path)
+        except OSError:
+            pass
+    
+    def _iter_encoded(self, image_files: List[Path], processes: int):
+        """
+        Genera (ruta, payload) codificando las imágenes en un pool de procesos
+        
+        Se mantienen como mucho processes * 4 imágenes en preparación; el payload
+        es vacío si la imagen no se pudo cargar. Las imágenes vigentes en el
+        ImageStore se sirven desde él sin pasar por el pool. Cada proceso
+        decodifica una imagen a la vez, con el tope de memoria worker_memory_bytes
+        si se indicó.
+        """
+        window = processes * 4
+        files = iter(image_files)
+        pending = deque()
+        encode_args = (self.max_image_size, self.jpeg_quality, self.image_limits)
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_preprocess_worker,
+                                 initargs=(self.worker_memory_bytes,)) as pool:
+            def prepare(path: Path):
+                stored = self.image_store.get(path) if self.image_store is not None else None
+                return stored if stored is not None else pool.submit(encode_image_file, path, *encode_args)
+            
+            for path in islice(files, window):
+                pending.append((path, prepare(path)))
+            while pending:
+                path, prepared = pending.popleft()
+                next_path = next(files, None)
+                if next_path is not None:
+                    pending.append((next_path, prepare(next_path)))
+                payload = prepared.result() if isinstance(prepared, Future) else prepared
+                yield path, payload if payload is not None else b""
+    
+    def classify_file(self, image_path: Union[str, Path], prompt: str) -> Dict:
+        """
+        Clasifica un archivo de imagen y devuelve su registro de resultado
+        (mismo formato que cada elemento de process_directory)
+        """
+        return self._classify_file(Path(image_path), prompt)
+    
+    def _classify_file(self, image_path: Path, prompt: str, position: int = 1, total: int = 1,
+                       payload: Optional[Union[str, bytes]] = None) -> Dict:
+        """
+        Carga y clasifica una imagen, devolviendo su registro de resultado
+        
+        Si se pasa `payload` (ya codificado en otro proceso) no se vuelve a cargar;
+        un payload vacío indica que la carga falló.
+        """
+        filename = image_path.name
+        # Con el presupuesto agotado no se carga ni se envía nada más
+        if self.usage_tracker is not None and self.usage_tracker.exhausted:
+            return self._error_record(image_path, "Presupuesto agotado")
+        
+        print(f"\n{'='*60}")
+        print(f"📸 PROCESANDO IMAGEN {position}/{total}: {filename}")
+        print('='*60)
+        
+        # Cargar imagen y convertir a base64
+        base64_img = self._load_payload(image_path) if payload is None else payload
+        
+        if not base64_img:
+            print(f"❌ Error: No se pudo cargar la imagen {filename}")
+            return self._error_record(image_path, "No se pudo cargar la imagen")
+        
+        print("✅ Imagen cargada exitosamente")
+        print("🔄 Clasificando imagen con modelo...")
+        print("⏳ Este proceso puede tomar varios segundos...")
+        
+        # Clasificar imagen
+        cascade_info = None
+        try:
+            if self.cascade is not None:
+                response, usage, cascade_info = self.classify_image_cascade(base64_img, prompt)
+            elif self.samples > 1:
+                response, usage = self.classify_image_consistent(base64_img, prompt, self.samples,
+                                                                 self.initial_samples), None
+            else:
+                response, usage = self.classify_image_detailed(base64_img, prompt)
+        except BudgetExceeded as e:
+            print(f"⛔ {e}")
+            return self._error_record(image_path, "Presupuesto agotado")
+        except DeadlineExpired as e:
+            print(f"⌛ {e}")
+            return self._error_record(image_path, DEADLINE_ERROR)
+        
+        if response:
+            print(f"\n📊 RESULTADO:")
+            print(f"{response[:200]}..." if len(response) > 200 else response)
+        else:
+            print(f"\n❌ No se pudo obtener respuesta del modelo")
+        
+        # Crear resultado
+        result = self._make_record(image_path, response, usage)
+        if cascade_info is not None:
+            result["cascade"] = cascade_info
+        return result
+    
+    def _make_record(self, image_path: Path, response: Optional[str], usage: Optional[Dict] = None) -> Dict:
+        """Registro de resultado de una imagen clasificada (con los campos parseados si hay parser)"""
+        result = {
+            "file": image_path.name,
+            "path": str(image_path),
+            "classification": response if response else "ERROR",
+            "error": None if response else "No se pudo obtener respuesta del modelo",
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if usage is not None:
+            result["usage"] = usage
+        if response and self.result_parser is not None:
+            parsed = self.result_parser.parse(response)
+            if not parsed.ok:
+                print(f"⚠️ No se pudo parsear la respuesta de {image_path.name}: {parsed.error}")
+            result.update(parsed.to_record())
+        return result
+    
+    @staticmethod
+    def _error_record(image_path: Path, error: str) -> Dict:
+        """Registro de resultado de una imagen que no se pudo clasificar"""
+        return {
+            "file": image_path.name,
+            "path": str(image_path),
+            "classification": "ERROR",
+            "error": error,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+    
+    def process_directory_multi(self, directory_path: Union[str, Path],
+                                prompts: Dict[str, str],
+                                output_file: str = "multi_prompt_results.json",
+                                image_extensions: Optional[set] = None,
+                                max_workers: Optional[int] = None) -> List[Dict]:
+        """
+        Procesa un directorio con varios prompts, cargando cada imagen una sola vez
+        
+        Cada imagen se carga y codifica una vez y los requests de todos los prompts
+        se envían en paralelo. Se genera un registro por imagen con una columna
+        "classification_<nombre>" por prompt (y "usage_<nombre>" con sus tokens).
+        
+        Args:
+            directory_path: Ruta al directorio con imágenes
+            prompts: Diccionario {nombre: prompt}
+            output_file: Nombre del archivo de salida JSON
+            image_extensions: Extensiones de imagen a procesar
+            max_workers: Requests simultáneos por imagen (por defecto, uno por prompt)
             
         Returns:
             Lista de diccionarios con resultados
         """
+        if not prompts:
+            raise ValueError("Se necesita al menos un prompt")
+        
+        image_files = self._list_images(directory_path, image_extensions)
+        if not image_files:
+            return []
+        
+        names = list(prompts)
+        print(f"📝 Prompts: {names}")
+        results = []
+        
+        with ThreadPoolExecutor(max_workers=max_workers or len(names)) as executor:
+            for i, image_path in enumerate(image_files, 1):
+                filename = image_path.name
+                print(f"\n{'='*60}")
+                print(f"📸 PROCESANDO IMAGEN {i}/{len(image_files)}: {filename}")
+                print('='*60)
+                
+                result = {"file": filename, "path": str(image_path)}
+                base64_img = self._load_payload(image_path)
+                
+                if not base64_img:
+                    print(f"❌ Error: No se pudo cargar la imagen {filename}")
+                    for name in names:
+                        result[f"classification_{name}"] = "ERROR"
+                    result["error"] = "No se pudo cargar la imagen"
+                    result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                    results.append(result)
+                    continue
+                
+                def classify(name: str) -> Tuple[Optional[str], Optional[Dict]]:
+                    try:
+                        return self.classify_image_detailed(base64_img, prompts[name])
+                    except (BudgetExceeded, DeadlineExpired):
+                        return None, None
+                
+                # Enviar todos los prompts en paralelo sobre la misma imagen codificada
+                responses = executor.map(classify, names)
+                failed = []
+                for name, (response, usage) in zip(names, responses):
+                    result[f"classification_{name}"] = response if response else "ERROR"
+                    if usage is not None:
+                        result[f"usage_{name}"] = usage
+                    if not response:
+                        failed.append(name)
+                    print(f"📊 {name}: {response[:100] if response else 'ERROR'}")
+                
+                result["error"] = f"Sin respuesta para: {', '.join(failed)}" if failed else None
+                result["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                results.append(result)
+        
+        self._save_results(results, output_file)
+        return results
+    
+    def _list_images(self, directory_path: Union[str, Path],
+                     image_extensions: Optional[set] = None) -> List[Path]:
+        """Devuelve las imágenes de un directorio (lista vacía si no hay o no existe)"""
         if image_extensions is None:
             image_extensions = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
         
@@ -225,64 +1181,82 @@ class OllamaImageClassifier:
         
         print(f"🔄 Se encontraron {len(image_files)} imágenes para procesar")
         print(f"Archivos: {[f.name for f in image_files]}")
+        return image_files
+    
+    def retry_failures(self, results_file: Union[str, Path], prompt: str,
+                       output_file: Optional[str] = None,
+                       max_workers: int = 1) -> List[Dict]:
+        """
+        Reclasifica solo las imágenes fallidas o no parseables de un archivo de resultados
         
-        results = []
+        Selecciona los registros con "classification": "ERROR" o con parse_error y
+        los vuelve a clasificar con la configuración actual (concurrencia, reintentos,
+        parser), sustituyéndolos en su posición. Si hay result_parser, los registros
+        con respuesta pero sin campos parseados se parsean primero en local y solo los
+        que fallan vuelven al modelo.
         
-        # Procesar cada imagen
-        for i, image_path in enumerate(image_files, 1):
-            filename = image_path.name
-            print(f"\n{'='*60}")
-            print(f"📸 PROCESANDO IMAGEN {i}/{len(image_files)}: {filename}")
-            print('='*60)
-            
-            # Cargar imagen y convertir a base64
-            base64_img = self.load_local_image_as_base64(image_path)
-            
-            if not base64_img:
-                print(f"❌ Error: No se pudo cargar la imagen {filename}")
-                result = {
-                    "file": filename,
-                    "path": str(image_path),
-                    "classification": "ERROR",
-                    "error": "No se pudo cargar la imagen",
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                }
-                results.append(result)
-                continue
-            
-            print("✅ Imagen cargada exitosamente")
-            print("🔄 Clasificando imagen con modelo...")
-            print("⏳ Este proceso puede tomar varios segundos...")
-            
-            # Clasificar imagen
-            response = self.classify_image(base64_img, prompt)
-            
-            if response:
-                print(f"\n📊 RESULTADO:")
-                print(f"{response[:200]}..." if len(response) > 200 else response)
-            else:
-                print(f"\n❌ No se pudo obtener respuesta del modelo")
+        Args:
+            results_file: Archivo JSON generado por process_directory
+            prompt: Prompt de clasificación
+            output_file: Archivo de salida (por defecto se sobrescribe results_file)
+            max_workers: Imágenes procesadas en paralelo
             
-            # Crear resultado
-            result = {
-                "file": filename,
-                "path": str(image_path),
-                "classification": response if response else "ERROR",
-                "error": None if response else "No se pudo obtener respuesta del modelo",
-                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            results.append(result)
+        Returns:
+            Lista completa de resultados con los fallos reintentados
+        """
+        results = self._load_results(results_file)
         
-        # Guardar resultados
-        self._save_results(results, output_file)
+        if self.result_parser is not None:
+            for result in results:
+                if result.get("classification") != "ERROR" and "parse_error" not in result:
+                    result.update(self.result_parser.parse(result["classification"]).to_record())
+        
+        failed = [i for i, r in enumerate(results)
+                  if r.get("classification") == "ERROR" or r.get("parse_error")]
+        print(f"🔁 {len(failed)} de {len(results)} registros para reintentar en '{results_file}'")
         
+        if failed:
+            retried = self._classify_files([Path(results[i]["path"]) for i in failed], prompt, max_workers)
+            retried = [result or results[i] for i, result in zip(failed, retried)]
+            for i, result in zip(failed, retried):
+                results[i] = result
+            still_failed = sum(1 for r in retried if r.get("classification") == "ERROR" or r.get("parse_error"))
+            print(f"✅ Recuperados: {len(failed) - still_failed} | Siguen fallando: {still_failed}")
+        
+        self._save_results(results, output_file or str(results_file))
         return results
     
+    @staticmethod
+    def _checkpoint_path(output_file: Union[str, Path]) -> str:
+        """Archivo JSONL donde se van añadiendo los resultados de una ejecución en curso"""
+        return f"{output_file}.partial.jsonl"
+    
+    def _stopping(self) -> bool:
+        """True si se pidió una parada ordenada (Ctrl-C o SIGTERM)"""
+        return self.shutdown is not None and self.shutdown.requested
+    
+    @staticmethod
+    def _is_failed(record: Dict) -> bool:
+        """Registro con error o cuya respuesta no se pudo parsear"""
+        return record.get("classification") == "ERROR" or bool(record.get("parse_error"))
+    
+    def _load_previous(self, output_file: Union[str, Path]) -> Dict[str, Dict]:
+        """Registros de ejecuciones anteriores (output_file y su checkpoint, gana el más reciente), por ruta"""
+        records: Dict[str, Dict] = {}
+        for source in (Path(output_file), Path(self._checkpoint_path(output_file))):
+            if source.exists():
+                for record in read_results(source):
+                    records[record["path"]] = record
+        return records
+    
+    def _load_results(self, results_file: Union[str, Path]) -> List[Dict]:
+        """Carga un archivo de resultados JSON o JSONL"""
+        return read_results(results_file)
+    
     def _save_results(self, results: List[Dict], output_file: str):
-        """Guarda los resultados en un archivo JSON"""
+        """Guarda los resultados en un archivo JSON (o JSONL si la extensión es .jsonl)"""
         try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=4)
+            write_results(results, output_file)
             print(f"\n💾 Resultados guardados en '{output_file}'")
         except Exception as e:
             print(f"\n❌ Error guardando resultados: {str(e)}")
@@ -320,8 +1294,9 @@ class OllamaImageClassifier:
         print("✅ Imagen cargada exitosamente")
         print("🔄 Clasificando imagen...")
         
-        # Clasificar
-        response = self.classify_image(base64_img, prompt)
+        # Clasificar (consulta interactiva: con scheduler pasa delante de los requests del lote)
+        with request_class(INTERACTIVE):
+            response = self.classify_image(base64_img, prompt)
         
         if response:
             print(f"\n📊 RESULTADO:")
@@ -358,29 +1333,182 @@ def create_example_prompt() -> str:
     If the waist of the person is not clearly visible, return "NA"."""
 
 
-def main():
-    """Función principal de ejemplo"""
-    print("="*70)
-    print("CLASIFICADOR DE IMÁGENES CON OLLAMA")
-    print("="*70)
+def add_classifier_arguments(parser: argparse.ArgumentParser):
+    """
+    Opciones del modelo y del envío de imágenes, con sus variables OLLAMA_*
+
+    Las comparten todos los puntos de entrada que crean un clasificador
+    (este script, queue_service.py serve y sharding.py run); ver classifier_from_args.
+    """
+    parser.add_argument("--model", default=env_default("OLLAMA_MODEL", DEFAULT_MODEL),
+                        help="Modelo de Ollama [OLLAMA_MODEL]")
+    parser.add_argument("--url", default=env_default("OLLAMA_URL", DEFAULT_OLLAMA_URL),
+                        help="URL del servidor Ollama [OLLAMA_URL]")
+    parser.add_argument("--timeout", type=float, default=env_default("OLLAMA_TIMEOUT", 120.0, float),
+                        help="Segundos máximos por request [OLLAMA_TIMEOUT]")
+    parser.add_argument("--retries", type=int, default=env_default("OLLAMA_RETRIES", 3, int),
+                        help="Intentos por imagen [OLLAMA_RETRIES]")
+    parser.add_argument("--max-image-size", type=int, default=env_default("OLLAMA_MAX_IMAGE_SIZE", None, int),
+                        help="Lado máximo en píxeles de las imágenes enviadas [OLLAMA_MAX_IMAGE_SIZE]")
+    parser.add_argument("--jpeg-quality", type=int,
+                        default=env_default("OLLAMA_JPEG_QUALITY", DEFAULT_JPEG_QUALITY, int),
+                        help="Calidad JPEG de las imágenes enviadas [OLLAMA_JPEG_QUALITY]")
+
+
+def classifier_from_args(args: argparse.Namespace, **kwargs) -> OllamaImageClassifier:
+    """OllamaImageClassifier con las opciones de add_classifier_arguments (y el resto en kwargs)"""
+    return OllamaImageClassifier(model_name=args.model, ollama_url=args.url, max_image_size=args.max_image_size,
+                                 jpeg_quality=args.jpeg_quality, request_timeout=args.timeout,
+                                 max_retries=args.retries, **kwargs)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Opciones de línea de comandos; cada una puede fijarse también por variable de entorno"""
+    parser = argparse.ArgumentParser(
+        description="Clasifica las imágenes de un directorio con un modelo de visión de Ollama",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("directory", nargs="?", default=env_default("OLLAMA_IMAGE_DIR"),
+                        help="Directorio con imágenes [OLLAMA_IMAGE_DIR]; sin él se pregunta de forma interactiva")
+    parser.add_argument("--prompt-file", default=env_default("OLLAMA_PROMPT_FILE", "prompt_capital-erotico.txt"),
+                        help="Archivo con el prompt [OLLAMA_PROMPT_FILE]")
+    add_classifier_arguments(parser)
+    parser.add_argument("-o", "--output", default=env_default("OLLAMA_OUTPUT", "image_classification_results.json"),
+                        help="Archivo de resultados [OLLAMA_OUTPUT]")
+    parser.add_argument("--format", choices=["json", "jsonl"], default=env_default("OLLAMA_OUTPUT_FORMAT"),
+                        help="Formato de salida; por defecto según la extensión de --output [OLLAMA_OUTPUT_FORMAT]")
     
-    # Crear clasificador
-    classifier = OllamaImageClassifier()
+    throughput = parser.add_argument_group("rendimiento")
+    throughput.add_argument("--workers", type=int, default=env_default("OLLAMA_WORKERS", 1, int),
+                            help="Requests en paralelo (techo si se usa --adaptive) [OLLAMA_WORKERS]")
+    throughput.add_argument("--adaptive", action="store_true", default=env_default("OLLAMA_ADAPTIVE", False, parse_flag),
+                            help="Ajustar la concurrencia según la latencia observada [OLLAMA_ADAPTIVE]")
+    throughput.add_argument("--processes", type=int, default=env_default("OLLAMA_PROCESSES", 0, int),
+                            help="Procesos para decodificar/codificar imágenes, 0 = hilo principal [OLLAMA_PROCESSES]")
+    throughput.add_argument("--max-pixels", type=int, default=env_default("OLLAMA_MAX_PIXELS", DEFAULT_MAX_PIXELS, int),
+                            help="Presupuesto de píxeles por imagen; los JPEG mayores se decodifican reducidos "
+                                 "y el resto se rechaza [OLLAMA_MAX_PIXELS]")
+    throughput.add_argument("--max-download-mb", type=float,
+                            default=env_default("OLLAMA_MAX_DOWNLOAD_MB", DEFAULT_MAX_DOWNLOAD_BYTES / 2**20, float),
+                            help="Tamaño máximo de una imagen descargada por URL [OLLAMA_MAX_DOWNLOAD_MB]")
+    throughput.add_argument("--decode-memory-mb", type=int, default=env_default("OLLAMA_DECODE_MEMORY_MB", None, int),
+                            help="Memoria máxima de las decodificaciones simultáneas de los workers "
+                                 "[OLLAMA_DECODE_MEMORY_MB]")
+    throughput.add_argument("--worker-memory-mb", type=int, default=env_default("OLLAMA_WORKER_MEMORY_MB", None, int),
+                            help="Tope de memoria de cada proceso de --processes (RLIMIT_AS, solo Unix) "
+                                 "[OLLAMA_WORKER_MEMORY_MB]")
+    throughput.add_argument("--images-per-request", type=int,
+                            default=env_default("OLLAMA_IMAGES_PER_REQUEST", 1, int),
+                            help="Imágenes por request de /api/chat con respuestas numeradas; "
+                                 "conviene con imágenes pequeñas [OLLAMA_IMAGES_PER_REQUEST]")
+    throughput.add_argument("--pool-size", type=int, default=env_default("OLLAMA_POOL_SIZE", None, int),
+                            help="Conexiones keep-alive con Ollama; por defecto tantas como --workers "
+                                 "[OLLAMA_POOL_SIZE]")
+    throughput.add_argument("--connect-timeout", type=float,
+                            default=env_default("OLLAMA_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT, float),
+                            help="Segundos máximos para establecer cada conexión [OLLAMA_CONNECT_TIMEOUT]")
+    throughput.add_argument("--gzip-requests", action="store_true",
+                            default=env_default("OLLAMA_GZIP_REQUESTS", False, parse_flag),
+                            help="Comprimir los cuerpos grandes; solo si el servidor o un proxy delante "
+                                 "acepta Content-Encoding: gzip [OLLAMA_GZIP_REQUESTS]")
+    throughput.add_argument("--cache-dir", default=env_default("OLLAMA_CACHE_DIR"),
+                            help="Directorio de un ImageStore con las imágenes ya codificadas [OLLAMA_CACHE_DIR]")
     
-    # Verificar conexión
-    if not classifier.check_connection():
-        print("\n❌ No se puede continuar sin conexión con Ollama")
-        print("\n💡 Para iniciar Ollama:")
-        print("   1. En una terminal: ollama serve")
-        print(f"   2. Instalar el modelo: ollama pull {DEFAULT_MODEL}")
-        return
+    run = parser.add_argument_group("ejecución")
+    run.add_argument("--parser", choices=["score", "na_score", "json"], default=env_default("OLLAMA_PARSER"),
+                     help="Parsear cada respuesta en campos tipados [OLLAMA_PARSER]")
+    run.add_argument("--parse-retries", type=int, default=env_default("OLLAMA_PARSE_RETRIES", 1, int),
+                     help="Pasadas extra sobre las respuestas no parseables [OLLAMA_PARSE_RETRIES]")
+    run.add_argument("--shard", default=env_default("OLLAMA_SHARD"),
+                     help="Procesar solo el fragmento i/N del directorio [OLLAMA_SHARD]")
+    run.add_argument("--checkpoint-every", type=int, default=env_default("OLLAMA_CHECKPOINT_EVERY", 0, int),
+                     help="Guardar un checkpoint cada N imágenes, 0 = desactivado [OLLAMA_CHECKPOINT_EVERY]")
+    run.add_argument("--resume", action="store_true", default=env_default("OLLAMA_RESUME", False, parse_flag),
+                     help="Saltar las imágenes ya clasificadas en --output o su checkpoint [OLLAMA_RESUME]")
+    run.add_argument("--incremental", action="store_true",
+                     default=env_default("OLLAMA_INCREMENTAL", False, parse_flag),
+                     help="Reclasificar solo las imágenes nuevas, cambiadas, fallidas o clasificadas con otro "
+                          "prompt/modelo en --output, con informe de cambios [OLLAMA_INCREMENTAL]")
+    run.add_argument("--retry-failures", action="store_true",
+                     help="Reintentar solo los registros fallidos de --output en lugar de procesar el directorio")
+    run.add_argument("--skip-check", action="store_true",
+                     help="No verificar la conexión ni el modelo antes de empezar")
     
-    # Ejemplo de uso: procesar un directorio
-    print("\n" + "="*70)
-    print("EJEMPLO: Procesar directorio de imágenes")
-    print("="*70)
+    scheduling = parser.add_argument_group("prioridades")
+    scheduling.add_argument("--max-in-flight", type=int, default=env_default("OLLAMA_MAX_IN_FLIGHT", None, int),
+                            help="Requests en vuelo del planificador; por defecto --workers [OLLAMA_MAX_IN_FLIGHT]")
+    scheduling.add_argument("--reserved-slots", type=int, default=env_default("OLLAMA_RESERVED_SLOTS", 0, int),
+                            help="Huecos que el lote deja libres para consultas interactivas del mismo "
+                                 "proceso [OLLAMA_RESERVED_SLOTS]")
+    scheduling.add_argument("--batch-deadline", type=float, default=env_default("OLLAMA_BATCH_DEADLINE", None, float),
+                            help="Segundos máximos en cola por imagen; las que lo superan se aplazan "
+                                 "[OLLAMA_BATCH_DEADLINE]")
+    scheduling.add_argument("--drop-expired", action="store_true",
+                            default=env_default("OLLAMA_DROP_EXPIRED", False, parse_flag),
+                            help="Dejar con error 'Plazo vencido' las imágenes fuera de plazo en lugar de "
+                                 "reintentarlas al final [OLLAMA_DROP_EXPIRED]")
+    
+    inference = parser.add_argument_group("inferencia")
+    inference.add_argument("--num-ctx", type=int, default=env_default("OLLAMA_NUM_CTX", None, int),
+                           help="Tokens de contexto del modelo; por defecto el del servidor [OLLAMA_NUM_CTX]")
+    inference.add_argument("--num-predict", type=int, default=env_default("OLLAMA_NUM_PREDICT", None, int),
+                           help="Tokens máximos de cada respuesta [OLLAMA_NUM_PREDICT]")
+    inference.add_argument("--temperature", type=float, default=env_default("OLLAMA_TEMPERATURE", None, float),
+                           help="Temperatura de muestreo [OLLAMA_TEMPERATURE]")
+    inference.add_argument("--num-thread", type=int, default=env_default("OLLAMA_NUM_THREAD", None, int),
+                           help="Hilos de CPU del servidor para cada request [OLLAMA_NUM_THREAD]")
+    inference.add_argument("--keep-alive", default=env_default("OLLAMA_KEEP_ALIVE"),
+                           help="Tiempo que el modelo sigue cargado tras el último request (\"30m\", segundos, "
+                                "-1 = siempre) [OLLAMA_KEEP_ALIVE]")
+    inference.add_argument("--prefix-reuse", action="store_true",
+                           default=env_default("OLLAMA_PREFIX_REUSE", False, parse_flag),
+                           help="Enviar el prompt como mensaje de sistema fijo para que Ollama reutilice su "
+                                "evaluación entre requests [OLLAMA_PREFIX_REUSE]")
     
-    # Pedir ruta del directorio
+    consistency = parser.add_argument_group("auto-consistencia")
+    consistency.add_argument("--samples", type=int, default=env_default("OLLAMA_SAMPLES", 1, int),
+                             help="Muestras por imagen agregadas con mediana o voto; 1 para una sola "
+                                  "respuesta (conviene --temperature > 0) [OLLAMA_SAMPLES]")
+    consistency.add_argument("--initial-samples", type=int, default=env_default("OLLAMA_INITIAL_SAMPLES", 2, int),
+                             help="Muestras de la primera ronda; si coinciden no se piden más "
+                                  "[OLLAMA_INITIAL_SAMPLES]")
+    
+    cascade = parser.add_argument_group("cascada")
+    cascade.add_argument("--cascade-model", default=env_default("OLLAMA_CASCADE_MODEL"),
+                         help="Modelo barato que clasifica primero; --model solo recibe los ítems dudosos "
+                              "[OLLAMA_CASCADE_MODEL]")
+    cascade.add_argument("--cascade-samples", type=int, default=env_default("OLLAMA_CASCADE_SAMPLES", 1, int),
+                         help="Muestras del modelo barato; con 2 se escala si no coinciden [OLLAMA_CASCADE_SAMPLES]")
+    cascade.add_argument("--cascade-keep-na", action="store_true",
+                         default=env_default("OLLAMA_CASCADE_KEEP_NA", False, parse_flag),
+                         help="Aceptar \"NA\" del modelo barato sin escalar [OLLAMA_CASCADE_KEEP_NA]")
+    cascade.add_argument("--cascade-audit-rate", type=float,
+                         default=env_default("OLLAMA_CASCADE_AUDIT_RATE", 0.0, float),
+                         help="Fracción de ítems confiables que también se comparan con --model "
+                              "[OLLAMA_CASCADE_AUDIT_RATE]")
+    add_budget_arguments(parser, "OLLAMA")
+    add_replay_arguments(parser, "OLLAMA")
+    add_profile_arguments(parser, "OLLAMA")
+    add_shutdown_arguments(parser, "OLLAMA")
+    return parser
+
+
+def load_prompt_file(prompt_file: Union[str, Path]) -> str:
+    """Lee el prompt de un archivo, con create_example_prompt como respaldo"""
+    prompt_path = Path(prompt_file)
+    if prompt_path.exists():
+        try:
+            prompt = prompt_path.read_text(encoding='utf-8')
+            print(f"✅ Usando prompt de archivo: {prompt_path}")
+            return prompt
+        except Exception as e:
+            print(f"⚠️ No se pudo leer {prompt_path}: {e}. Usando prompt por defecto.")
+            return create_example_prompt()
+    print(f"⚠️ No se encontró '{prompt_path}'. Usando prompt por defecto.")
+    return create_example_prompt()
+
+
+def ask_directory() -> Optional[str]:
+    """Pide el directorio de imágenes por consola (modo interactivo)"""
     directory = input("\nIngresa la ruta del directorio con imágenes (o presiona Enter para usar 'images_test'): ").strip()
     if not directory:
         directory = "images_test"
@@ -393,27 +1521,135 @@ def main():
             Path(directory).mkdir(parents=True, exist_ok=True)
             print(f"✅ Directorio '{directory}' creado.")
             print(f"💡 Coloca imágenes en este directorio y ejecuta el script nuevamente.")
-        return
+        return None
+    return directory
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Punto de entrada de línea de comandos
     
-    # Usar prompt del repositorio si existe (fallback a create_example_prompt)
-    prompt_path = Path("prompt_capital-erotico.txt")
-    if prompt_path.exists():
-        try:
-            prompt = prompt_path.read_text(encoding='utf-8')
-            print(f"✅ Usando prompt de archivo: {prompt_path}")
-        except Exception as e:
-            print(f"⚠️ No se pudo leer {prompt_path}: {e}. Usando prompt por defecto.")
-            prompt = create_example_prompt()
-    else:
-        print("⚠️ No se encontró 'prompt_capital-erotico.txt' en el repositorio. Usando prompt por defecto.")
-        prompt = create_example_prompt()
-    
-    # Procesar directorio
-    results = classifier.process_directory(
-        directory_path=directory,
-        prompt=prompt,
-        output_file="image_classification_results.json"
+    Ejemplos:
+        python classify_images_with_ollama.py images/ --workers 4 --adaptive --max-image-size 1024
+        OLLAMA_URL=http://gpu01:11434 python classify_images_with_ollama.py images/ -o out.jsonl --resume
+    
+    Returns:
+        Código de salida (0 si todo fue bien)
+    """
+    args = build_arg_parser().parse_args(argv)
+    return run_profiled(args, run, args)
+
+
+def run(args: argparse.Namespace) -> int:
+    """Ejecución completa con las opciones ya parseadas (lo que perfila --profile)"""
+    output_file = args.output
+    if args.format and not output_file.endswith(f".{args.format}"):
+        output_file = f"{Path(output_file).with_suffix('')}.{args.format}"
+    
+    print("="*70)
+    print("CLASIFICADOR DE IMÁGENES CON OLLAMA")
+    print("="*70)
+    
+    image_limits = ImageLimits(max_pixels=args.max_pixels, max_download_bytes=int(args.max_download_mb * 2**20))
+    image_store = None
+    if args.cache_dir:
+        from image_store import ImageStore
+        image_store = ImageStore(args.cache_dir, args.max_image_size, args.jpeg_quality, image_limits)
+    limiter = None
+    if args.adaptive:
+        from concurrency import AdaptiveConcurrencyLimiter
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=min(2, args.workers), max_limit=max(1, args.workers))
+    result_parser = None
+    if args.parser:
+        from result_parsers import get_parser
+        result_parser = get_parser(args.parser)
+    cascade = None
+    if args.cascade_model:
+        from cascade import Cascade
+        cascade = Cascade(args.cascade_model, samples=args.cascade_samples,
+                          escalate_na=not args.cascade_keep_na, audit_rate=args.cascade_audit_rate)
+    
+    if args.samples > 1 and cascade is not None:
+        print("⚠️ Con --cascade-model se usa --cascade-samples; --samples no se aplica")
+    
+    scheduler = None
+    if args.reserved_slots or args.batch_deadline:
+        scheduler = PriorityScheduler(args.max_in_flight or args.workers, args.reserved_slots)
+    
+    # Crear clasificador
+    classifier = classifier_from_args(
+        args,
+        image_store=image_store,
+        concurrency_limiter=limiter,
+        result_parser=result_parser,
+        usage_tracker=tracker_from_args(args, args.model),
+        cascade=cascade,
+        images_per_request=args.images_per_request,
+        image_limits=image_limits,
+        decode_memory_bytes=args.decode_memory_mb * 2**20 if args.decode_memory_mb else None,
+        worker_memory_bytes=args.worker_memory_mb * 2**20 if args.worker_memory_mb else None,
+        transport=TransportConfig(pool_size=args.pool_size or args.workers, connect_timeout=args.connect_timeout,
+                                  gzip_requests=args.gzip_requests),
+        scheduler=scheduler,
+        batch_deadline=args.batch_deadline,
+        defer_expired=not args.drop_expired,
+        options=OllamaOptions(num_ctx=args.num_ctx, num_predict=args.num_predict, temperature=args.temperature,
+                              num_thread=args.num_thread, keep_alive=parse_keep_alive(args.keep_alive)),
+        prefix_reuse=args.prefix_reuse,
+        shutdown=GracefulShutdown(args.shutdown_grace),
+        queue_size=args.queue_size or None,
+        samples=args.samples,
+        initial_samples=args.initial_samples
     )
+    archive = archive_from_args(args)
+    if archive is not None:
+        install_session(classifier.session, replay_mode(args), archive, args.replay_latency_scale)
+    
+    # Verificar conexión
+    if not args.skip_check and not classifier.check_connection():
+        print("\n❌ No se puede continuar sin conexión con Ollama")
+        print("\n💡 Para iniciar Ollama:")
+        print("   1. En una terminal: ollama serve")
+        print(f"   2. Instalar el modelo: ollama pull {args.model}")
+        return 1
+    
+    prompt = load_prompt_file(args.prompt_file)
+    
+    # Ctrl-C / SIGTERM: terminar lo que está en vuelo y guardar en lugar de morir a mitad
+    with classifier.shutdown:
+        if args.retry_failures:
+            results = classifier.retry_failures(output_file, prompt, max_workers=args.workers)
+        else:
+            directory = args.directory
+            if directory is None:
+                if not sys.stdin.isatty():
+                    print("❌ Indica el directorio de imágenes (argumento o OLLAMA_IMAGE_DIR)")
+                    return 2
+                directory = ask_directory()
+                if directory is None:
+                    return 0
+            elif not Path(directory).is_dir():
+                print(f"❌ Error: El directorio '{directory}' no existe")
+                return 2
+            
+            # Procesar directorio
+            results = classifier.process_directory(
+                directory_path=directory,
+                prompt=prompt,
+                output_file=output_file,
+                max_workers=args.workers,
+                parse_retries=args.parse_retries,
+                shard=args.shard,
+                preprocess_processes=args.processes,
+                resume=args.resume,
+                checkpoint_every=args.checkpoint_every,
+                incremental=args.incremental
+            )
+    
+    if image_store is not None:
+        image_store.close()
+    if archive is not None:
+        archive.close()
     
     # Mostrar resumen
     print("\n" + "="*70)
@@ -423,8 +1659,12 @@ def main():
     successful = sum(1 for r in results if r.get('error') is None)
     print(f"Clasificaciones exitosas: {successful}")
     print(f"Errores: {len(results) - successful}")
+    classifier.usage_tracker.print_summary()
     print("="*70)
+    if classifier.shutdown.requested:
+        return EXIT_INTERRUPTED
+    return 0 if successful == len(results) else 1
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -4,72 +4,340 @@ Script para clasificar frases usando GPT-4o-mini via API de OpenAI
 y evaluar el desempeño comparando con las etiquetas correctas (_ME)
 """
 
+import argparse
 import pandas as pd
 import json
 import time
+import math
 import os
-from typing import Dict, List, Tuple
+import sys
+from typing import Dict, List, Optional, Tuple
 from openai import OpenAI
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import numpy as np
 
+from cli_env import env_default, parse_flag
+from cascade import Cascade
+from incremental import PROVENANCE_FIELDS, label_changes, plan_incremental, prompt_hash, text_fingerprint, write_diff_report
+from label_propagation import LabelPropagator, get_encoder
+from self_consistency import majority_vote, sample_with_early_stopping
+from profiling import add_profile_arguments, checkpoint as memory_checkpoint, run_profiled
+from rule_engine import RuleEngine
+from shutdown import (EXIT_INTERRUPTED, GracefulShutdown, add_shutdown_arguments, clear_resume_marker,
+                      read_resume_marker, resume_marker_path, run_stages, write_resume_marker)
+from replay import add_replay_arguments, archive_from_args, openai_transport, replay_mode
+from transport import DEFAULT_CONNECT_TIMEOUT, TransportConfig
+from usage import BudgetExceeded, UsageTracker, add_budget_arguments, tracker_from_args
+
 # Configuración de la API
 API_KEY = os.getenv('API_KEY_OPENAI')  # Usar variable de entorno para seguridad
-if not API_KEY:
-    raise ValueError("Por favor, configura la variable de entorno API_KEY_OPENAI con tu clave de API de OpenAI")
 MODEL = 'gpt-4o-mini-2024-07-18'  # Usamos el modelo disponible más cercano
 
-# Configurar cliente OpenAI
-client = OpenAI(api_key=API_KEY)
+# Mapeo de categorías para Reference (jerarquía superior)
+REFERENCE_MAPPING = {
+    # Sin anclaje
+    "Biosocial": "Sin anclaje", "Generic": "Sin anclaje",
+    "Name": "Sin anclaje", "Gender": "Sin anclaje", "Age": "Sin anclaje",
+    "Physical Characteristics": "Sin anclaje", "Health identity": "Sin anclaje",
+    "Universal definition": "Sin anclaje", "Material partitive": "Sin anclaje",
+    "Social partitive": "Sin anclaje",
+    
+    # Anclaje  
+    "Familiar": "Anclaje", "Groupal": "Anclaje", "Active": "Anclaje", "Social": "Anclaje",
+    "Matrimonial": "Anclaje", "Partner": "Anclaje", "Nuclear family": "Anclaje",
+    "Extended family": "Anclaje", "Home": "Anclaje", "Housing": "Anclaje",
+    "Primary group": "Anclaje", "Secondary group": "Anclaje", "Generalized other": "Anclaje",
+    "Job": "Anclaje", "Work role": "Anclaje", "Unemployment": "Anclaje",
+    "Educational role": "Anclaje", "Complementary activity": "Anclaje",
+    "Social class": "Anclaje", "Local": "Anclaje", "Local identity": "Anclaje",
+    "Intermediate identity": "Anclaje", "State identity": "Anclaje",
+    "Supranational identity": "Anclaje", "Marginal identity": "Anclaje",
+    "Queer identity": "Anclaje", "Political identity": "Anclaje",
+    "Sexual Orientation": "Anclaje", "Ethnic identity": "Anclaje",
+    "Famous personalities": "Anclaje", "Religious identity": "Anclaje",
+    "Linguistic reference": "Anclaje"
+}
+
+# Mapeo de categorías para Sense (jerarquía superior)
+SENSE_MAPPING = {
+    # Consensual
+    "Physical": "Consensual", "Collective": "Consensual", "Activity": "Consensual",
+    "Property": "Consensual", "Narrative": "Consensual", "Global": "Consensual",
+    
+    # Subconsensual
+    "Attitudinal": "Subconsensual", "Self-esteem": "Subconsensual",
+    "Preference": "Subconsensual", "Beliefs": "Subconsensual",
+    "Aspirations": "Subconsensual", "Self-doubt": "Subconsensual",
+    "Nihilistic": "Subconsensual", "About others": "Subconsensual",
+    "Test evasion": "Subconsensual", "Metaphor": "Subconsensual"
+}
+
+# Configurar cliente OpenAI (None sin API key, para que las herramientas offline
+# puedan importar este módulo; require_client falla al primer uso real)
+client = OpenAI(api_key=API_KEY) if API_KEY else None
 
-def load_prompt() -> str:
+def require_client():
+    """Devuelve el cliente OpenAI configurado"""
+    if client is None:
+        raise ValueError("Por favor, configura la variable de entorno API_KEY_OPENAI con tu clave de API de OpenAI")
+    return client
+
+# Contabilidad de tokens y presupuesto (ver usage.py); main lo crea desde la línea de comandos
+usage_tracker: Optional[UsageTracker] = None
+
+def load_prompt(prompt_file: str = 'prompt_18.txt') -> str:
     """Carga el prompt desde el archivo"""
-    with open('prompt_18.txt', 'r', encoding='utf-8') as f:
+    with open(prompt_file, 'r', encoding='utf-8') as f:
         return f.read()
 
-def classify_sentence_with_gpt(sentence: str, prompt: str, max_retries: int = 3) -> Dict:
+SYSTEM_MESSAGE = "You are a multilingual identity statement classifier. Always respond with valid JSON following the specified format."
+
+def build_messages(sentence: str, prompt: str) -> List[Dict]:
     """
-    Clasifica una frase usando GPT-4o-mini
+    Construye los mensajes de chat para clasificar una frase
     """
     full_prompt = f"{prompt}\n\nClassify the following sentence:\n\"{sentence}\""
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": full_prompt}
+    ]
+
+def parse_response_text(response_text: str) -> Dict:
+    """
+    Parsea el texto devuelto por GPT como JSON (lanza json.JSONDecodeError si falla)
+    """
+    response_text = response_text.strip()
+    # Limpiar el texto si contiene markdown
+    if response_text.startswith('```json'):
+        response_text = response_text[7:]
+    if response_text.endswith('```'):
+        response_text = response_text[:-3]
+    return json.loads(response_text)
+
+def request_completion(messages: List[Dict], temperature: float, usage: Dict,
+                       model: Optional[str] = None, logprobs: bool = False):
+    """
+    Envía un request de chat pasando por el usage_tracker y acumula su uso en `usage`
     
+    Raises:
+        BudgetExceeded: si el request superaría el presupuesto
+    """
+    model = model or MODEL
+    options = {"logprobs": True} if logprobs else {}
+    if usage_tracker is not None:
+        usage_tracker.acquire()
+    try:
+        response = require_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,  # Baja temperatura para resultados más consistentes
+            max_tokens=1500,
+            **options
+        )
+    except Exception:
+        if usage_tracker is not None:
+            usage_tracker.release()
+        raise
+    
+    prompt_tokens = getattr(response.usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(response.usage, "completion_tokens", 0) or 0
+    usage["prompt_tokens"] += prompt_tokens
+    usage["completion_tokens"] += completion_tokens
+    if usage_tracker is not None:
+        usage_tracker.record(model, prompt_tokens, completion_tokens)
+    return response
+
+def response_confidence(response) -> Optional[float]:
+    """
+    Probabilidad media por token (media geométrica) de una respuesta pedida con logprobs
+    """
+    logprobs = getattr(response.choices[0], "logprobs", None)
+    tokens = getattr(logprobs, "content", None) or []
+    if not tokens:
+        return None
+    return round(math.exp(sum(token.logprob for token in tokens) / len(tokens)), 4)
+
+def classify_sentence_with_gpt(sentence: str, prompt: str, max_retries: int = 3,
+                               temperature: float = 0.1, model: Optional[str] = None,
+                               logprobs: bool = False) -> Dict:
+    """
+    Clasifica una frase usando GPT-4o-mini (u otro modelo con `model`)
+    
+    La respuesta incluye "usage" con los tokens de todos los intentos (los
+    intentos con JSON inválido también se pagan) y, con logprobs=True,
+    "confidence" con la probabilidad media por token.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    result = None
     for attempt in range(max_retries):
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": "You are a multilingual identity statement classifier. Always respond with valid JSON following the specified format."},
-                    {"role": "user", "content": full_prompt}
-                ],
-                temperature=0.1,  # Baja temperatura para resultados más consistentes
-                max_tokens=1500
-            )
+            response = request_completion(build_messages(sentence, prompt), temperature, usage,
+                                          model, logprobs)
             
             response_text = response.choices[0].message.content.strip()
             
             # Intentar parsear JSON
             try:
-                # Limpiar el texto si contiene markdown
-                if response_text.startswith('```json'):
-                    response_text = response_text[7:]
-                if response_text.endswith('```'):
-                    response_text = response_text[:-3]
-                
-                result = json.loads(response_text)
-                return result
+                result = parse_response_text(response_text)
+                if logprobs and isinstance(result, dict):
+                    result["confidence"] = response_confidence(response)
+                break
                 
             except json.JSONDecodeError:
                 print(f"Error parsing JSON on attempt {attempt + 1} for sentence: {sentence[:50]}...")
                 if attempt == max_retries - 1:
-                    return create_error_response(sentence, "JSON parsing error")
-                
+                    result = create_error_response(sentence, "JSON parsing error")
+        
+        except BudgetExceeded as e:
+            print(f"Budget exceeded, skipping sentence: {sentence[:50]}... ({e})")
+            result = create_error_response(sentence, "Presupuesto agotado")
+            break
         except Exception as e:
             print(f"API error on attempt {attempt + 1} for sentence: {sentence[:50]}... Error: {e}")
             if attempt == max_retries - 1:
-                return create_error_response(sentence, f"API error: {e}")
+                result = create_error_response(sentence, f"API error: {e}")
+                break
             time.sleep(2)  # Esperar antes de reintentar
     
-    return create_error_response(sentence, "Max retries exceeded")
+    if result is None:
+        result = create_error_response(sentence, "Max retries exceeded")
+    if isinstance(result, dict):
+        result["usage"] = usage
+    return result
+
+def samples_agree(responses: List[Dict], sentence: str) -> bool:
+    """
+    Indica si las muestras coinciden en las tres dimensiones sin ningún ERROR
+
+    Varias muestras fallidas no son un consenso: hay que seguir pidiendo muestras.
+    """
+    labels = {extract_classification(r, sentence) for r in responses}
+    return len(labels) == 1 and "ERROR" not in next(iter(labels))
+
+def classify_sentence_consistent(sentence: str, prompt: str, k: int = 5, initial: int = 2,
+                                 temperature: float = 0.7, max_retries: int = 3) -> Dict:
+    """
+    Clasifica una frase con auto-consistencia: k muestras en paralelo y voto por mayoría
+    
+    Se piden primero `initial` muestras; si coinciden en las tres dimensiones (y
+    ninguna es ERROR) no se piden más. El resultado conserva el formato de classify_sentence_with_gpt, con
+    las etiquetas votadas en la primera frase y el detalle del voto en
+    "self_consistency".
+    """
+    samples = sample_with_early_stopping(
+        lambda: classify_sentence_with_gpt(sentence, prompt, max_retries, temperature),
+        k=k,
+        initial=initial,
+        agree_fn=lambda responses: samples_agree(responses, sentence)
+    )
+    labels = [extract_classification(r, sentence) for r in samples]
+    valid = [(response, label) for response, label in zip(samples, labels) if "ERROR" not in label]
+    if not valid:
+        return samples[0]
+    
+    voted = {}
+    agreement = {}
+    for position, dimension in enumerate(("sense", "reference", "attribution")):
+        voted[dimension], agreement[dimension] = majority_vote([label[position] for _, label in valid])
+    
+    # Usar como base la muestra que más se parece al voto
+    voted_tuple = (voted["sense"], voted["reference"], voted["attribution"])
+    representative = next((r for r, label in valid if label == voted_tuple), valid[0][0])
+    result = json.loads(json.dumps(representative))
+    (result["sentences"][0] if result.get("sentences") else result).update(voted)
+    result["usage"] = {key: sum(r.get("usage", {}).get(key, 0) for r in samples)
+                       for key in ("prompt_tokens", "completion_tokens")}
+    result["self_consistency"] = {
+        "samples": len(samples),
+        "valid_samples": len(valid),
+        "agreement": agreement
+    }
+    return result
+
+def classify_sentence_cascade(sentence: str, prompt: str, cascade: Cascade,
+                              max_retries: int = 3) -> Dict:
+    """
+    Clasifica con el modelo barato de la cascada y escala a MODEL si no es confiable
+    
+    Con cascade.samples > 1 se piden varias muestras baratas (temperatura 0.7) y se
+    escala si no coinciden; con cascade.min_confidence se piden logprobs. La
+    respuesta lleva el detalle en "cascade".
+    """
+    temperature = 0.7 if cascade.samples > 1 else 0.1
+    logprobs = cascade.min_confidence is not None
+    cheap = [classify_sentence_with_gpt(sentence, prompt, max_retries, temperature,
+                                        model=cascade.cheap_model, logprobs=logprobs)
+             for _ in range(cascade.samples)]
+    labels = [extract_classification(r, sentence) for r in cheap]
+    reason = cascade.labels_escalation(labels, [r.get("confidence") for r in cheap])
+    audited = reason is None and cascade.should_audit()
+    info = {"cheap_model": cascade.cheap_model, "cheap_labels": [list(label) for label in labels],
+            "escalation_reason": reason, "tier": "cheap"}
+    
+    if reason is None and not audited:
+        cascade.stats.record(None)
+        cheap[0]["cascade"] = info
+        return cheap[0]
+    
+    expensive = classify_sentence_with_gpt(sentence, prompt, max_retries)
+    expensive_labels = extract_classification(expensive, sentence)
+    agreed = None if "ERROR" in expensive_labels else expensive_labels == labels[0]
+    cascade.stats.record(reason, audited, agreed)
+    if audited:
+        # En la auditoría se conserva la respuesta barata; la cara solo se compara
+        info["audit_labels"] = list(expensive_labels)
+        cheap[0]["cascade"] = info
+        return cheap[0]
+    info["tier"] = "expensive"
+    expensive["cascade"] = info
+    usage = expensive.setdefault("usage", {"prompt_tokens": 0, "completion_tokens": 0})
+    for response in cheap:
+        for key in ("prompt_tokens", "completion_tokens"):
+            usage[key] += response.get("usage", {}).get(key, 0)
+    return expensive
+
+def propagated_response(sentence: str, match: Dict) -> Dict:
+    """
+    Respuesta con las etiquetas de la frase vecina de label_propagation, sin llamar al modelo
+    """
+    sense, reference, attribution = match["labels"]
+    note = f"Propagada de \"{match['source']}\" (similitud {match['similarity']})"
+    return {
+        "sentences": [{
+            "text": sentence,
+            "sense": sense,
+            "reference": reference,
+            "attribution": attribution,
+            "sense_justification": note,
+            "reference_justification": note,
+            "attribution_justification": note
+        }],
+        "propagation": {"source": match["source"], "similarity": match["similarity"]},
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0}
+    }
+
+def rule_response(match: Dict) -> Dict:
+    """
+    Respuesta con las etiquetas de las reglas locales de rule_engine, sin llamar al modelo
+    """
+    sentences = []
+    for sentence in match["sentences"]:
+        sense, reference, attribution = sentence["labels"]
+        note = f"Regla local: {sentence['rule']}"
+        sentences.append({
+            "text": sentence["text"],
+            "sense": sense,
+            "reference": reference,
+            "attribution": attribution,
+            "sense_justification": note,
+            "reference_justification": note,
+            "attribution_justification": note
+        })
+    return {
+        "sentences": sentences,
+        "rules": [sentence["rule"] for sentence in match["sentences"]],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0}
+    }
 
 def create_error_response(sentence: str, error: str) -> Dict:
     """Crea una respuesta de error en el formato esperado"""
@@ -100,6 +368,12 @@ def extract_classification(gpt_response: Dict, sentence: str) -> Tuple[str, str,
     try:
         if "sentences" in gpt_response and len(gpt_response["sentences"]) > 0:
             sentence_data = gpt_response["sentences"][0]
+        elif "sense" in gpt_response:
+            # Formato de frase única: etiquetas en el nivel superior del JSON
+            sentence_data = gpt_response
+        else:
+            sentence_data = None
+        if sentence_data is not None:
             sense = sentence_data.get("sense", "ERROR")
             reference = sentence_data.get("reference", "ERROR")
             attribution = sentence_data.get("attribution", "ERROR")
@@ -126,122 +400,490 @@ def normalize_categories(category: str, dimension: str) -> str:
     
     category = str(category).strip()
     
-    # Mapeo de categorías para Reference (jerarquía superior)
     if dimension == "reference":
-        reference_mapping = {
-            # Sin anclaje
-            "Biosocial": "Sin anclaje", "Generic": "Sin anclaje",
-            "Name": "Sin anclaje", "Gender": "Sin anclaje", "Age": "Sin anclaje",
-            "Physical Characteristics": "Sin anclaje", "Health identity": "Sin anclaje",
-            "Universal definition": "Sin anclaje", "Material partitive": "Sin anclaje",
-            "Social partitive": "Sin anclaje",
-            
-            # Anclaje  
-            "Familiar": "Anclaje", "Groupal": "Anclaje", "Active": "Anclaje", "Social": "Anclaje",
-            "Matrimonial": "Anclaje", "Partner": "Anclaje", "Nuclear family": "Anclaje",
-            "Extended family": "Anclaje", "Home": "Anclaje", "Housing": "Anclaje",
-            "Primary group": "Anclaje", "Secondary group": "Anclaje", "Generalized other": "Anclaje",
-            "Job": "Anclaje", "Work role": "Anclaje", "Unemployment": "Anclaje",
-            "Educational role": "Anclaje", "Complementary activity": "Anclaje",
-            "Social class": "Anclaje", "Local": "Anclaje", "Local identity": "Anclaje",
-            "Intermediate identity": "Anclaje", "State identity": "Anclaje",
-            "Supranational identity": "Anclaje", "Marginal identity": "Anclaje",
-            "Queer identity": "Anclaje", "Political identity": "Anclaje",
-            "Sexual Orientation": "Anclaje", "Ethnic identity": "Anclaje",
-            "Famous personalities": "Anclaje", "Religious identity": "Anclaje",
-            "Linguistic reference": "Anclaje"
-        }
-        return reference_mapping.get(category, category)
-    
-    # Mapeo de categorías para Sense (jerarquía superior)
+        return REFERENCE_MAPPING.get(category, category)
     elif dimension == "sense":
-        sense_mapping = {
-            # Consensual
-            "Physical": "Consensual", "Collective": "Consensual", "Activity": "Consensual",
-            "Property": "Consensual", "Narrative": "Consensual", "Global": "Consensual",
-            
-            # Subconsensual
-            "Attitudinal": "Subconsensual", "Self-esteem": "Subconsensual",
-            "Preference": "Subconsensual", "Beliefs": "Subconsensual",
-            "Aspirations": "Subconsensual", "Self-doubt": "Subconsensual",
-            "Nihilistic": "Subconsensual", "About others": "Subconsensual",
-            "Test evasion": "Subconsensual", "Metaphor": "Subconsensual"
-        }
-        return sense_mapping.get(category, category)
+        return SENSE_MAPPING.get(category, category)
     
     return category
 
-def main():
+def prediction_fields(gpt_response: Dict, sentence: str) -> Dict:
+    """
+    Campos de predicción de una fila de resultados
+    """
+    sense_pred, reference_pred, attribution_pred = extract_classification(gpt_response, sentence)
+    usage = gpt_response.get("usage") or {}
+    return {
+        'sense_predicted': sense_pred,
+        'reference_predicted': reference_pred,
+        'attribution_predicted': attribution_pred,
+        'gpt_response': json.dumps(gpt_response),
+        'prompt_tokens': usage.get("prompt_tokens", 0),
+        'completion_tokens': usage.get("completion_tokens", 0)
+    }
+
+def build_result_row(row: pd.Series, gpt_response: Dict) -> Dict:
+    """
+    Construye la fila de resultados a partir de la fila original y la respuesta de GPT
+    """
+    sentence = row['frase']
+    
+    # Normalizar categorías verdaderas (de específicas a jerarquía superior)
+    sense_true = normalize_categories(row['sense_ME'], 'sense')
+    reference_true = normalize_categories(row['reference_ME'], 'reference') if pd.notna(row['reference_ME']) else "NA"
+    attribution_true = str(row['attribution_ME']) if pd.notna(row['attribution_ME']) else "NA"
+    
+    predicted = prediction_fields(gpt_response, sentence)
+    return {
+        'bio_num': row['bio_num'],
+        'frase_num': row['frase_num'],
+        'frase': sentence,
+        'sense_true': sense_true,
+        'sense_predicted': predicted['sense_predicted'],
+        'reference_true': reference_true,
+        'reference_predicted': predicted['reference_predicted'],
+        'attribution_true': attribution_true,
+        'attribution_predicted': predicted['attribution_predicted'],
+        'gpt_response': predicted['gpt_response'],
+        'prompt_tokens': predicted['prompt_tokens'],
+        'completion_tokens': predicted['completion_tokens']
+    }
+
+def provenance_fields(sentence: str, digest: str) -> Dict:
+    """
+    Prompt, modelo y huella de la frase con que se obtuvo una fila (ver incremental.py)
+    """
+    return {'prompt_hash': digest, 'model': MODEL, 'input_fingerprint': text_fingerprint(sentence)}
+
+# Etiquetas predichas de cada fila de resultados
+PREDICTED_COLUMNS = ('sense_predicted', 'reference_predicted', 'attribution_predicted')
+
+def is_failed_row(row: pd.Series) -> bool:
+    """
+    Indica si una fila de resultados tiene alguna dimensión en ERROR
+    """
+    return any(row[column] == "ERROR" for column in PREDICTED_COLUMNS)
+
+def label_text(value) -> str:
+    """Etiqueta predicha como texto para comparar ejecuciones; vacía o NaN cuenta como NA"""
+    if pd.isna(value) or str(value).strip() == "":
+        return "NA"
+    return str(value).strip()
+
+# Columnas que identifican una frase en la entrada y en los resultados
+KEY_COLUMNS = ('bio_num', 'frase_num')
+
+def read_results_csv(path: str) -> pd.DataFrame:
+    """
+    Lee un CSV de resultados sin convertir la etiqueta "NA" (categoría válida) en NaN
+    
+    Con los valores por defecto de pandas "NA" se lee como NaN y to_csv lo vuelve a
+    escribir como celda vacía: todo CSV de resultados que se relee y se reescribe
+    tiene que pasar por aquí. Los identificadores y la procedencia se leen como
+    texto (ver row_key).
+    """
+    return pd.read_csv(path, dtype={column: str for column in KEY_COLUMNS + PROVENANCE_FIELDS},
+                       keep_default_na=False, na_values=[])
+
+def classify_sentences(sentences: List[str], prompt: str, max_workers: int = 1,
+                       max_retries: int = 3, pause: float = 0.0,
+                       cascade: Optional[Cascade] = None,
+                       propagator: Optional[LabelPropagator] = None,
+                       rules: Optional[RuleEngine] = None,
+                       shutdown: Optional[GracefulShutdown] = None,
+                       queue_size: Optional[int] = None,
+                       samples: int = 1, initial_samples: int = 2) -> List[Optional[Dict]]:
+    """
+    Clasifica varias frases con max_workers requests en paralelo, manteniendo el orden
+    
+    `pause` son los segundos que cada worker espera tras cada frase (límites de rate).
+    Con `cascade` cada frase pasa primero por el modelo barato. Con `propagator`
+    las frases casi idénticas a otra ya clasificada reutilizan sus etiquetas. Con
+    `rules` las frases triviales se resuelven localmente antes que nada. Con
+    samples > 1 (y sin cascada) cada frase se clasifica con auto-consistencia
+    (ver classify_sentence_consistent). Las frases
+    pasan a los workers por una cola acotada (ver shutdown.run_stages); si se pide
+    la parada con `shutdown`, las que no llegaron a empezar quedan como None.
+    """
+    def classify(sentence: str) -> Dict:
+        rule_match = rules.lookup(sentence) if rules is not None else None
+        if rule_match is not None and not rule_match["audit"]:
+            rules.stats.record(rule_match, True)
+            return rule_response(rule_match)
+        match = propagator.lookup(sentence) if propagator is not None else None
+        if match is not None and not match["audit"]:
+            propagator.stats.record(True)
+            return propagated_response(sentence, match)
+        if cascade is not None:
+            result = classify_sentence_cascade(sentence, prompt, cascade, max_retries)
+        elif samples > 1:
+            result = classify_sentence_consistent(sentence, prompt, samples, initial_samples,
+                                                  max_retries=max_retries)
+        else:
+            result = classify_sentence_with_gpt(sentence, prompt, max_retries)
+        if propagator is not None:
+            propagator.stats.record(False)
+            propagator.observe(sentence, extract_classification(result, sentence), match)
+        if rules is not None:
+            rules.stats.record(rule_match, False)
+            rules.observe(rule_match, extract_classification(result, sentence))
+        if pause > 0:
+            time.sleep(pause)
+        return result
+    
+    results: List[Optional[Dict]] = [None] * len(sentences)
+    
+    def store(item: Tuple[int, str], result: Dict):
+        results[item[0]] = result
+    
+    run_stages(enumerate(sentences), lambda item: classify(item[1]), store, max_workers,
+               queue_size=queue_size, shutdown=shutdown)
+    return results
+
+def retry_failures(results_csv: str, prompt: str, output_csv: Optional[str] = None,
+                   max_workers: int = 1, max_retries: int = 3,
+                   samples: int = 1, initial_samples: int = 2) -> pd.DataFrame:
+    """
+    Reclasifica solo las filas con ERROR de un CSV de resultados y las fusiona en su sitio
+    
+    Args:
+        results_csv: CSV generado por main (gpt_classification_results.csv)
+        prompt: Prompt de clasificación
+        output_csv: CSV de salida (por defecto se sobrescribe results_csv)
+        max_workers: Frases clasificadas en paralelo
+        max_retries: Reintentos por frase
+        samples: Muestras por frase (auto-consistencia si es > 1)
+        initial_samples: Muestras de la primera ronda de la auto-consistencia
+    """
+    df_results = read_results_csv(results_csv)
+    failed = df_results.index[df_results.apply(is_failed_row, axis=1)]
+    print(f"Filas con ERROR a reintentar: {len(failed)} de {len(df_results)}")
+    
+    if len(failed) > 0:
+        sentences = df_results.loc[failed, 'frase'].tolist()
+        responses = classify_sentences(sentences, prompt, max_workers, max_retries,
+                                       samples=samples, initial_samples=initial_samples)
+        digest = prompt_hash(prompt)
+        for idx, sentence, gpt_response in zip(failed, sentences, responses):
+            fields = {**prediction_fields(gpt_response, sentence), **provenance_fields(sentence, digest)}
+            for column, value in fields.items():
+                df_results.at[idx, column] = value
+        still_failed = int(df_results.loc[failed].apply(is_failed_row, axis=1).sum())
+        print(f"Recuperadas: {len(failed) - still_failed} | Siguen con ERROR: {still_failed}")
+    
+    df_results.to_csv(output_csv or results_csv, index=False)
+    return df_results
+
+def key_part(value) -> str:
+    """Texto normalizado de un identificador: 12, "12" y 12.0 (columna leída como float) son la misma frase"""
+    text = str(value).strip()
+    if text.endswith(".0") and text[:-2].isdigit():
+        return text[:-2]
+    return text
+
+def row_key(row) -> Tuple[str, str]:
+    """Identificador de una frase (bio_num, frase_num) para reanudar ejecuciones"""
+    return key_part(row['bio_num']), key_part(row['frase_num'])
+
+def load_previous_rows(output_csv: str, checkpoint_csv: str) -> Dict[Tuple[str, str], Dict]:
+    """
+    Filas de una ejecución anterior (resultado final y checkpoint, gana el más reciente), por frase
+    """
+    previous = {}
+    for path in (output_csv, checkpoint_csv):
+        if os.path.exists(path):
+            for _, row in read_results_csv(path).iterrows():
+                previous[row_key(row)] = row.to_dict()
+    return previous
+
+def load_completed_rows(output_csv: str, checkpoint_csv: str) -> Dict[Tuple[str, str], Dict]:
+    """
+    Filas sin ERROR de una ejecución anterior (resultado final y checkpoint), por frase
+    """
+    return {key: row for key, row in load_previous_rows(output_csv, checkpoint_csv).items()
+            if not is_failed_row(row)}
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """Opciones de línea de comandos; cada una puede fijarse también por variable de entorno"""
+    parser = argparse.ArgumentParser(
+        description="Clasifica frases de identidad con la API de OpenAI",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-i", "--input", default=env_default("GPT_INPUT_CSV", "clasificacion_ME_204_simple.csv"),
+                        help="CSV con las frases y las etiquetas _ME [GPT_INPUT_CSV]")
+    parser.add_argument("--prompt-file", default=env_default("GPT_PROMPT_FILE", "prompt_18.txt"),
+                        help="Archivo con el prompt [GPT_PROMPT_FILE]")
+    parser.add_argument("--model", default=env_default("GPT_MODEL", MODEL),
+                        help="Modelo de OpenAI [GPT_MODEL]")
+    parser.add_argument("-o", "--output", default=env_default("GPT_OUTPUT", "gpt_classification_results.csv"),
+                        help="CSV de resultados [GPT_OUTPUT]")
+    
+    throughput = parser.add_argument_group("rendimiento")
+    throughput.add_argument("--workers", type=int, default=env_default("GPT_WORKERS", 1, int),
+                            help="Frases clasificadas en paralelo [GPT_WORKERS]")
+    throughput.add_argument("--pause", type=float, default=env_default("GPT_PAUSE", 0.5, float),
+                            help="Segundos de pausa de cada worker tras cada frase [GPT_PAUSE]")
+    throughput.add_argument("--timeout", type=float, default=env_default("GPT_TIMEOUT", None, float),
+                            help="Segundos máximos esperando cada respuesta; por defecto el del cliente OpenAI "
+                                 "[GPT_TIMEOUT]")
+    throughput.add_argument("--connect-timeout", type=float,
+                            default=env_default("GPT_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT, float),
+                            help="Segundos máximos para establecer cada conexión [GPT_CONNECT_TIMEOUT]")
+    throughput.add_argument("--pool-size", type=int, default=env_default("GPT_POOL_SIZE", None, int),
+                            help="Conexiones reutilizables; por defecto tantas como --workers [GPT_POOL_SIZE]")
+    throughput.add_argument("--http2", action="store_true", default=env_default("GPT_HTTP2", False, parse_flag),
+                            help="Multiplexar los requests en HTTP/2 (requiere httpx[http2]) [GPT_HTTP2]")
+    throughput.add_argument("--retries", type=int, default=env_default("GPT_RETRIES", 3, int),
+                            help="Intentos por frase [GPT_RETRIES]")
+    throughput.add_argument("--batch", action="store_true", default=env_default("GPT_BATCH", False, parse_flag),
+                            help="Usar la Batch API (asíncrona, más barata) en lugar de requests síncronos [GPT_BATCH]")
+    throughput.add_argument("--batch-size", type=int, default=env_default("GPT_BATCH_SIZE", None, int),
+                            help="Máximo de requests por trabajo batch [GPT_BATCH_SIZE]")
+    throughput.add_argument("--batch-dir", default=env_default("GPT_BATCH_DIR", "gpt_batch"),
+                            help="Directorio de trabajo y estado del modo batch [GPT_BATCH_DIR]")
+    throughput.add_argument("--poll-interval", type=float, default=env_default("GPT_POLL_INTERVAL", 60.0, float),
+                            help="Segundos entre consultas de estado en modo batch [GPT_POLL_INTERVAL]")
+    
+    run = parser.add_argument_group("ejecución")
+    run.add_argument("--checkpoint-every", type=int, default=env_default("GPT_CHECKPOINT_EVERY", 10, int),
+                     help="Guardar el progreso cada N frases, 0 = desactivado [GPT_CHECKPOINT_EVERY]")
+    run.add_argument("--resume", action="store_true", default=env_default("GPT_RESUME", False, parse_flag),
+                     help="Saltar las frases ya clasificadas sin ERROR en --output o su checkpoint [GPT_RESUME]")
+    run.add_argument("--incremental", action="store_true",
+                     default=env_default("GPT_INCREMENTAL", False, parse_flag),
+                     help="Reclasificar solo las frases nuevas, cambiadas, con ERROR o clasificadas con otro "
+                          "prompt/modelo en --output, con informe de cambios [GPT_INCREMENTAL]")
+    run.add_argument("--retry-failures", action="store_true",
+                     help="Reintentar solo las filas con ERROR de --output")
+    
+    consistency = parser.add_argument_group("auto-consistencia")
+    consistency.add_argument("--samples", type=int, default=env_default("GPT_SAMPLES", 1, int),
+                             help="Muestras por frase (temperatura 0.7) con voto por mayoría; 1 para una "
+                                  "sola respuesta [GPT_SAMPLES]")
+    consistency.add_argument("--initial-samples", type=int, default=env_default("GPT_INITIAL_SAMPLES", 2, int),
+                             help="Muestras de la primera ronda; si coinciden no se piden más "
+                                  "[GPT_INITIAL_SAMPLES]")
+    
+    cascade = parser.add_argument_group("cascada")
+    cascade.add_argument("--cascade-model", default=env_default("GPT_CASCADE_MODEL"),
+                         help="Modelo barato que clasifica primero; --model solo recibe las frases dudosas "
+                              "[GPT_CASCADE_MODEL]")
+    cascade.add_argument("--cascade-samples", type=int, default=env_default("GPT_CASCADE_SAMPLES", 1, int),
+                         help="Muestras del modelo barato; con 2 se escala si no coinciden [GPT_CASCADE_SAMPLES]")
+    cascade.add_argument("--cascade-min-confidence", type=float,
+                         default=env_default("GPT_CASCADE_MIN_CONFIDENCE", None, float),
+                         help="Escalar si la probabilidad media por token (logprobs) es menor "
+                              "[GPT_CASCADE_MIN_CONFIDENCE]")
+    cascade.add_argument("--cascade-audit-rate", type=float, default=env_default("GPT_CASCADE_AUDIT_RATE", 0.0, float),
+                         help="Fracción de frases confiables que también se comparan con --model "
+                              "[GPT_CASCADE_AUDIT_RATE]")
+    propagation = parser.add_argument_group("propagación")
+    propagation.add_argument("--propagate", action="store_true", default=env_default("GPT_PROPAGATE", False, parse_flag),
+                             help="Reutilizar las etiquetas de la frase ya clasificada más parecida en lugar de "
+                                  "llamar al modelo [GPT_PROPAGATE]")
+    propagation.add_argument("--propagation-threshold", type=float,
+                             default=env_default("GPT_PROPAGATION_THRESHOLD", 0.9, float),
+                             help="Similitud coseno mínima para propagar [GPT_PROPAGATION_THRESHOLD]")
+    propagation.add_argument("--propagation-audit-rate", type=float,
+                             default=env_default("GPT_PROPAGATION_AUDIT_RATE", 0.05, float),
+                             help="Fracción de frases propagables que se clasifican igualmente para medir "
+                                  "el acierto [GPT_PROPAGATION_AUDIT_RATE]")
+    propagation.add_argument("--embedder", default=env_default("GPT_EMBEDDER", "hashing"),
+                             help="'hashing' (n-gramas de caracteres) o un modelo local de sentence-transformers "
+                                  "[GPT_EMBEDDER]")
+    rules = parser.add_argument_group("reglas")
+    rules.add_argument("--rules", action="store_true", default=env_default("GPT_RULES", False, parse_flag),
+                       help="Resolver con reglas locales las frases triviales (edad, género, profesión, "
+                            "lugar...) sin llamar al modelo [GPT_RULES]")
+    rules.add_argument("--rules-audit-rate", type=float, default=env_default("GPT_RULES_AUDIT_RATE", 0.05, float),
+                       help="Fracción de frases resueltas por reglas que se clasifican igualmente para medir "
+                            "el acuerdo [GPT_RULES_AUDIT_RATE]")
+    add_budget_arguments(parser, "GPT")
+    add_replay_arguments(parser, "GPT")
+    add_profile_arguments(parser, "GPT")
+    add_shutdown_arguments(parser, "GPT")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
     """
     Función principal
+    
+    Ejemplos:
+        python classify_with_gpt.py --workers 8 --pause 0 -o resultados.csv
+        GPT_MODEL=gpt-4o python classify_with_gpt.py --resume
     """
-    print("=== CLASIFICACIÓN DE FRASES CON GPT-4o-mini ===\n")
+    args = build_arg_parser().parse_args(argv)
+    return run_profiled(args, run, args)
+
+def run(args: argparse.Namespace) -> int:
+    """Ejecución completa con las opciones ya parseadas (lo que perfila --profile)"""
+    global client, MODEL, usage_tracker
+    MODEL = args.model
+    usage_tracker = tracker_from_args(args, MODEL)
+    transport = TransportConfig(pool_size=args.pool_size or args.workers, connect_timeout=args.connect_timeout,
+                                read_timeout=args.timeout, http2=args.http2)
+    archive = archive_from_args(args)
+    if archive is not None or API_KEY:
+        # La reproducción no necesita API key: las respuestas salen de la grabación
+        recorder = None
+        if archive is not None:
+            recorder = openai_transport(replay_mode(args), archive, args.replay_latency_scale,
+                                        **transport.httpx_transport_kwargs())
+        client = OpenAI(api_key=API_KEY or "replay", http_client=transport.openai_http_client(recorder),
+                        timeout=transport.httpx_timeout())
+    client = require_client()
+    
+    print(f"=== CLASIFICACIÓN DE FRASES CON {MODEL} ===\n")
+    
+    # Cargar prompt
+    print("Cargando prompt...")
+    prompt = load_prompt(args.prompt_file)
+    
+    if args.retry_failures:
+        df_results = retry_failures(args.output, prompt, max_workers=args.workers, max_retries=args.retries,
+                                    samples=args.samples, initial_samples=args.initial_samples)
+        usage_tracker.print_summary()
+        return 0 if not df_results.apply(is_failed_row, axis=1).any() else 1
     
     # Cargar datos
     print("Cargando datos...")
-    df = pd.read_csv("clasificacion_ME_204_simple.csv")
+    df = pd.read_csv(args.input, dtype={column: str for column in KEY_COLUMNS})
     print(f"Total de frases a clasificar: {len(df)}")
     
-    # Cargar prompt
-    print("Cargando prompt...")
-    prompt = load_prompt()
+    cascade = None
+    if args.cascade_model:
+        if args.batch:
+            print("⚠️ La cascada no se aplica en modo batch; se usa solo --model")
+        else:
+            cascade = Cascade(args.cascade_model, samples=args.cascade_samples,
+                              min_confidence=args.cascade_min_confidence, audit_rate=args.cascade_audit_rate)
     
-    # Preparar resultados
-    results = []
+    if args.samples > 1:
+        if args.batch:
+            print("⚠️ La auto-consistencia no se aplica en modo batch; se pide una muestra por frase")
+        elif cascade is not None:
+            print("⚠️ Con --cascade-model se usa --cascade-samples; --samples no se aplica")
+    
+    propagator = None
+    if args.propagate:
+        if args.batch:
+            print("⚠️ La propagación de etiquetas no se aplica en modo batch")
+        else:
+            propagator = LabelPropagator(get_encoder(args.embedder), args.propagation_threshold,
+                                         args.propagation_audit_rate)
+    
+    rules = None
+    if args.rules:
+        if args.batch:
+            print("⚠️ Las reglas locales no se aplican en modo batch")
+        else:
+            rules = RuleEngine(REFERENCE_MAPPING, SENSE_MAPPING, audit_rate=args.rules_audit_rate)
     
-    print("\nIniciando clasificación...")
     start_time = time.time()
+    digest = prompt_hash(prompt)
+    plan = None
     
-    for idx, row in df.iterrows():
-        sentence = row['frase']
-        print(f"Procesando frase {idx + 1}/{len(df)}: {sentence[:50]}...")
-        
-        # Clasificar con GPT
-        gpt_response = classify_sentence_with_gpt(sentence, prompt)
-        
-        # Extraer clasificaciones
-        sense_pred, reference_pred, attribution_pred = extract_classification(gpt_response, sentence)
+    if args.batch:
+        from gpt_batch import run_batch
+        batch_options = {"max_requests": args.batch_size} if args.batch_size else {}
+        if args.incremental:
+            print("⚠️ El modo incremental no se aplica en modo batch; se clasifican todas las frases")
+        df_results = run_batch(df, prompt, work_dir=args.batch_dir, model=MODEL, client=client,
+                               poll_interval=args.poll_interval, **batch_options)
+        provenance = [provenance_fields(sentence, digest) for sentence in df_results['frase']]
+        df_results = pd.concat([df_results, pd.DataFrame(provenance, index=df_results.index)], axis=1)
+    else:
+        checkpoint_csv = f"{os.path.splitext(args.output)[0]}.partial.csv"
+        if args.incremental:
+            previous = load_previous_rows(args.output, checkpoint_csv)
+            plan = plan_incremental({row_key(row): text_fingerprint(row['frase']) for _, row in df.iterrows()},
+                                    previous, prompt, MODEL, is_failed_row)
+            plan.print_summary()
+            completed = plan.reused
+        else:
+            completed = load_completed_rows(args.output, checkpoint_csv) if args.resume else {}
+        pending = [row for _, row in df.iterrows() if row_key(row) not in completed]
+        marker_file = resume_marker_path(os.path.splitext(args.output)[0])
+        if args.resume:
+            marker = read_resume_marker(marker_file)
+            if marker is not None:
+                print(f"📌 La ejecución anterior se interrumpió el {marker['interrupted_at']} ({marker['reason']})")
+            print(f"Reanudando: {len(df) - len(pending)} frases ya clasificadas, {len(pending)} pendientes")
+        if propagator is not None:
+            propagator.add([row['frase'] for row in completed.values()],
+                           [(row['sense_predicted'], row['reference_predicted'], row['attribution_predicted'])
+                            for row in completed.values()])
         
-        # Normalizar categorías verdaderas (de específicas a jerarquía superior)
-        sense_true = normalize_categories(row['sense_ME'], 'sense')
-        reference_true = normalize_categories(row['reference_ME'], 'reference') if pd.notna(row['reference_ME']) else "NA"
-        attribution_true = str(row['attribution_ME']) if pd.notna(row['attribution_ME']) else "NA"
+        # Preparar resultados
+        results = {}
+        chunk_size = args.checkpoint_every if args.checkpoint_every > 0 else max(1, len(pending))
         
-        # Almacenar resultados
-        result = {
-            'bio_num': row['bio_num'],
-            'frase_num': row['frase_num'],
-            'frase': sentence,
-            'sense_true': sense_true,
-            'sense_predicted': sense_pred,
-            'reference_true': reference_true,
-            'reference_predicted': reference_pred,
-            'attribution_true': attribution_true,
-            'attribution_predicted': attribution_pred,
-            'gpt_response': json.dumps(gpt_response)
-        }
-        results.append(result)
+        # Ctrl-C / SIGTERM: terminar las frases en vuelo y guardar el progreso en lugar de morir a mitad
+        shutdown = GracefulShutdown(args.shutdown_grace)
+        print("\nIniciando clasificación...")
+        with shutdown:
+            for start in range(0, len(pending), chunk_size):
+                if shutdown.requested:
+                    break
+                chunk = pending[start:start + chunk_size]
+                for offset, row in enumerate(chunk, start + 1):
+                    print(f"Procesando frase {offset}/{len(pending)}: {row['frase'][:50]}...")
+                
+                # Clasificar con GPT
+                responses = classify_sentences([row['frase'] for row in chunk], prompt, args.workers, args.retries,
+                                               args.pause, cascade, propagator, rules, shutdown,
+                                               args.queue_size or None, args.samples, args.initial_samples)
+                results.update((row_key(row), {**build_result_row(row, response),
+                                               **provenance_fields(row['frase'], digest)})
+                               for row, response in zip(chunk, responses) if response is not None)
+                
+                # Guardar progreso
+                if args.checkpoint_every > 0:
+                    pd.DataFrame(list(completed.values()) + list(results.values())).to_csv(checkpoint_csv, index=False)
+                    print(f"Progreso guardado: {len(results)} frases procesadas")
+                memory_checkpoint(f"{len(results)} frases")
         
-        # Pausa para evitar límites de rate
-        time.sleep(0.5)
+        unfinished = ["/".join(row_key(row)) for row in pending if row_key(row) not in results]
+        if shutdown.requested and unfinished:
+            # Parada ordenada: el progreso queda en el checkpoint y la salida final no se toca
+            pd.DataFrame(list(completed.values()) + list(results.values())).to_csv(checkpoint_csv, index=False)
+            write_resume_marker(marker_file, shutdown, len(completed) + len(results), unfinished, checkpoint_csv)
+            usage_tracker.print_summary()
+            if archive is not None:
+                archive.close()
+            return EXIT_INTERRUPTED
         
-        # Guardar progreso cada 10 frases
-        if (idx + 1) % 10 == 0:
-            temp_df = pd.DataFrame(results)
-            temp_df.to_csv(f"temp_results_{idx + 1}.csv", index=False)
-            print(f"Progreso guardado: {idx + 1} frases procesadas")
-    
-    # Crear DataFrame con resultados
-    df_results = pd.DataFrame(results)
+        # Mantener el orden del CSV de entrada
+        df_results = pd.DataFrame([completed.get(row_key(row)) or results[row_key(row)] for _, row in df.iterrows()])
+        clear_resume_marker(marker_file)
+        if plan is not None:
+            labels = lambda r: [label_text(r[column]) for column in PREDICTED_COLUMNS]
+            changes = label_changes(plan, results, labels)
+            write_diff_report(changes, plan, f"{os.path.splitext(args.output)[0]}.diff.json")
     
     # Guardar resultados completos
-    df_results.to_csv("gpt_classification_results.csv", index=False)
+    df_results.to_csv(args.output, index=False)
+    if not args.batch and os.path.exists(checkpoint_csv):
+        os.remove(checkpoint_csv)
     
     elapsed_time = time.time() - start_time
     print(f"\nClasificación completada en {elapsed_time:.2f} segundos")
     
+    if args.batch:
+        tokens = df_results['prompt_tokens'].sum() + df_results['completion_tokens'].sum()
+        print(f"Tokens del batch: {tokens} ({len(df_results)} frases)")
+    if cascade is not None:
+        cascade.stats.print_summary()
+    if propagator is not None:
+        propagator.stats.print_summary()
+    if rules is not None:
+        rules.stats.print_summary()
+    usage_tracker.print_summary()
+    if archive is not None:
+        archive.close()
+    
     print("\nArchivos generados:")
-    print("- gpt_classification_results.csv: Resultados completos de clasificación")
+    print(f"- {args.output}: Resultados completos de clasificación")
+    return 0 if not df_results.apply(is_failed_row, axis=1).any() else 1
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Utilidades compartidas por las líneas de comandos de los clasificadores
+
+Cada opción puede fijarse con un argumento o con una variable de entorno, de
+modo que las mismas configuraciones se pueden lanzar desde cron o desde un
+gestor de trabajos sin editar los scripts.
+"""
+
+import os
+from typing import Any, Callable, Optional
+
+
+def parse_flag(value: str) -> bool:
+    """Interpreta una variable de entorno booleana ("1", "true", "yes", "si")"""
+    return value.strip().lower() in ("1", "true", "yes", "si", "sí")
+
+
+def env_default(name: str, default: Any = None, cast: Callable[[str], Any] = str) -> Optional[Any]:
+    """Valor por defecto de una opción tomado de la variable de entorno `name` (si está definida)"""
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return cast(value)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Control adaptativo de concurrencia basado en la latencia observada de Ollama
+
+Un número fijo de workers no sirve: si es bajo la GPU queda ociosa y si es
+alto los requests se encolan en el servidor hasta agotar el timeout. El
+limitador sube el número de requests en vuelo mientras la latencia se mantiene
+plana respecto a la mínima reciente (aumento aditivo) y lo baja de forma
+multiplicativa cuando la latencia crece, hay timeouts o el servidor avisa de
+que está saturado (HTTP 429/503, p. ej. con la cola de Ollama llena, o
+conexiones rechazadas).
+
+Uso (simulación contra un servidor cuya latencia crece con la concurrencia):
+    python concurrency.py --requests 200 --capacity 4 --latency 0.2
+"""
+
+import argparse
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limitador AIMD guiado por la latencia (estilo TCP Vegas)
+
+    Cada request hace acquire() antes de enviarse y release() al terminar con
+    su latencia. A partir de la latencia suavizada y la mínima reciente se
+    estima cuántos requests están esperando en la cola del servidor:
+
+        cola ≈ límite * (1 - latencia_mínima / latencia_suavizada)
+
+    - cola < queue_low (la latencia sigue plana): +1 al límite por cada ventana de `limit` respuestas
+    - cola > queue_high (la latencia crece), timeout o sobrecarga: límite * backoff, como mucho
+      una vez por ventana
+    """
+
+    def __init__(self, initial_limit: int = 2, min_limit: int = 1, max_limit: int = 32,
+                 queue_low: float = 2.0, queue_high: float = 4.0, backoff: float = 0.7,
+                 smoothing: float = 0.3, window: int = 200):
+        """
+        Args:
+            initial_limit: Requests en vuelo al empezar
+            min_limit: Límite mínimo
+            max_limit: Límite máximo
+            queue_low: Cola estimada por debajo de la cual se aumenta el límite
+            queue_high: Cola estimada por encima de la cual se reduce el límite
+            backoff: Factor multiplicativo al reducir
+            smoothing: Peso de cada muestra en la media móvil exponencial
+            window: Muestras recientes usadas para estimar la latencia mínima
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_low = queue_low
+        self.queue_high = queue_high
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.overloads = 0
+        self.errors = 0
+        self.smoothed_latency: Optional[float] = None
+        self._recent = deque(maxlen=window)
+        self._last_decrease = 0
+        self._history: List[int] = [int(self.limit)]
+        self._cond = threading.Condition()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    def acquire(self):
+        """Espera a que haya un hueco bajo el límite actual"""
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, timed_out: bool = False, failed: bool = False,
+                overloaded: bool = False):
+        """
+        Libera un hueco y ajusta el límite
+
+        Args:
+            latency: Segundos que tardó el request (None si no hubo respuesta)
+            timed_out: True si el request agotó el timeout
+            failed: True si falló por otro motivo (no ajusta el límite)
+            overloaded: True si el servidor rechazó el request por saturación (HTTP 429/503
+                o conexión rechazada); reduce el límite igual que un timeout
+        """
+        with self._cond:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            self.completed += 1
+            if timed_out or overloaded:
+                if timed_out:
+                    self.timeouts += 1
+                else:
+                    self.overloads += 1
+                self._decrease()
+            elif failed or latency is None:
+                self.errors += 1
+            else:
+                self._recent.append(latency)
+                if self.smoothed_latency is None:
+                    self.smoothed_latency = latency
+                else:
+                    self.smoothed_latency += self.smoothing * (latency - self.smoothed_latency)
+                queue = self.limit * (1 - min(self._recent) / self.smoothed_latency)
+                if queue > self.queue_high:
+                    self._decrease()
+                elif queue < self.queue_low and in_flight >= int(self.limit):
+                    # Solo crecer si el límite actual se está usando de verdad
+                    self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            if int(self.limit) != self._history[-1]:
+                self._history.append(int(self.limit))
+            self._cond.notify_all()
+
+    def _decrease(self):
+        # Reducir solo una vez por ventana: las respuestas que ya estaban en
+        # vuelo reflejan todavía el límite anterior
+        if self.completed - self._last_decrease < max(1, int(self.limit)):
+            return
+        self.limit = max(float(self.min_limit), self.limit * self.backoff)
+        self._last_decrease = self.completed
+
+    def metrics(self) -> Dict:
+        """Métricas actuales del limitador"""
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "overloads": self.overloads,
+                "errors": self.errors,
+                "smoothed_latency_s": round(self.smoothed_latency, 4) if self.smoothed_latency is not None else None,
+                "min_latency_s": round(min(self._recent), 4) if self._recent else None,
+                "limit_history": list(self._history)
+            }
+
+
+def main():
+    """Simula el limitador contra un Ollama simulado con capacidad limitada"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from classify_images_with_ollama import OllamaImageClassifier
+    from ollama_stub import StubOllamaServer
+
+    parser = argparse.ArgumentParser(description="Simulación del limitador adaptativo")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--capacity", type=int, default=4, help="Requests en paralelo del servidor")
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos por request del servidor")
+    parser.add_argument("--max-limit", type=int, default=32)
+    args = parser.parse_args()
+
+    limiter = AdaptiveConcurrencyLimiter(max_limit=args.max_limit)
+    with StubOllamaServer(base_latency=args.latency, capacity=args.capacity) as server:
+        classifier = OllamaImageClassifier(ollama_url=server.url, concurrency_limiter=limiter)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.max_limit) as executor:
+            list(executor.map(lambda _: classifier.classify_image("AAAA", "test"), range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+    metrics = limiter.metrics()
+    print(f"\n📊 {args.requests} requests en {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)")
+    print(f"   Capacidad del servidor: {args.capacity} | Límite final: {metrics['limit']}")
+    print(f"   Máximo en vuelo en el servidor: {server.max_in_flight}")
+    print(f"   Evolución del límite: {metrics['limit_history']}")
+
+
+if __name__ == "__main__":
+    main()
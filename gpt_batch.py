@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Modo batch para clasificar frases con la Batch API de OpenAI
+
+Convierte el DataFrame en un archivo JSONL de entrada (un request por frase con
+custom_id = "bio_num:frase_num"), lo envía, espera a que termine y fusiona la
+salida con el mismo camino que el modo síncrono (extract_classification y
+normalize_categories vía build_result_row).
+
+El estado de los trabajos se guarda en disco, por lo que una ejecución
+interrumpida se puede reanudar sin volver a subir ni a pagar lo ya enviado.
+El estado guarda una huella de las frases, el prompt y el modelo: no se
+reanuda con otra entrada en el mismo directorio de trabajo.
+Para probar contra un endpoint local falso basta con pasar un cliente propio
+(o definir OPENAI_BASE_URL).
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from classify_with_gpt import (
+    MODEL,
+    build_messages,
+    build_result_row,
+    create_error_response,
+    load_prompt,
+    parse_response_text,
+    require_client,
+)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Límite de la Batch API por archivo de entrada
+MAX_REQUESTS_PER_BATCH = 50000
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def make_custom_id(bio_num, frase_num) -> str:
+    """Construye el custom_id de un request a partir de (bio_num, frase_num)"""
+    return f"{bio_num}:{frase_num}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[str, str]:
+    """Recupera (bio_num, frase_num) desde un custom_id"""
+    bio_num, frase_num = custom_id.split(":", 1)
+    return bio_num, frase_num
+
+
+def build_batch_request(custom_id: str, sentence: str, prompt: str, model: str = MODEL) -> Dict:
+    """Construye una línea del archivo JSONL de entrada de la Batch API"""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": build_messages(sentence, prompt),
+            "temperature": 0.1,
+            "max_tokens": 1500
+        }
+    }
+
+
+def write_batch_inputs(df: pd.DataFrame, prompt: str, work_dir: Path,
+                       model: str = MODEL,
+                       max_requests: int = MAX_REQUESTS_PER_BATCH) -> List[Path]:
+    """
+    Escribe el DataFrame como uno o varios archivos JSONL de entrada
+
+    Args:
+        df: DataFrame con columnas bio_num, frase_num y frase
+        prompt: Prompt de clasificación
+        work_dir: Directorio donde escribir los archivos
+        model: Modelo a usar en cada request
+        max_requests: Máximo de requests por archivo (límite de la API)
+
+    Returns:
+        Lista de rutas a los archivos escritos
+    """
+    custom_ids = [make_custom_id(b, f) for b, f in zip(df['bio_num'], df['frase_num'])]
+    duplicated = sorted(cid for cid, count in Counter(custom_ids).items() if count > 1)
+    if duplicated:
+        raise ValueError(f"custom_id duplicados en el DataFrame: {duplicated[:5]}")
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for start in range(0, len(df), max_requests):
+        path = work_dir / f"batch_input_{len(paths):03d}.jsonl"
+        with open(path, 'w', encoding='utf-8') as f:
+            for custom_id, sentence in zip(custom_ids[start:start + max_requests],
+                                           df['frase'].iloc[start:start + max_requests]):
+                request = build_batch_request(custom_id, sentence, prompt, model)
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        paths.append(path)
+    return paths
+
+
+def batch_fingerprint(df: pd.DataFrame, prompt: str, model: str) -> str:
+    """Huella de las frases (con su custom_id), el prompt y el modelo de una ejecución batch"""
+    digest = hashlib.sha256()
+    for part in (model, prompt):
+        digest.update(part.encode('utf-8') + b"\0")
+    for bio_num, frase_num, sentence in zip(df['bio_num'], df['frase_num'], df['frase']):
+        digest.update(f"{make_custom_id(bio_num, frase_num)}\t{sentence}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class BatchJobState:
+    """
+    Estado persistente de una ejecución batch (uno o varios trabajos)
+
+    Cada trabajo guarda su archivo de entrada, los ids devueltos por la API y
+    el archivo de salida descargado. Se guarda tras cada transición, de modo
+    que al reanudar solo se repite lo que falta.
+    """
+
+    def __init__(self, path: Path, data: Optional[Dict] = None):
+        self.path = Path(path)
+        self.data = data or {"jobs": []}
+
+    @classmethod
+    def load(cls, path: Path) -> "BatchJobState":
+        path = Path(path)
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        return cls(path)
+
+    @property
+    def jobs(self) -> List[Dict]:
+        return self.data["jobs"]
+
+    def save(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=4)
+        tmp_path.replace(self.path)
+
+
+def submit_job(job: Dict, state: BatchJobState, client=None):
+    """Sube el archivo de entrada y crea el batch (omite los pasos ya hechos)"""
+    client = client or require_client()
+    if not job.get("input_file_id"):
+        with open(job["input_file"], 'rb') as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        job["input_file_id"] = uploaded.id
+        state.save()
+        print(f"📤 Archivo subido: {job['input_file']} -> {uploaded.id}")
+    if not job.get("batch_id"):
+        batch = client.batches.create(
+            input_file_id=job["input_file_id"],
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata={"source": Path(job["input_file"]).name}
+        )
+        job["batch_id"] = batch.id
+        job["status"] = batch.status
+        state.save()
+        print(f"🚀 Batch creado: {batch.id}")
+
+
+def poll_job(job: Dict, state: BatchJobState, client=None, poll_interval: float = 60.0):
+    """Espera a que el batch llegue a un estado terminal"""
+    client = client or require_client()
+    while job.get("status") not in TERMINAL_STATUSES:
+        batch = client.batches.retrieve(job["batch_id"])
+        if batch.status != job.get("status") and batch.status not in TERMINAL_STATUSES:
+            job["status"] = batch.status
+            state.save()
+        counts = getattr(batch, "request_counts", None)
+        if counts is not None:
+            print(f"⏳ Batch {job['batch_id']}: {batch.status} "
+                  f"({counts.completed}/{counts.total} completados, {counts.failed} fallidos)")
+        else:
+            print(f"⏳ Batch {job['batch_id']}: {batch.status}")
+        if batch.status in TERMINAL_STATUSES:
+            job["status"] = batch.status
+            job["output_file_id"] = getattr(batch, "output_file_id", None)
+            job["error_file_id"] = getattr(batch, "error_file_id", None)
+            state.save()
+            break
+        time.sleep(poll_interval)
+
+
+def download_job(job: Dict, state: BatchJobState, work_dir: Path, client=None):
+    """Descarga los archivos de salida y de errores de un batch terminado"""
+    client = client or require_client()
+    for key, prefix in (("output_file_id", "output"), ("error_file_id", "errors")):
+        file_id = job.get(key)
+        local_key = f"{prefix}_path"
+        if not file_id or job.get(local_key):
+            continue
+        local_path = work_dir / f"batch_{prefix}_{job['batch_id']}.jsonl"
+        local_path.write_text(client.files.content(file_id).text, encoding='utf-8')
+        job[local_key] = str(local_path)
+        state.save()
+        print(f"📥 Descargado: {local_path}")
+
+
+def read_batch_outputs(paths: List[str]) -> Dict[str, Dict]:
+    """
+    Lee los archivos de salida/errores y devuelve {custom_id: línea}
+    """
+    outputs = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    outputs[record["custom_id"]] = record
+    return outputs
+
+
+def output_to_gpt_response(record: Optional[Dict], sentence: str) -> Dict:
+    """Convierte una línea de salida de la Batch API en la respuesta que usa el modo síncrono"""
+    if record is None:
+        return create_error_response(sentence, "Batch error: sin resultado")
+    if record.get("error"):
+        return create_error_response(sentence, f"Batch error: {record['error']}")
+    response = record.get("response") or {}
+    if response.get("status_code") != 200:
+        return create_error_response(sentence, f"API error: HTTP {response.get('status_code')}")
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        result = parse_response_text(content)
+        usage = response["body"].get("usage") or {}
+        if isinstance(result, dict):
+            result["usage"] = {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0)
+            }
+        return result
+    except json.JSONDecodeError:
+        return create_error_response(sentence, "JSON parsing error")
+    except (KeyError, IndexError, TypeError) as e:
+        return create_error_response(sentence, f"Batch error: respuesta inesperada ({e})")
+
+
+def merge_batch_results(df: pd.DataFrame, outputs: Dict[str, Dict]) -> pd.DataFrame:
+    """Fusiona la salida del batch con el DataFrame original"""
+    results = []
+    for _, row in df.iterrows():
+        record = outputs.get(make_custom_id(row['bio_num'], row['frase_num']))
+        results.append(build_result_row(row, output_to_gpt_response(record, row['frase'])))
+    return pd.DataFrame(results)
+
+
+def run_batch(df: pd.DataFrame, prompt: str, work_dir: Union[str, Path] = "gpt_batch",
+              model: str = MODEL, client=None, poll_interval: float = 60.0,
+              max_requests: int = MAX_REQUESTS_PER_BATCH) -> pd.DataFrame:
+    """
+    Ejecuta (o reanuda) la clasificación completa en modo batch
+
+    Args:
+        df: DataFrame con las frases a clasificar
+        prompt: Prompt de clasificación
+        work_dir: Directorio con archivos de entrada/salida y el estado
+        model: Modelo de OpenAI
+        client: Cliente OpenAI (por defecto el del módulo classify_with_gpt)
+        poll_interval: Segundos entre consultas de estado
+        max_requests: Máximo de requests por batch
+
+    Returns:
+        DataFrame con el mismo formato que el modo síncrono
+    """
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    state = BatchJobState.load(work_dir / "batch_state.json")
+    fingerprint = batch_fingerprint(df, prompt, model)
+
+    if state.jobs and state.data.get("fingerprint") != fingerprint:
+        if "fingerprint" not in state.data:
+            # Estado de una versión anterior, sin huella: se reanuda como antes
+            print(f"⚠️ '{state.path}' no tiene huella de entrada; se supone que corresponde a estas frases")
+            state.data["fingerprint"] = fingerprint
+            state.save()
+        else:
+            raise ValueError(f"'{state.path}' corresponde a otras frases, otro prompt u otro modelo: "
+                             f"usa otro directorio de trabajo o borra ese estado para empezar de cero")
+
+    if not state.jobs:
+        input_paths = write_batch_inputs(df, prompt, work_dir, model, max_requests)
+        state.data["fingerprint"] = fingerprint
+        state.data["model"] = model
+        state.data["total_requests"] = len(df)
+        state.data["jobs"] = [{"input_file": str(p)} for p in input_paths]
+        state.save()
+        print(f"📝 {len(input_paths)} archivo(s) de entrada escritos en '{work_dir}'")
+    else:
+        print(f"🔁 Reanudando {len(state.jobs)} trabajo(s) desde '{state.path}'")
+
+    for job in state.jobs:
+        submit_job(job, state, client)
+    for job in state.jobs:
+        poll_job(job, state, client, poll_interval)
+        download_job(job, state, work_dir, client)
+        if job["status"] != "completed":
+            print(f"⚠️ Batch {job['batch_id']} terminó con estado '{job['status']}'")
+
+    output_paths = [job[key] for job in state.jobs
+                    for key in ("output_path", "errors_path") if job.get(key)]
+    return merge_batch_results(df, read_batch_outputs(output_paths))
+
+
+def main():
+    """
+    Función principal
+    """
+    print("=== CLASIFICACIÓN DE FRASES CON LA BATCH API DE OPENAI ===\n")
+
+    df = pd.read_csv("clasificacion_ME_204_simple.csv")
+    print(f"Total de frases a clasificar: {len(df)}")
+    prompt = load_prompt()
+
+    start_time = time.time()
+    df_results = run_batch(df, prompt)
+    df_results.to_csv("gpt_batch_classification_results.csv", index=False)
+
+    errors = (df_results['sense_predicted'] == "ERROR").sum()
+    elapsed_time = time.time() - start_time
+    print(f"\nClasificación batch completada en {elapsed_time:.2f} segundos ({errors} errores)")
+    print("- gpt_batch_classification_results.csv: Resultados completos de clasificación")
+
+
+if __name__ == "__main__":
+    main()
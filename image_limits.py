@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Límites de memoria al descargar y decodificar imágenes
+
+Una sola imagen enorme (una panorámica de cientos de megapíxeles, un GIF
+malformado) puede disparar la memoria de un worker en varios GB. Este módulo
+acota cada paso:
+
+- descarga en streaming con un tope de bytes (se corta al superarlo)
+- lectura solo de la cabecera (`Image.open` sin `load()`) para comprobar el
+  número de píxeles antes de decodificar; los JPEG por encima del presupuesto
+  se decodifican ya reducidos con `draft()` y el resto se rechaza
+- en GIF/WebP/TIFF con varios fotogramas solo se usa el primero
+- un semáforo de bytes limita la memoria de las decodificaciones simultáneas
+  de un proceso, y en los procesos de preprocesado se puede fijar un tope de
+  memoria (RLIMIT_AS) para que un caso extremo falle sin afectar al resto
+"""
+
+import math
+import threading
+from contextlib import contextmanager
+from typing import IO, Optional, Union
+from pathlib import Path
+
+import requests
+from PIL import Image
+
+DEFAULT_MAX_PIXELS = 50_000_000  # ~50 MP: 150 MB en RGB
+DEFAULT_MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(Exception):
+    """La imagen supera el tope de bytes o el presupuesto de píxeles"""
+
+
+class ImageLimits:
+    """
+    Topes por imagen
+
+    Args:
+        max_pixels: Presupuesto de píxeles (ancho x alto) de la imagen decodificada
+        max_download_bytes: Tamaño máximo de una imagen descargada
+        draft: Decodificar reducidos los JPEG que superan max_pixels en lugar de rechazarlos
+    """
+
+    def __init__(self, max_pixels: Optional[int] = DEFAULT_MAX_PIXELS,
+                 max_download_bytes: Optional[int] = DEFAULT_MAX_DOWNLOAD_BYTES,
+                 draft: bool = True):
+        self.max_pixels = max_pixels
+        self.max_download_bytes = max_download_bytes
+        self.draft = draft
+
+
+def fetch_limited(url: str, max_bytes: Optional[int] = DEFAULT_MAX_DOWNLOAD_BYTES, timeout: float = 10,
+                  session: Optional[requests.Session] = None) -> bytes:
+    """
+    Descarga una URL en streaming sin pasar de max_bytes
+
+    Raises:
+        ImageTooLarge: si Content-Length o los bytes recibidos superan el tope
+        requests.HTTPError: si la respuesta no es 2xx
+    """
+    http = session or requests
+    with http.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        declared = response.headers.get("Content-Length")
+        if max_bytes is not None and declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ImageTooLarge(f"{url} ocupa {int(declared)} bytes (máximo {max_bytes})")
+        buffer = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            buffer += chunk
+            if max_bytes is not None and len(buffer) > max_bytes:
+                raise ImageTooLarge(f"{url} supera {max_bytes} bytes")
+        return bytes(buffer)
+
+
+def open_bounded(source: Union[str, Path, IO[bytes]], limits: Optional[ImageLimits] = None) -> Image.Image:
+    """
+    Abre una imagen comprobando su tamaño antes de decodificarla
+
+    Solo se lee la cabecera; si la imagen supera el presupuesto de píxeles y es
+    JPEG se pide a Pillow una decodificación reducida (1/2, 1/4 o 1/8) que quepa,
+    y si no es posible se rechaza. Las imágenes con varios fotogramas quedan
+    posicionadas en el primero.
+
+    Raises:
+        ImageTooLarge: si la imagen no cabe en el presupuesto
+    """
+    limits = limits or ImageLimits()
+    try:
+        img = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    try:
+        if getattr(img, "n_frames", 1) > 1:
+            img.seek(0)
+        if limits.max_pixels is not None and pixel_count(img) > limits.max_pixels:
+            width, height = img.size
+            if limits.draft and img.format == "JPEG":
+                # Menor reducción de las que admite el decodificador JPEG que cabe en el presupuesto
+                needed = math.sqrt(pixel_count(img) / limits.max_pixels)
+                scale = next((s for s in (2, 4, 8) if s >= needed), 8)
+                img.draft("RGB", (max(1, width // scale), max(1, height // scale)))
+            if pixel_count(img) > limits.max_pixels:
+                raise ImageTooLarge(f"{width}x{height} píxeles supera el presupuesto de {limits.max_pixels}")
+    except Exception:
+        img.close()
+        raise
+    return img
+
+
+def pixel_count(img: Image.Image) -> int:
+    width, height = img.size
+    return width * height
+
+
+def decoded_bytes(img: Image.Image) -> int:
+    """Memoria aproximada de decodificar la imagen y convertirla a RGB"""
+    return pixel_count(img) * (len(img.getbands()) + 3)
+
+
+class DecodeMemoryGate:
+    """
+    Semáforo de bytes para las decodificaciones simultáneas de un proceso
+
+    Cada decodificación reserva su memoria estimada y espera mientras la suma
+    de las que están en curso superaría max_bytes; una imagen mayor que el tope
+    completo se decodifica sola.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        nbytes = min(nbytes, self.max_bytes)
+        with self._condition:
+            while self.in_use and self.in_use + nbytes > self.max_bytes:
+                self._condition.wait()
+            self.in_use += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+
+
+def limit_worker_memory(max_bytes: Optional[int]):
+    """
+    Inicializador de procesos de preprocesado: fija un tope de memoria virtual (RLIMIT_AS)
+
+    Al superarlo la decodificación falla con MemoryError en ese proceso en lugar de
+    agotar la memoria de la máquina. Sin efecto en sistemas sin el módulo `resource`.
+    """
+    if not max_bytes:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Almacén de imágenes pre-codificadas en base64 con un archivo empaquetado y mmap
+
+Al iterar sobre prompts, las mismas imágenes se decodifican, recodifican a JPEG
+y pasan a base64 en cada ejecución. Este módulo hace ese trabajo una sola vez:
+guarda todos los payloads en un único archivo (payloads.bin) con un índice de
+offsets (index.json) y los sirve después como memoryview sobre el archivo
+mapeado en memoria, sin copias intermedias.
+
+Cada entrada se invalida si cambia el mtime/tamaño del archivo fuente o la
+configuración de preprocesado (tamaño máximo y calidad JPEG).
+
+Uso:
+    python image_store.py images_folder --store .image_store --max-size 1024 --quality 85
+"""
+
+import argparse
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+from tqdm import tqdm
+
+from classify_images_with_ollama import DEFAULT_JPEG_QUALITY, encode_image_to_base64
+from image_limits import ImageLimits, open_bounded
+
+PACK_NAME = "payloads.bin"
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+
+
+def settings_key(max_size: Optional[int], quality: int) -> str:
+    """Identifica la configuración de preprocesado de una entrada"""
+    return f"jpeg:q{quality}:max{max_size or 0}"
+
+
+class ImageStore:
+    """
+    Archivo empaquetado de payloads base64 con índice de offsets, leído vía mmap
+    """
+
+    def __init__(self, store_dir: Union[str, Path], max_image_size: Optional[int] = None,
+                 jpeg_quality: int = DEFAULT_JPEG_QUALITY, image_limits: Optional[ImageLimits] = None):
+        """
+        Abre (o crea) un almacén
+
+        Args:
+            store_dir: Directorio del almacén
+            max_image_size: Lado máximo con el que se preprocesan las imágenes
+            jpeg_quality: Calidad JPEG del preprocesado
+            image_limits: Presupuesto de píxeles al decodificar (ver image_limits)
+        """
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.pack_path = self.store_dir / PACK_NAME
+        self.index_path = self.store_dir / INDEX_NAME
+        self.max_image_size = max_image_size
+        self.jpeg_quality = jpeg_quality
+        self.image_limits = image_limits
+        self.settings = settings_key(max_image_size, jpeg_quality)
+        self.entries: Dict[str, Dict] = self._load_index()
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._open_map()
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not self.index_path.exists():
+            return {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            return {}
+        return data.get("entries", {})
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "entries": self.entries}, f)
+        tmp_path.replace(self.index_path)
+
+    def _open_map(self):
+        if self.pack_path.exists() and self.pack_path.stat().st_size > 0:
+            with open(self.pack_path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def close(self):
+        """Libera el mapeo (falla si aún hay memoryviews en uso)"""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    @staticmethod
+    def _key(path: Union[str, Path]) -> str:
+        return str(Path(path).resolve())
+
+    def _is_fresh(self, entry: Optional[Dict], stat: os.stat_result) -> bool:
+        return (entry is not None
+                and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size
+                and entry["settings"] == self.settings)
+
+    def get(self, path: Union[str, Path]) -> Optional[memoryview]:
+        """
+        Devuelve el payload base64 de una imagen como memoryview sobre el mmap
+
+        Returns:
+            memoryview con el base64 (bytes ASCII) o None si no existe o está desactualizado
+        """
+        entry = self.entries.get(self._key(path))
+        if entry is None or self._view is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not self._is_fresh(entry, stat):
+            return None
+        end = entry["offset"] + entry["length"]
+        if end > len(self._view):
+            return None
+        return self._view[entry["offset"]:end]
+
+    def build(self, paths: Iterable[Union[str, Path]]) -> Dict[str, int]:
+        """
+        Preprocesa y añade al almacén las imágenes nuevas o desactualizadas
+
+        Las entradas vigentes no se tocan; las nuevas se añaden al final del
+        archivo empaquetado y el índice se reescribe al terminar.
+
+        Returns:
+            Estadísticas: {"added": n, "fresh": n, "failed": n}
+        """
+        stats = {"added": 0, "fresh": 0, "failed": 0}
+        pending = []
+        for path in paths:
+            key = self._key(path)
+            stat = os.stat(path)
+            if self._is_fresh(self.entries.get(key), stat):
+                stats["fresh"] += 1
+            else:
+                pending.append((key, Path(path), stat))
+
+        if pending:
+            self.close()
+            with open(self.pack_path, 'ab') as pack:
+                for key, path, stat in tqdm(pending, desc="Preprocesando", unit="img"):
+                    try:
+                        with open_bounded(path, self.image_limits) as img:
+                            payload = encode_image_to_base64(img, self.max_image_size, self.jpeg_quality)
+                    except Exception as e:
+                        print(f"❌ Error preprocesando {path}: {e}")
+                        stats["failed"] += 1
+                        continue
+                    offset = pack.tell()
+                    pack.write(payload)
+                    self.entries[key] = {
+                        "offset": offset,
+                        "length": len(payload),
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "settings": self.settings
+                    }
+                    stats["added"] += 1
+            self._save_index()
+            self._open_map()
+        return stats
+
+    def compact(self):
+        """Reescribe el archivo empaquetado sin las entradas sustituidas"""
+        if self._view is None:
+            return
+        new_pack = self.pack_path.with_suffix(".bin.tmp")
+        new_entries = {}
+        with open(new_pack, 'wb') as f:
+            for key, entry in self.entries.items():
+                start = entry["offset"]
+                new_entries[key] = dict(entry, offset=f.tell())
+                f.write(self._view[start:start + entry["length"]])
+        self.close()
+        new_pack.replace(self.pack_path)
+        self.entries = new_entries
+        self._save_index()
+        self._open_map()
+
+
+def main():
+    """Preprocesa un directorio de imágenes en un ImageStore"""
+    parser = argparse.ArgumentParser(description="Pre-codifica imágenes en un almacén mapeado en memoria")
+    parser.add_argument("directory", help="Directorio con imágenes")
+    parser.add_argument("--store", default=".image_store", help="Directorio del almacén")
+    parser.add_argument("--max-size", type=int, default=None, help="Lado máximo en píxeles")
+    parser.add_argument("--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="Calidad JPEG")
+    parser.add_argument("--compact", action="store_true", help="Compactar el archivo al terminar")
+    args = parser.parse_args()
+
+    extensions = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
+    paths = [p for p in Path(args.directory).iterdir()
+             if p.is_file() and p.suffix.lower() in extensions]
+
+    store = ImageStore(args.store, args.max_size, args.quality)
+    stats = store.build(paths)
+    if args.compact:
+        store.compact()
+    print(f"✅ Almacén '{args.store}': {stats['added']} añadidas, "
+          f"{stats['fresh']} vigentes, {stats['failed']} fallidas")
+
+
+if __name__ == "__main__":
+    main()
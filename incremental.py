@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Reclasificación incremental cuando cambian el prompt, el modelo o las entradas
+
+Cada registro de resultados guarda la configuración con la que se obtuvo
+(`prompt_hash`, `model`) y la huella de su entrada (`input_fingerprint`: SHA-256
+del archivo de imagen o del texto de la frase). En modo incremental se compara
+la configuración y las entradas actuales con los resultados existentes y solo
+se clasifican los ítems:
+
+- nuevos: no estaban en los resultados
+- cambiados: la entrada tiene otra huella
+- con otra configuración: otro prompt u otro modelo (o registros sin estos
+  campos, de versiones anteriores)
+- fallidos: con ERROR en la ejecución anterior
+
+El resto se reutiliza tal cual. Al terminar se escribe un informe con las
+etiquetas que cambiaron respecto a la ejecución anterior.
+
+Las imágenes guardan también `input_stat` (tamaño y mtime): si no cambió, se
+reutiliza la huella anterior sin volver a leer el archivo.
+"""
+
+import hashlib
+import json
+import math
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Union
+
+PROVENANCE_FIELDS = ("prompt_hash", "model", "input_fingerprint")
+REASONS = {"new": "nuevas", "changed": "cambiadas", "stale": "con otra configuración", "failed": "fallidas"}
+
+
+def prompt_hash(prompt: str) -> str:
+    """Huella corta del texto del prompt"""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+
+def text_fingerprint(text: str) -> str:
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest()[:16]
+
+
+def file_stat(path: Union[str, Path]) -> str:
+    """Tamaño y mtime de un archivo, para saber sin leerlo si puede haber cambiado"""
+    stat = Path(path).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@lru_cache(maxsize=65536)
+def _content_hash(path: str, stat: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def file_fingerprint(path: Union[str, Path], previous: Optional[Dict] = None) -> str:
+    """
+    Huella del contenido de un archivo
+
+    Si `previous` (el registro anterior) tiene el mismo input_stat, se reutiliza su huella.
+    """
+    stat = file_stat(path)
+    if previous and previous.get("input_stat") == stat and previous.get("input_fingerprint"):
+        return previous["input_fingerprint"]
+    return _content_hash(str(path), stat)
+
+
+class IncrementalPlan:
+    """
+    Ítems a clasificar y registros reutilizables de una ejecución incremental
+
+    Attributes:
+        reused: Clave -> registro anterior que sigue siendo válido
+        reasons: Clave -> motivo por el que se reclasifica ("new", "changed", "stale", "failed")
+        removed: Claves de los resultados anteriores que ya no están en la entrada
+        previous: Todos los registros anteriores, para el informe de cambios
+    """
+
+    def __init__(self, previous: Dict[Hashable, Dict]):
+        self.previous = previous
+        self.reused: Dict[Hashable, Dict] = {}
+        self.reasons: Dict[Hashable, str] = {}
+        self.removed: List[Hashable] = []
+
+    def print_summary(self):
+        counts = Counter(self.reasons.values())
+        detail = ", ".join(f"{counts[reason]} {label}" for reason, label in REASONS.items() if counts[reason])
+        print(f"🧮 INCREMENTAL: {len(self.reasons)} a clasificar ({detail or 'ninguna'}), "
+              f"{len(self.reused)} reutilizadas" + (f", {len(self.removed)} ya no están" if self.removed else ""))
+
+
+def plan_incremental(fingerprints: Dict[Hashable, str], previous: Dict[Hashable, Dict], prompt: str, model: str,
+                     is_failed: Callable[[Dict], bool]) -> IncrementalPlan:
+    """
+    Compara la configuración y las entradas actuales con los resultados anteriores
+
+    Args:
+        fingerprints: Clave de cada ítem actual -> huella de su entrada
+        previous: Clave -> registro de la ejecución anterior
+        prompt: Prompt actual
+        model: Modelo actual
+        is_failed: Indica si un registro anterior falló
+    """
+    plan = IncrementalPlan(previous)
+    current_hash = prompt_hash(prompt)
+    for key, fingerprint in fingerprints.items():
+        record = previous.get(key)
+        if record is None:
+            plan.reasons[key] = "new"
+        elif record.get("input_fingerprint") != fingerprint:
+            plan.reasons[key] = "changed"
+        elif record.get("prompt_hash") != current_hash or record.get("model") != model:
+            plan.reasons[key] = "stale"
+        elif is_failed(record):
+            plan.reasons[key] = "failed"
+        else:
+            plan.reused[key] = record
+    plan.removed = [key for key in previous if key not in fingerprints]
+    return plan
+
+
+def comparable_label(value):
+    """
+    Etiqueta lista para comparar y guardar en JSON: NaN (celda vacía leída por pandas) pasa a None
+
+    Un NaN no es igual a sí mismo (daría cambios fantasma) y json.dump lo escribe
+    como un token NaN que no es JSON válido.
+    """
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (list, tuple)):
+        return [comparable_label(item) for item in value]
+    if isinstance(value, dict):
+        return {key: comparable_label(item) for key, item in value.items()}
+    return value
+
+
+def label_changes(plan: IncrementalPlan, results: Dict[Hashable, Dict],
+                  label: Callable[[Dict], object]) -> List[Dict]:
+    """
+    Etiquetas que cambiaron entre la ejecución anterior y la actual (solo ítems reclasificados)
+
+    Args:
+        plan: Plan de la ejecución incremental
+        results: Clave -> registro nuevo
+        label: Extrae la etiqueta comparable de un registro
+    """
+    changes = []
+    for key, reason in plan.reasons.items():
+        before = plan.previous.get(key)
+        after = results.get(key)
+        if before is None or after is None:
+            continue
+        old, new = comparable_label(label(before)), comparable_label(label(after))
+        if old != new:
+            changes.append({"item": "/".join(map(str, key)) if isinstance(key, tuple) else str(key),
+                            "reason": reason, "before": old, "after": new})
+    return changes
+
+
+def write_diff_report(changes: List[Dict], plan: IncrementalPlan, path: Union[str, Path]):
+    """Guarda el informe de cambios (JSON) y muestra las transiciones más frecuentes"""
+    transitions = Counter((json.dumps(change["before"], ensure_ascii=False),
+                           json.dumps(change["after"], ensure_ascii=False)) for change in changes)
+    report = {
+        "reclassified": len(plan.reasons),
+        "reasons": dict(Counter(plan.reasons.values())),
+        "changed_labels": len(changes),
+        "removed": [str(key) for key in plan.removed],
+        "transitions": [{"before": before, "after": after, "count": count}
+                        for (before, after), count in transitions.most_common()],
+        "changes": changes
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    compared = sum(1 for key in plan.reasons if key in plan.previous)
+    print(f"🔀 {len(changes)} de {compared} ítems reclasificados cambiaron de etiqueta (informe en '{path}')")
+    for (before, after), count in transitions.most_common(5):
+        print(f"   {count} × {before} → {after}")
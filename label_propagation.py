@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Propagación de etiquetas por vecino más cercano para ahorrar llamadas al LLM
+
+Muchas frases de un corpus son casi paráfrasis unas de otras, y cada una cuesta
+una llamada completa con el prompt de 24 KB. Antes de llamar al modelo se busca
+la frase ya clasificada más parecida; si la similitud coseno supera el umbral
+se reutilizan sus etiquetas.
+
+- Embeddings: por defecto un HashingVectorizer de n-gramas de caracteres
+  (scikit-learn, sin entrenamiento ni descargas); opcionalmente un modelo local
+  de sentence-transformers si está instalado
+- Índice: búsqueda exacta por fuerza bruta (producto matricial con NumPy/SciPy)
+  sobre las frases ya clasificadas, que crece con cada respuesta del modelo en
+  búferes de capacidad doble (añadir no vuelve a apilar el índice)
+- Auditoría: una fracción de las frases que se propagarían (audit_rate) se
+  envía igualmente al modelo para medir cuántas veces la etiqueta propagada
+  coincide con la real, en total y por dimensión
+"""
+
+import random
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+Labels = Tuple[str, str, str]
+DIMENSIONS = ("sense", "reference", "attribution")
+
+
+class HashingEncoder:
+    """
+    Vectores TF de n-gramas de caracteres (3-5) normalizados, con hashing
+
+    Robusto a mayúsculas, tildes y pequeñas variaciones de forma ("Soy de
+    Madrid" / "soy de madrid."), sin vocabulario que ajustar.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18):
+        from sklearn.feature_extraction.text import HashingVectorizer
+
+        self.vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5), n_features=n_features,
+                                            alternate_sign=False, norm="l2", strip_accents="unicode")
+
+    def encode(self, texts: Sequence[str]):
+        return self.vectorizer.transform(texts).tocsr()
+
+
+class SentenceTransformerEncoder:
+    """Embeddings densos de un modelo local de sentence-transformers (p. ej. paraphrase-multilingual-MiniLM-L12-v2)"""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError("El codificador de sentence-transformers requiere: pip install sentence-transformers")
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def get_encoder(name: str = "hashing"):
+    """Codificador por nombre: "hashing" o el nombre de un modelo de sentence-transformers"""
+    return HashingEncoder() if name == "hashing" else SentenceTransformerEncoder(name)
+
+
+class NeighborIndex:
+    """
+    Índice exacto de vecinos por similitud coseno (vectores ya normalizados)
+
+    Las filas se copian en búferes que duplican su capacidad al llenarse (una
+    matriz densa, o los arrays data/indices/indptr de una CSR), así que añadir
+    una frase cuesta O(1) amortizado y buscar es un producto matricial sobre
+    una vista de las filas ocupadas, sin volver a apilar el índice.
+    """
+
+    def __init__(self, initial_capacity: int = 64):
+        self.initial_capacity = initial_capacity
+        self.payloads: List = []
+        self._rows = 0
+        self._n_features = None
+        self._dense: Optional[np.ndarray] = None
+        self._data: Optional[np.ndarray] = None
+        self._indices: Optional[np.ndarray] = None
+        self._indptr: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.payloads)
+
+    @staticmethod
+    def _reserve(buffer: np.ndarray, needed: int) -> np.ndarray:
+        """El mismo búfer si caben `needed` filas; si no, una copia con el doble de capacidad (o más)"""
+        if len(buffer) >= needed:
+            return buffer
+        grown = np.empty((max(needed, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+        grown[:len(buffer)] = buffer
+        return grown
+
+    def add(self, vectors, payloads: Sequence):
+        if not len(payloads):
+            return
+        if sparse.issparse(vectors):
+            self._add_sparse(vectors.tocsr())
+        else:
+            self._add_dense(np.asarray(vectors))
+        self._rows += len(payloads)
+        self.payloads.extend(payloads)
+
+    def _add_dense(self, vectors: np.ndarray):
+        if self._dense is None:
+            self._n_features = vectors.shape[1]
+            self._dense = np.empty((max(self.initial_capacity, len(vectors)), self._n_features), vectors.dtype)
+        self._dense = self._reserve(self._dense, self._rows + len(vectors))
+        self._dense[self._rows:self._rows + len(vectors)] = vectors
+
+    def _add_sparse(self, vectors):
+        if self._indptr is None:
+            self._n_features = vectors.shape[1]
+            capacity = max(self.initial_capacity, vectors.shape[0])
+            self._indptr = np.zeros(capacity + 1, dtype=vectors.indptr.dtype)
+            self._data = np.empty(max(capacity, vectors.nnz), dtype=vectors.data.dtype)
+            self._indices = np.empty(max(capacity, vectors.nnz), dtype=vectors.indices.dtype)
+        nnz = int(self._indptr[self._rows])
+        rows = vectors.shape[0]
+        self._data = self._reserve(self._data, nnz + vectors.nnz)
+        self._indices = self._reserve(self._indices, nnz + vectors.nnz)
+        self._indptr = self._reserve(self._indptr, self._rows + rows + 1)
+        self._data[nnz:nnz + vectors.nnz] = vectors.data
+        self._indices[nnz:nnz + vectors.nnz] = vectors.indices
+        self._indptr[self._rows + 1:self._rows + rows + 1] = vectors.indptr[1:] + nnz
+
+    def _matrix(self):
+        """Vista (sin copiar) de las filas ocupadas"""
+        if self._dense is not None:
+            return self._dense[:self._rows]
+        nnz = int(self._indptr[self._rows])
+        return sparse.csr_matrix((self._data[:nnz], self._indices[:nnz], self._indptr[:self._rows + 1]),
+                                 shape=(self._rows, self._n_features), copy=False)
+
+    def nearest(self, vector) -> Optional[Tuple[float, int]]:
+        """(similitud, posición) del vecino más parecido, o None si el índice está vacío"""
+        if not self._rows:
+            return None
+        scores = self._matrix() @ vector.T
+        scores = scores.toarray().ravel() if sparse.issparse(scores) else np.asarray(scores).ravel()
+        best = int(np.argmax(scores))
+        return float(scores[best]), best
+
+
+class PropagationStats:
+    """Contadores de propagación y de acuerdo en la auditoría"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.propagated = 0
+        self.audited = 0
+        self.audit_agreed = 0
+        self.dimension_agreed = {dimension: 0 for dimension in DIMENSIONS}
+
+    def record(self, propagated: bool):
+        with self._lock:
+            self.items += 1
+            self.propagated += int(propagated)
+
+    def record_audit(self, predicted: Labels, actual: Labels):
+        with self._lock:
+            self.audited += 1
+            self.audit_agreed += int(predicted == actual)
+            for dimension, p, a in zip(DIMENSIONS, predicted, actual):
+                self.dimension_agreed[dimension] += int(p == a)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            audit = None
+            if self.audited:
+                audit = {"items": self.audited, "accuracy": round(self.audit_agreed / self.audited, 4)}
+                audit.update({dimension: round(agreed / self.audited, 4)
+                              for dimension, agreed in self.dimension_agreed.items()})
+            return {
+                "items": self.items,
+                "propagated": self.propagated,
+                "propagation_rate": round(self.propagated / self.items, 4) if self.items else 0.0,
+                "audit": audit
+            }
+
+    def print_summary(self):
+        metrics = self.metrics()
+        if not metrics["items"]:
+            return
+        print(f"\n🧲 PROPAGACIÓN: {metrics['propagated']}/{metrics['items']} frases sin llamar al modelo "
+              f"({metrics['propagation_rate']:.1%})")
+        audit = metrics["audit"]
+        if audit:
+            per_dimension = ", ".join(f"{dimension} {audit[dimension]:.1%}" for dimension in DIMENSIONS)
+            print(f"   Auditoría: {audit['accuracy']:.1%} de acierto en {audit['items']} frases ({per_dimension})")
+
+
+class LabelPropagator:
+    """
+    Reutiliza las etiquetas de la frase ya clasificada más parecida
+
+    Args:
+        encoder: Codificador de frases (ver get_encoder)
+        threshold: Similitud coseno mínima para propagar
+        audit_rate: Fracción de frases propagables que se envían también al modelo
+        seed: Semilla de la selección de auditoría
+    """
+
+    def __init__(self, encoder=None, threshold: float = 0.9, audit_rate: float = 0.05,
+                 seed: Optional[int] = None):
+        self.encoder = encoder or HashingEncoder()
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.index = NeighborIndex()
+        self.stats = PropagationStats()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _valid(labels: Labels) -> bool:
+        return "ERROR" not in labels
+
+    def add(self, sentences: Sequence[str], labels: Sequence[Labels]):
+        """Añade al índice frases ya clasificadas (se ignoran las que tienen ERROR)"""
+        items = [(sentence, tuple(label)) for sentence, label in zip(sentences, labels) if self._valid(label)]
+        if not items:
+            return
+        vectors = self.encoder.encode([sentence for sentence, _ in items])
+        with self._lock:
+            self.index.add(vectors, items)
+
+    def lookup(self, sentence: str) -> Optional[Dict]:
+        """
+        Vecino más parecido por encima del umbral
+
+        Returns:
+            {"labels", "source", "similarity", "audit"} o None si no hay vecino suficientemente parecido;
+            con audit=True la frase debe clasificarse igualmente y compararse con observe()
+        """
+        vector = self.encoder.encode([sentence])
+        with self._lock:
+            nearest = self.index.nearest(vector)
+            if nearest is None or nearest[0] < self.threshold:
+                return None
+            similarity, position = nearest
+            source, labels = self.index.payloads[position]
+            audit = self.audit_rate > 0 and self._random.random() < self.audit_rate
+        return {"labels": labels, "source": source, "similarity": round(similarity, 4), "audit": audit}
+
+    def observe(self, sentence: str, labels: Labels, match: Optional[Dict] = None):
+        """Registra una frase clasificada por el modelo: la añade al índice y, si era una auditoría, compara"""
+        if match is not None and self._valid(labels):
+            self.stats.record_audit(tuple(match["labels"]), tuple(labels))
+        self.add([sentence], [labels])
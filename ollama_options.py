@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Opciones de inferencia de Ollama y reutilización del prefijo del prompt
+
+OllamaOptions agrupa los parámetros que Ollama acepta en cada request
+(`options` y `keep_alive`) y se añade a todos los payloads del clasificador:
+
+- num_ctx: tamaño de contexto (el prompt tridimensional + imagen necesita más de 2048)
+- num_predict: tokens máximos de respuesta (una puntuación no necesita 512)
+- temperature, seed: muestreo determinista o no
+- num_thread: hilos de CPU del servidor
+- keep_alive: cuánto tiempo sigue el modelo cargado tras el último request ("30m", -1)
+
+Con `prefix_reuse` el prompt de clasificación va como mensaje de sistema de
+/api/chat, idéntico en todos los requests y antes de la imagen. Ollama conserva
+la caché KV de cada hueco de ejecución y, si el request siguiente empieza con
+los mismos tokens, no vuelve a evaluarlos; en /api/generate la imagen va
+delante del texto y el prefijo común se pierde. PrefixCacheStats mide el
+efecto con el `prompt_eval_count` y el `prompt_eval_duration` de cada respuesta.
+"""
+
+import threading
+from typing import Dict, Optional, Union
+
+# Mensaje de usuario que acompaña a la imagen cuando el prompt va como mensaje de sistema
+PREFIX_USER_MESSAGE = "Classify the attached image following the instructions."
+
+
+class OllamaOptions:
+    """
+    Parámetros de inferencia enviados en cada request
+
+    Args:
+        num_ctx: Tokens de contexto
+        num_predict: Tokens máximos generados
+        temperature: Temperatura de muestreo
+        num_thread: Hilos de CPU del servidor
+        seed: Semilla de muestreo
+        keep_alive: Duración ("30m", "1h"), segundos o -1 para no descargar nunca el modelo
+        extra: Otras opciones de Ollama tal cual (top_k, top_p, repeat_penalty...)
+    """
+
+    def __init__(self, num_ctx: Optional[int] = None, num_predict: Optional[int] = None,
+                 temperature: Optional[float] = None, num_thread: Optional[int] = None,
+                 seed: Optional[int] = None, keep_alive: Optional[Union[str, int]] = None,
+                 extra: Optional[Dict] = None):
+        for name, value in (("num_ctx", num_ctx), ("num_thread", num_thread)):
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} debe ser positivo (recibido {value})")
+        if num_predict is not None and num_predict == 0:
+            raise ValueError("num_predict debe ser positivo o -1 (sin límite)")
+        if temperature is not None and temperature < 0:
+            raise ValueError(f"temperature no puede ser negativa (recibido {temperature})")
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.temperature = temperature
+        self.num_thread = num_thread
+        self.seed = seed
+        self.keep_alive = keep_alive
+        self.extra = dict(extra or {})
+
+    def request_options(self) -> Dict:
+        """Campo `options` del request (solo los valores indicados)"""
+        options = {name: value for name, value in (
+            ("num_ctx", self.num_ctx), ("num_predict", self.num_predict), ("temperature", self.temperature),
+            ("num_thread", self.num_thread), ("seed", self.seed)) if value is not None}
+        options.update(self.extra)
+        return options
+
+    def apply(self, payload: Dict) -> Dict:
+        """Añade `options` y `keep_alive` a un payload de /api/generate o /api/chat"""
+        options = self.request_options()
+        if options:
+            payload["options"] = options
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def __repr__(self) -> str:
+        values = self.request_options()
+        if self.keep_alive is not None:
+            values["keep_alive"] = self.keep_alive
+        return f"OllamaOptions({', '.join(f'{name}={value!r}' for name, value in values.items())})"
+
+
+def parse_keep_alive(value: Optional[str]) -> Optional[Union[str, int]]:
+    """keep_alive de la línea de comandos: los números van como segundos, el resto ("30m") como texto"""
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class PrefixCacheStats:
+    """
+    Tokens y tiempo de evaluación del prompt por request, para medir la caché de prefijo
+
+    Un request "frío" evalúa el prompt completo; uno "caliente" reutiliza la caché
+    y evalúa menos tokens. El ahorro estimado es, por cada request caliente, la
+    diferencia entre el prompt_eval_duration medio frío y el suyo.
+    """
+
+    def __init__(self, warm_ratio: float = 0.9):
+        self.warm_ratio = warm_ratio
+        self._lock = threading.Lock()
+        self._samples = []  # (prompt_tokens, prompt_eval_duration_s)
+
+    def record(self, usage: Optional[Dict]):
+        if usage:
+            with self._lock:
+                self._samples.append((usage.get("prompt_tokens", 0), usage.get("prompt_eval_duration_s", 0.0)))
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return {"requests": 0}
+        full = max(tokens for tokens, _ in samples)
+        cold = [(t, d) for t, d in samples if t >= self.warm_ratio * full]
+        warm = [(t, d) for t, d in samples if t < self.warm_ratio * full]
+        mean = lambda values: sum(values) / len(values) if values else 0.0
+        cold_s = mean([d for _, d in cold])
+        warm_s = mean([d for _, d in warm])
+        return {
+            "requests": len(samples),
+            "cold_requests": len(cold),
+            "warm_requests": len(warm),
+            "full_prompt_tokens": full,
+            "reused_tokens": sum(full - t for t, _ in warm),
+            "cold_prompt_eval_s": round(cold_s, 4),
+            "warm_prompt_eval_s": round(warm_s, 4),
+            "prompt_eval_total_s": round(sum(d for _, d in samples), 3),
+            "saved_s": round(max(0.0, cold_s - warm_s) * len(warm), 3) if warm else 0.0
+        }
+
+    def print_summary(self):
+        metrics = self.metrics()
+        if not metrics["requests"]:
+            return
+        print(f"\n♻️ CACHÉ DE PREFIJO: {metrics['warm_requests']}/{metrics['requests']} requests reutilizaron el "
+              f"prompt ({metrics['reused_tokens']} tokens sin evaluar)")
+        if not metrics["warm_requests"]:
+            print("   Todos los requests evaluaron el prompt completo (o la caché ya estaba caliente desde "
+                  "el primero); compara con una ejecución sin --prefix-reuse")
+            return
+        print(f"   prompt_eval medio: {metrics['cold_prompt_eval_s']:.3f}s en frío, "
+              f"{metrics['warm_prompt_eval_s']:.3f}s con caché | total {metrics['prompt_eval_total_s']:.1f}s | "
+              f"ahorro estimado {metrics['saved_s']:.1f}s")
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Servidor Ollama simulado para pruebas locales sin GPU ni red
+
+Implementa los endpoints que usa el clasificador (/api/tags, /api/version,
+/api/generate y /api/chat) con una respuesta fija y acepta cuerpos con
+`Content-Encoding: gzip`; cuenta las conexiones TCP abiertas (keep-alive) e
+imita la caché de prefijo: un mensaje de sistema ya visto no cuenta en
+prompt_eval_count ni en prompt_eval_duration. Simula la cola del
+servidor: solo `capacity` requests se procesan a la vez y cada uno tarda
+`base_latency` segundos, así que la latencia observada crece con la
+concurrencia igual que en un Ollama real saturado; con `max_queue`, como
+OLLAMA_MAX_QUEUE, los requests que no caben en la cola reciben un 503.
+
+Uso:
+    python ollama_stub.py --port 11435 --latency 0.5 --capacity 2
+"""
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class _FifoSlots:
+    """Semáforo FIFO: los requests se atienden en orden de llegada, como en Ollama"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+        self._busy = 0
+
+    def __enter__(self):
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving or self._busy >= self.capacity:
+                self._cond.wait()
+            self._serving += 1
+            self._busy += 1
+            self._cond.notify_all()
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._busy -= 1
+            self._cond.notify_all()
+
+
+class StubOllamaServer:
+    """
+    Servidor HTTP en segundo plano que imita a Ollama
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 base_latency: float = 0.05, capacity: int = 4,
+                 response_text: str = "50",
+                 models: Optional[List[str]] = None,
+                 responses: Optional[Dict[str, str]] = None,
+                 max_queue: Optional[int] = None):
+        """
+        Args:
+            host: Dirección de escucha
+            port: Puerto (0 para elegir uno libre)
+            base_latency: Segundos de "inferencia" por request
+            capacity: Requests que el servidor procesa en paralelo
+            response_text: Texto devuelto por el modelo
+            models: Modelos que anuncia /api/tags
+            responses: Texto por modelo (p. ej. para probar una cascada); si el
+                modelo no aparece se usa response_text
+            max_queue: Requests que pueden esperar además de los `capacity` en curso;
+                el resto recibe 503 (None para una cola sin límite)
+        """
+        self.base_latency = base_latency
+        self.capacity = capacity
+        self.response_text = response_text
+        self.responses = responses or {}
+        self.models = models or ["gemma3:27b-it-qat"] + [m for m in self.responses if m != "gemma3:27b-it-qat"]
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._slots = _FifoSlots(capacity)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.connections = 0
+        self.last_request: Optional[Dict] = None
+        self._seen_prefixes = set()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "StubOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self) -> bool:
+        """Reserva sitio en la cola; False (y cuenta el rechazo) si está llena"""
+        with self._lock:
+            if self.max_queue is not None and self.in_flight >= self.capacity + self.max_queue:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def _generate(self, request: Dict, chat: bool) -> Dict:
+        """Respuesta de un request ya admitido con _admit"""
+        with self._lock:
+            self.requests += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.last_request = request
+            messages = request.get("messages") or []
+            prefix = messages[0].get("content") if messages and messages[0].get("role") == "system" else None
+            cached = prefix is not None and prefix in self._seen_prefixes
+            if prefix is not None:
+                self._seen_prefixes.add(prefix)
+        start = time.perf_counter()
+        try:
+            with self._slots:
+                time.sleep(self.base_latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        total_ns = int((time.perf_counter() - start) * 1e9)
+        eval_ns = int(self.base_latency * 1e9)
+        text = self.responses.get(request.get("model"), self.response_text)
+        prompt_tokens = len(json.dumps(request)) // 4
+        prompt_eval_ns = eval_ns // 2
+        if cached:
+            prefix_tokens = len(json.dumps(prefix)) // 4
+            prompt_eval_ns = prompt_eval_ns * (prompt_tokens - prefix_tokens) // prompt_tokens
+            prompt_tokens -= prefix_tokens
+        response = {
+            "model": request.get("model"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "total_duration": total_ns,
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": prompt_eval_ns,
+            "eval_count": max(1, len(text) // 4),
+            "eval_duration": eval_ns // 2
+        }
+        if chat:
+            # Varias imágenes en el último mensaje: una respuesta numerada por imagen
+            images = (request.get("messages") or [{}])[-1].get("images") or []
+            if len(images) > 1:
+                text = "\n".join(f"{i}: {text}" for i in range(1, len(images) + 1))
+            response["message"] = {"role": "assistant", "content": text}
+        else:
+            response["response"] = text
+        return response
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeceras y cuerpo van en escrituras separadas: sin esto cada respuesta por una
+            # conexión reutilizada espera ~40 ms al ACK retardado del cliente
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def _send_json(self, status: int, body: Dict):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": name} for name in server.models]})
+                elif self.path == "/api/version":
+                    self._send_json(200, {"version": "stub"})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                try:
+                    if self.headers.get("Content-Encoding") == "gzip":
+                        body = gzip.decompress(body)
+                    request = json.loads(body or b"{}")
+                except (OSError, json.JSONDecodeError):
+                    self._send_json(400, {"error": "invalid json"})
+                    return
+                if self.path not in ("/api/generate", "/api/chat"):
+                    self._send_json(404, {"error": "not found"})
+                elif not server._admit():
+                    self._send_json(503, {"error": "server busy, please try again. "
+                                                   "maximum pending requests exceeded"})
+                else:
+                    self._send_json(200, server._generate(request, chat=self.path == "/api/chat"))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="Segundos por request")
+    parser.add_argument("--capacity", type=int, default=2, help="Requests en paralelo")
+    parser.add_argument("--response", default="50", help="Texto devuelto por el modelo")
+    args = parser.parse_args()
+
+    server = StubOllamaServer(args.host, args.port, args.latency, args.capacity, args.response)
+    print(f"🧪 Ollama simulado en {server.url} (latencia {args.latency}s, capacidad {args.capacity})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Perfilado de una ejecución completa de los pipelines (--profile)
+
+Cuando una ejecución va lenta no se ve si el tiempo se va en PIL, base64,
+JSON, la pila HTTP o esperando al servidor. RunProfiler envuelve el `run()`
+real de classify_images_with_ollama.py o classify_with_gpt.py y recoge:
+
+- muestras de pila de todos los hilos cada `interval` segundos (modo
+  "sampling", poca sobrecarga) o además cProfile en cada hilo (modo
+  "cprofile", exacto pero más lento); las muestras de hilos ociosos (esperando
+  en threading/queue/concurrent.futures) se descartan, la espera de red no
+- instantáneas de tracemalloc al empezar, al terminar y en cada
+  `checkpoint(label)` de los pipelines (cada checkpoint de resultados)
+
+y escribe en `output_dir`:
+
+- stacks.folded: pilas colapsadas ("a;b;c N"), para flamegraph.pl o speedscope
+- summary.txt: funciones con más tiempo propio, focos de memoria y evolución
+  de la memoria en cada checkpoint
+- profile.pstats: estadísticas de cProfile (solo modo "cprofile"; snakeviz)
+
+Uso:
+    python classify_images_with_ollama.py images/ --workers 8 --profile
+    python classify_with_gpt.py --profile cprofile --profile-dir perfil_gpt
+    flamegraph.pl profile/stacks.folded > flamegraph.svg
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cli_env import env_default
+
+PROFILE_MODES = ("sampling", "cprofile")
+IDLE_FILES = ("threading.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"),
+              os.path.join("concurrent", "futures", "_base.py"), "selectors.py")
+
+_active: Optional["RunProfiler"] = None
+
+
+def checkpoint(label: str):
+    """Instantánea de memoria con el perfilador activo (sin --profile no hace nada)"""
+    if _active is not None:
+        _active.checkpoint(label)
+
+
+def _frame_name(code) -> str:
+    return f"{Path(code.co_filename).name}:{code.co_name}"
+
+
+class StackSampler:
+    """Hilo que cuenta las pilas de los demás hilos cada `interval` segundos"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if frame.f_code.co_filename.endswith(IDLE_FILES):
+                    self.idle_samples += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def self_time(self) -> List[Tuple[str, int]]:
+        """Muestras por función en la cima de la pila (tiempo propio), de mayor a menor"""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common()
+
+    def write_folded(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfiler:
+    """
+    Perfilador de una ejecución
+
+    Args:
+        mode: "sampling" (solo muestras de pila) o "cprofile" (además cProfile en cada hilo)
+        output_dir: Directorio de los informes
+        interval: Segundos entre muestras de pila
+        trace_memory: Tomar instantáneas de tracemalloc
+        top: Filas de cada tabla del resumen
+    """
+
+    def __init__(self, mode: str = "sampling", output_dir: str = "profile", interval: float = 0.005,
+                 trace_memory: bool = True, top: int = 25):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Modo de perfilado desconocido '{mode}'. Disponibles: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.output_dir = Path(output_dir)
+        self.trace_memory = trace_memory
+        self.top = top
+        self.sampler = StackSampler(interval)
+        self.checkpoints: List[Dict] = []
+        self._snapshots: List[Tuple[str, tracemalloc.Snapshot]] = []
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._start = None
+
+    def _profile_thread(self, *_):
+        """Gancho de threading.setprofile: arranca un cProfile propio en cada hilo nuevo"""
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        global _active
+        self._start = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+            self.checkpoint("inicio")
+        self.sampler.start()
+        if self.mode == "cprofile":
+            profile = cProfile.Profile()
+            self._profiles.append(profile)
+            # Desde Python 3.12 cProfile ya ve todos los hilos; antes hay que activarlo en cada uno
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+            profile.enable()
+        _active = self
+
+    def checkpoint(self, label: str):
+        if not self.trace_memory or not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._snapshots.append((label, snapshot))
+            self.checkpoints.append({"label": label, "elapsed_s": round(time.perf_counter() - self._start, 3),
+                                     "current_mb": round(current / 2**20, 2), "peak_mb": round(peak / 2**20, 2)})
+
+    def stop(self) -> Dict:
+        """Detiene la recogida y escribe los informes; devuelve las rutas escritas"""
+        global _active
+        _active = None
+        self.sampler.stop()
+        if self.mode == "cprofile":
+            threading.setprofile(None)
+            for profile in self._profiles:
+                profile.disable()
+        self.checkpoint("fin")
+        if self.trace_memory:
+            tracemalloc.stop()
+        return self.write_reports()
+
+    def _self_time_table(self) -> List[str]:
+        if self._profiles:
+            stats = pstats.Stats(*self._profiles)
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+            lines = [f"{'tiempo propio':>14} {'acumulado':>10} {'llamadas':>10}  función"]
+            for (filename, line, name), (_, calls, self_time, cumulative, _) in rows:
+                lines.append(f"{self_time:13.3f}s {cumulative:9.3f}s {calls:10d}  {Path(filename).name}:{line}({name})")
+            return lines
+        total = self.sampler.samples or 1
+        lines = [f"{'muestras':>10} {'%':>6}  función"]
+        for name, count in self.sampler.self_time()[:self.top]:
+            lines.append(f"{count:10d} {count / total:6.1%}  {name}")
+        return lines
+
+    def _memory_tables(self) -> List[str]:
+        if not self._snapshots:
+            return []
+        lines = ["", "MEMORIA POR CHECKPOINT", f"{'transcurrido':>12} {'actual':>10} {'pico':>10}  checkpoint"]
+        for point in self.checkpoints:
+            lines.append(f"{point['elapsed_s']:11.1f}s {point['current_mb']:8.1f}MB {point['peak_mb']:8.1f}MB  "
+                         f"{point['label']}")
+        # Se filtra al escribir el informe, no al tomar la instantánea, para no inflar el perfil
+        filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        snapshots = [(label, snapshot.filter_traces(filters)) for label, snapshot in self._snapshots]
+        first, last = snapshots[0][1], snapshots[-1][1]
+        lines += ["", "FOCOS DE MEMORIA (crecimiento desde el inicio)"]
+        for stat in last.compare_to(first, "lineno")[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size_diff / 2**20:9.2f}MB {stat.count_diff:+9d} bloques  "
+                         f"{Path(frame.filename).name}:{frame.lineno}")
+        busiest = max(snapshots, key=lambda item: sum(s.size for s in item[1].statistics("filename")))
+        lines += ["", f"FOCOS DE MEMORIA (mayor instantánea: {busiest[0]})"]
+        for stat in busiest[1].statistics("lineno")[:self.top]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 2**20:9.2f}MB {stat.count:9d} bloques  {Path(frame.filename).name}:{frame.lineno}")
+        return lines
+
+    def write_reports(self) -> Dict:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        paths = {"folded": self.output_dir / "stacks.folded", "summary": self.output_dir / "summary.txt"}
+        self.sampler.write_folded(paths["folded"])
+        if self._profiles:
+            paths["pstats"] = self.output_dir / "profile.pstats"
+            pstats.Stats(*self._profiles).dump_stats(paths["pstats"])
+
+        elapsed = time.perf_counter() - self._start
+        lines = [f"Perfil ({self.mode}) de {elapsed:.1f}s: {self.sampler.samples} muestras de pila activas, "
+                 f"{self.sampler.idle_samples} ociosas descartadas", "", "FUNCIONES POR TIEMPO PROPIO"]
+        lines += self._self_time_table() + self._memory_tables()
+        paths["summary"].write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+        print(f"\n🔬 PERFIL ({self.mode}, {elapsed:.1f}s)")
+        for line in self._self_time_table()[1:6]:
+            print(f"   {line.strip()}")
+        if self.checkpoints:
+            print(f"   Memoria: pico {max(p['peak_mb'] for p in self.checkpoints):.1f} MB trazados")
+        print(f"   Informes: {', '.join(str(path) for path in paths.values())}")
+        return paths
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser, env_prefix: str):
+    """Añade las opciones de perfilado a una línea de comandos"""
+    group = parser.add_argument_group("perfilado")
+    group.add_argument("--profile", nargs="?", const="sampling", choices=PROFILE_MODES,
+                       default=env_default(f"{env_prefix}_PROFILE"),
+                       help=f"Perfilar la ejecución: 'sampling' (por defecto) o 'cprofile' [{env_prefix}_PROFILE]")
+    group.add_argument("--profile-dir", default=env_default(f"{env_prefix}_PROFILE_DIR", "profile"),
+                       help=f"Directorio de los informes del perfil [{env_prefix}_PROFILE_DIR]")
+    group.add_argument("--profile-interval", type=float,
+                       default=env_default(f"{env_prefix}_PROFILE_INTERVAL", 0.005, float),
+                       help=f"Segundos entre muestras de pila [{env_prefix}_PROFILE_INTERVAL]")
+
+
+def run_profiled(args: argparse.Namespace, function: Callable, *function_args):
+    """Ejecuta function(*function_args), perfilada si se pidió --profile"""
+    if not args.profile:
+        return function(*function_args)
+    profiler = RunProfiler(args.profile, args.profile_dir, args.profile_interval)
+    profiler.start()
+    try:
+        return function(*function_args)
+    finally:
+        profiler.stop()
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Perfilado de tokens y compresión del prompt del sistema tridimensional
+
+El prompt se envía completo en cada request, así que cada token cuenta miles
+de veces. Esta herramienta:
+
+- Cuenta los tokens de cada sección (encabezados markdown) con un tokenizador
+  local: tiktoken si está instalado o una aproximación por bytes si no.
+- Genera variantes comprimidas: sin decoración (emojis fuera de los ejemplos
+  entre comillas, negritas, separadores, índice), con los ejemplos podados y
+  con cada sección eliminada (ablación).
+- Evalúa cada variante contra las columnas etiquetadas _ME sin depender de la
+  red: las respuestas se guardan en una caché JSONL que se puede reproducir
+  (modo replay) y existe un modo mock para probar el circuito completo.
+- Informa del compromiso tokens / precisión y recomienda la variante más
+  barata cuya precisión no baja más de una tolerancia respecto al original.
+
+Uso:
+    python prompt_profiler.py sections
+    python prompt_profiler.py evaluate --dataset clasificacion_ME_204_simple.csv --mode live --ablate
+    python prompt_profiler.py evaluate --dataset clasificacion_ME_204_simple.csv --mode replay
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+DEFAULT_PROMPT_FILE = "prompt_sistema-clasificacion-tridimensional.txt"
+DEFAULT_CACHE_FILE = "prompt_profile_cache.jsonl"
+PREAMBLE_TITLE = "(preámbulo)"
+
+HEADER_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$', re.MULTILINE)
+EMOJI_PATTERN = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]+")
+QUOTED_PATTERN = re.compile(r'"[^"\n]*"')
+QUOTED_LIST_PATTERN = re.compile(r'"[^"\n]*"(?:\s*,\s*"[^"\n]*")+')
+EXAMPLE_LINE_PATTERN = re.compile(r'^\s*(?:[-*•]\s*)?(?:Example:\s*)?"[^"\n]*"\s*(?:→|->)')
+EXAMPLE_BLOCK_PATTERN = re.compile(r'^\W*Input\b')
+
+
+class TokenCounter:
+    """
+    Cuenta tokens con tiktoken si está disponible
+
+    Sin tiktoken se aproxima con bytes UTF-8 / 4, que sobreestima algo el texto
+    en inglés y refleja que cada emoji cuesta varios tokens.
+    """
+
+    def __init__(self, encoding: str = "o200k_base"):
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding)
+            self.exact = True
+        except Exception:
+            self._encoding = None
+            self.exact = False
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return math.ceil(len(text.encode('utf-8')) / 4)
+
+
+def split_sections(text: str, level: int = 2) -> List[Tuple[str, str]]:
+    """
+    Divide un prompt markdown en secciones por sus encabezados
+
+    Args:
+        text: Prompt completo
+        level: Nivel máximo de encabezado que abre sección (2 = "##")
+
+    Returns:
+        Lista de (título, texto de la sección incluido su encabezado); el texto
+        anterior al primer encabezado es la sección "(preámbulo)". Unir los
+        textos reproduce el prompt original.
+    """
+    starts = [(m.start(), m.group(2).strip()) for m in HEADER_PATTERN.finditer(text)
+              if len(m.group(1)) <= level]
+    sections = []
+    if not starts or starts[0][0] > 0:
+        sections.append((PREAMBLE_TITLE, text[:starts[0][0] if starts else len(text)]))
+    for i, (start, title) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+        sections.append((title, text[start:end]))
+    return sections
+
+
+def _outside_quotes(line: str, transform: Callable[[str], str]) -> str:
+    """Aplica `transform` solo a las partes de la línea que no están entre comillas"""
+    parts = []
+    last = 0
+    for match in QUOTED_PATTERN.finditer(line):
+        parts.append(transform(line[last:match.start()]))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(transform(line[last:]))
+    return "".join(parts)
+
+
+def strip_decoration(text: str) -> str:
+    """
+    Quita la decoración que no aporta instrucciones
+
+    Elimina emojis (salvo dentro de ejemplos entre comillas, donde son parte de
+    la regla de separación), negritas, separadores "---", el índice y los
+    espacios sobrantes.
+    """
+    lines = []
+    in_toc = False
+    for line in text.splitlines():
+        if "TABLE OF CONTENTS" in line.upper():
+            in_toc = True
+            continue
+        if in_toc:
+            if line.strip():
+                continue
+            in_toc = False
+        if line.strip() == "---":
+            continue
+        line = _outside_quotes(line, lambda part: EMOJI_PATTERN.sub("", part.replace("**", "")))
+        lines.append(re.sub(r'(?<=\S) {2,}', ' ', line).rstrip())
+    return re.sub(r'\n{3,}', '\n\n', "\n".join(lines)).strip() + "\n"
+
+
+def prune_examples(text: str, keep: int = 1) -> str:
+    """
+    Deja como mucho `keep` ejemplos seguidos
+
+    Se podan las líneas de ejemplo ('- "texto" → ...'), los bloques
+    "Input" consecutivos y las listas de ejemplos entre comillas dentro
+    de una misma línea.
+    """
+    blocks = []
+    block_run = 0
+    for block in re.split(r'\n{2,}', text):
+        if EXAMPLE_BLOCK_PATTERN.match(block.strip()):
+            block_run += 1
+            if block_run > keep:
+                continue
+        else:
+            block_run = 0
+            lines = []
+            line_run = 0
+            for line in block.split("\n"):
+                if EXAMPLE_LINE_PATTERN.match(line):
+                    line_run += 1
+                    if line_run > keep:
+                        continue
+                else:
+                    line_run = 0
+                    line = QUOTED_LIST_PATTERN.sub(
+                        lambda m: ", ".join(QUOTED_PATTERN.findall(m.group(0))[:keep]), line)
+                lines.append(line)
+            block = "\n".join(lines)
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def build_variants(prompt: str, keep_examples: int = 1, ablate: bool = False,
+                   level: int = 2) -> Dict[str, str]:
+    """
+    Genera las variantes del prompt a evaluar
+
+    Returns:
+        Diccionario {nombre: prompt}; "original" siempre está incluido. Con
+        ablate=True se añade "sin:<sección>" por cada sección de nivel `level`.
+    """
+    stripped = strip_decoration(prompt)
+    variants = {
+        "original": prompt,
+        "sin_decoracion": stripped,
+        "ejemplos_podados": prune_examples(prompt, keep_examples),
+        "compacto": prune_examples(stripped, keep_examples),
+    }
+    if ablate:
+        sections = split_sections(prompt, level)
+        for i, (title, _) in enumerate(sections):
+            variants[f"sin:{title}"] = "".join(body for j, (_, body) in enumerate(sections) if j != i)
+    return variants
+
+
+def section_report(prompt: str, counter: TokenCounter, level: int = 2) -> List[Dict]:
+    """Tokens y caracteres de cada sección, con su porcentaje del total"""
+    total = counter.count(prompt)
+    report = []
+    for title, body in split_sections(prompt, level):
+        tokens = counter.count(body)
+        report.append({
+            "section": title,
+            "chars": len(body),
+            "tokens": tokens,
+            "share": round(tokens / total, 4) if total else 0.0
+        })
+    return report
+
+
+class ResponseCache:
+    """
+    Caché JSONL de respuestas por (modelo, prompt, frase)
+
+    Permite repetir la evaluación sin red: en modo replay las respuestas que no
+    están en la caché cuentan como no disponibles.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+
+    @staticmethod
+    def make_key(model: str, prompt: str, sentence: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}\0{sentence}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self._entries.get(key)
+
+    def put(self, key: str, entry: Dict):
+        entry = dict(entry, key=key)
+        with self._lock:
+            self._entries[key] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def live_responder(model: str) -> Callable[[str, str], Dict]:
+    """Responde llamando a la API de OpenAI con el cliente de classify_with_gpt"""
+    import classify_with_gpt
+
+    classify_with_gpt.require_client()
+    classify_with_gpt.MODEL = model
+
+    def respond(prompt: str, sentence: str) -> Dict:
+        usage = {"prompt_tokens": 0, "completion_tokens": 0}
+        response = classify_with_gpt.request_completion(
+            classify_with_gpt.build_messages(sentence, prompt), 0.1, usage)
+        return dict(usage, response=response.choices[0].message.content)
+
+    return respond
+
+
+def mock_responder(labels: Dict[str, str]) -> Callable[[str, str], Dict]:
+    """
+    Respuesta fija con las etiquetas dadas (p. ej. la clase mayoritaria)
+
+    Sirve para probar el circuito sin red; su precisión es la línea base trivial.
+    """
+    response = json.dumps({"sentences": [dict(labels)]})
+
+    def respond(prompt: str, sentence: str) -> Dict:
+        return {"response": response, "prompt_tokens": 0, "completion_tokens": 0}
+
+    return respond
+
+
+def true_labels(row: pd.Series) -> Tuple[str, str, str]:
+    """Etiquetas _ME normalizadas igual que build_result_row"""
+    from classify_with_gpt import normalize_categories
+
+    sense = normalize_categories(row['sense_ME'], 'sense')
+    reference = normalize_categories(row['reference_ME'], 'reference') if pd.notna(row['reference_ME']) else "NA"
+    attribution = str(row['attribution_ME']) if pd.notna(row['attribution_ME']) else "NA"
+    return sense, reference, attribution
+
+
+def evaluate_variant(name: str, prompt: str, df: pd.DataFrame, model: str,
+                     cache: ResponseCache, responder: Optional[Callable[[str, str], Dict]],
+                     counter: TokenCounter, max_workers: int = 1, use_cache: bool = True) -> Dict:
+    """
+    Evalúa una variante sobre el dataset
+
+    Args:
+        responder: Función (prompt, frase) -> {"response", "prompt_tokens", ...}
+            para las frases que no están en caché; None en modo replay
+        use_cache: Leer y guardar respuestas en `cache`; False en modo mock, cuyas
+            respuestas fijas no deben mezclarse con las reales del modelo
+
+    Returns:
+        Métricas de la variante: tokens, cobertura y precisión por dimensión
+    """
+    from classify_with_gpt import extract_classification, normalize_categories, parse_response_text
+
+    def answer(sentence: str) -> Optional[Dict]:
+        key = cache.make_key(model, prompt, sentence)
+        entry = cache.get(key) if use_cache else None
+        if entry is None and responder is not None:
+            try:
+                entry = responder(prompt, sentence)
+            except Exception as e:
+                # Un fallo de la API deja la frase sin respuesta (baja la cobertura) en lugar de abortar
+                print(f"⚠️ '{name}': sin respuesta para '{sentence[:40]}': {e}")
+                return None
+            if use_cache:
+                cache.put(key, dict(entry, model=model, variant=name))
+        return entry
+
+    sentences = df['frase'].tolist()
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = list(executor.map(answer, sentences))
+    else:
+        entries = [answer(sentence) for sentence in sentences]
+
+    hits = Counter()
+    answered = 0
+    api_prompt_tokens = []
+    for (_, row), entry in zip(df.iterrows(), entries):
+        if entry is None:
+            continue
+        answered += 1
+        if entry.get("prompt_tokens"):
+            api_prompt_tokens.append(entry["prompt_tokens"])
+        try:
+            predicted = extract_classification(parse_response_text(entry["response"]), row['frase'])
+        except (json.JSONDecodeError, TypeError, AttributeError):
+            predicted = ("ERROR", "ERROR", "ERROR")
+        expected = true_labels(row)
+        for dimension, pred, true in zip(("sense", "reference", "attribution"), predicted, expected):
+            if dimension != "attribution":
+                pred = normalize_categories(pred, dimension)
+            hits[dimension] += int(pred == true)
+
+    accuracy = {dimension: round(hits[dimension] / answered, 4) if answered else None
+                for dimension in ("sense", "reference", "attribution")}
+    mean = round(sum(accuracy.values()) / 3, 4) if answered else None
+    return {
+        "variant": name,
+        "prompt_tokens": counter.count(prompt),
+        "api_prompt_tokens": round(sum(api_prompt_tokens) / len(api_prompt_tokens)) if api_prompt_tokens else None,
+        "answered": answered,
+        "coverage": round(answered / len(df), 4) if len(df) else 0.0,
+        "accuracy": accuracy,
+        "mean_accuracy": mean
+    }
+
+
+def recommend(results: List[Dict], tolerance: float = 0.01) -> Optional[Dict]:
+    """
+    Variante más barata cuya precisión media no cae más de `tolerance` respecto al original
+
+    Solo compiten las variantes con al menos la cobertura del original: una precisión
+    calculada sobre las pocas frases que había en caché no es comparable.
+    """
+    baseline = next((r for r in results if r["variant"] == "original"), None)
+    if baseline is None or baseline["mean_accuracy"] is None:
+        return None
+    candidates = [r for r in results
+                  if r["mean_accuracy"] is not None and r["coverage"] >= baseline["coverage"]
+                  and r["mean_accuracy"] >= baseline["mean_accuracy"] - tolerance]
+    return min(candidates, key=lambda r: r["prompt_tokens"])
+
+
+def print_tradeoff(results: List[Dict], recommended: Optional[Dict]):
+    """Tabla tokens / precisión de las variantes"""
+    baseline_tokens = next((r["prompt_tokens"] for r in results if r["variant"] == "original"), None)
+    print(f"\n{'VARIANTE':<45} {'TOKENS':>7} {'AHORRO':>7} {'COBERT.':>7} "
+          f"{'SENSE':>6} {'REF.':>6} {'ATTR.':>6} {'MEDIA':>6}")
+    for r in sorted(results, key=lambda r: r["prompt_tokens"]):
+        saving = f"{1 - r['prompt_tokens'] / baseline_tokens:.0%}" if baseline_tokens else "-"
+        acc = r["accuracy"]
+        fmt = lambda v: f"{v:.3f}" if v is not None else "  -  "
+        mark = " ⭐" if recommended is not None and r["variant"] == recommended["variant"] else ""
+        print(f"{r['variant'][:45]:<45} {r['prompt_tokens']:>7} {saving:>7} {r['coverage']:>7.0%} "
+              f"{fmt(acc['sense']):>6} {fmt(acc['reference']):>6} {fmt(acc['attribution']):>6} "
+              f"{fmt(r['mean_accuracy']):>6}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfilado de tokens y compresión de prompts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sections_parser = subparsers.add_parser("sections", help="Tokens por sección del prompt")
+    sections_parser.add_argument("--prompt", default=DEFAULT_PROMPT_FILE)
+    sections_parser.add_argument("--level", type=int, default=2, help="Nivel de encabezado que abre sección")
+
+    eval_parser = subparsers.add_parser("evaluate", help="Evaluar variantes contra las etiquetas _ME")
+    eval_parser.add_argument("--prompt", default=DEFAULT_PROMPT_FILE)
+    eval_parser.add_argument("--dataset", required=True, help="CSV con frase y columnas sense_ME/reference_ME/attribution_ME")
+    eval_parser.add_argument("--model", default="gpt-4o-mini-2024-07-18")
+    eval_parser.add_argument("--mode", choices=["live", "replay", "mock"], default="replay",
+                             help="live: API para lo que falte en caché; replay: solo caché; "
+                                  "mock: respuesta fija (sin leer ni escribir la caché)")
+    eval_parser.add_argument("--cache", default=DEFAULT_CACHE_FILE, help="Caché JSONL de respuestas")
+    eval_parser.add_argument("--sample", type=int, default=None, help="Evaluar solo N frases (muestra fija)")
+    eval_parser.add_argument("--keep-examples", type=int, default=1, help="Ejemplos seguidos que se conservan al podar")
+    eval_parser.add_argument("--ablate", action="store_true", help="Añadir una variante sin cada sección")
+    eval_parser.add_argument("--level", type=int, default=2, help="Nivel de las secciones para la ablación")
+    eval_parser.add_argument("--variants", default=None, help="Evaluar solo estas variantes (separadas por comas)")
+    eval_parser.add_argument("--tolerance", type=float, default=0.01, help="Pérdida de precisión media aceptable")
+    eval_parser.add_argument("--workers", type=int, default=1, help="Requests en paralelo en modo live")
+    eval_parser.add_argument("--report", default="prompt_profile.json", help="Informe JSON")
+    eval_parser.add_argument("--export-dir", default=None, help="Guardar el texto de cada variante en este directorio")
+    args = parser.parse_args()
+
+    prompt = Path(args.prompt).read_text(encoding='utf-8')
+    counter = TokenCounter()
+    if not counter.exact:
+        print("⚠️ tiktoken no está instalado: los tokens son una aproximación (bytes / 4)")
+
+    if args.command == "sections":
+        report = section_report(prompt, counter, args.level)
+        print(f"\n📏 {args.prompt}: {counter.count(prompt)} tokens, {len(prompt)} caracteres\n")
+        for entry in sorted(report, key=lambda e: -e["tokens"]):
+            print(f"{entry['tokens']:>6} tokens {entry['share']:>6.1%}  {entry['section']}")
+        return
+
+    df = pd.read_csv(args.dataset)
+    if args.sample:
+        df = df.sample(n=min(args.sample, len(df)), random_state=0)
+
+    variants = build_variants(prompt, args.keep_examples, args.ablate, args.level)
+    if args.variants:
+        wanted = {"original"} | set(args.variants.split(","))
+        variants = {name: text for name, text in variants.items() if name in wanted}
+    if args.export_dir:
+        export_dir = Path(args.export_dir)
+        export_dir.mkdir(parents=True, exist_ok=True)
+        for name, text in variants.items():
+            safe_name = re.sub(r'[^\w.-]+', '_', name).strip('_')
+            (export_dir / f"{safe_name}.txt").write_text(text, encoding='utf-8')
+
+    responder = None
+    if args.mode == "live":
+        responder = live_responder(args.model)
+    elif args.mode == "mock":
+        majority = {dimension: Counter(true_labels(row)[i] for _, row in df.iterrows()).most_common(1)[0][0]
+                    for i, dimension in enumerate(("sense", "reference", "attribution"))}
+        responder = mock_responder(majority)
+
+    cache = ResponseCache(args.cache)
+    results = []
+    for name, text in variants.items():
+        print(f"🧪 Evaluando '{name}' ({counter.count(text)} tokens)...")
+        results.append(evaluate_variant(name, text, df, args.model, cache, responder, counter, args.workers,
+                                        use_cache=args.mode != "mock"))
+
+    recommended = recommend(results, args.tolerance)
+    print_tradeoff(results, recommended)
+    if recommended is not None:
+        print(f"\n⭐ Recomendada: '{recommended['variant']}' ({recommended['prompt_tokens']} tokens, "
+              f"precisión media {recommended['mean_accuracy']})")
+
+    report = {
+        "prompt_file": args.prompt,
+        "model": args.model,
+        "mode": args.mode,
+        "exact_tokens": counter.exact,
+        "rows": len(df),
+        "sections": section_report(prompt, counter, args.level),
+        "variants": results,
+        "recommended": recommended["variant"] if recommended else None
+    }
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"💾 Informe guardado en '{args.report}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Servicio de clasificación continua con una cola local persistente (SQLite)
+
+En lugar de lanzar un lote por directorio, un worker de larga duración toma
+trabajos de la cola con leases y tiempo de visibilidad: si el worker muere a
+mitad de un trabajo, el lease caduca y otro lo retoma; los fallos se
+reintentan hasta `max_attempts`. El modelo permanece cargado y el pipeline
+saturado entre lotes. Una pequeña API HTTP permite a otros servicios encolar
+imágenes y consultar su estado.
+
+Uso:
+    python queue_service.py serve --db queue.db --port 8765 \
+        --prompt capital=prompt_capital-erotico.txt --workers 4 --model gemma3:27b-it-qat --max-image-size 1024
+    python queue_service.py enqueue images_folder --db queue.db --prompt capital
+
+serve acepta las opciones del clasificador de classify_images_with_ollama.py
+(--model, --url, --timeout, --retries, --max-image-size, --jpeg-quality y sus
+variables OLLAMA_*) y registra sus prompts en la base de datos: enqueue solo
+acepta prompts registrados.
+
+API:
+    POST /jobs        {"path": "...", "prompt": "capital"}  o  {"jobs": [{...}, ...]}
+    GET  /jobs/<id>   estado y resultado de un trabajo
+    GET  /stats       número de trabajos por estado
+"""
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_path TEXT NOT NULL,
+    prompt_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, lease_until);
+CREATE TABLE IF NOT EXISTS prompts (
+    name TEXT PRIMARY KEY,
+    registered_at REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """
+    Cola de trabajos persistente en SQLite con leases
+
+    Estados: queued -> leased -> done | failed (o de vuelta a queued si se reintenta).
+    Cada hilo usa su propia conexión.
+    """
+
+    def __init__(self, db_path: str, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, image_path: str, prompt_name: str) -> int:
+        """Añade un trabajo y devuelve su id"""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO jobs (image_path, prompt_name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (str(image_path), prompt_name, now, now)
+        )
+        return cursor.lastrowid
+
+    def register_prompts(self, names: List[str]):
+        """Registra los prompts que conoce un worker (serve), para validar lo que se encola por línea de comandos"""
+        now = time.time()
+        self._connect().executemany("INSERT OR REPLACE INTO prompts (name, registered_at) VALUES (?, ?)",
+                                    [(name, now) for name in names])
+
+    def known_prompts(self) -> List[str]:
+        """Prompts registrados por algún worker de esta cola"""
+        return [row["name"] for row in self._connect().execute("SELECT name FROM prompts ORDER BY name")]
+
+    def lease(self, worker_id: str, limit: int, visibility_timeout: float) -> List[Dict]:
+        """
+        Reserva hasta `limit` trabajos pendientes (o con lease caducado) para un worker
+
+        Los trabajos con lease caducado que ya agotaron sus intentos se marcan como fallidos.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease caducado tras el último intento', "
+                "updated_at = ? WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'leased' AND lease_until < ?) "
+                "ORDER BY id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            for row in rows:
+                conn.execute(
+                    "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_until = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + visibility_timeout, now, row["id"])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [dict(row, attempts=row["attempts"] + 1) for row in rows]
+
+    def extend(self, job_ids: List[int], worker_id: str, visibility_timeout: float) -> int:
+        """
+        Renueva el lease de trabajos en curso (heartbeat) para que no caduquen mientras se procesan
+
+        Returns:
+            Número de leases renovados (los que ya no son de este worker no se tocan)
+        """
+        if not job_ids:
+            return 0
+        now = time.time()
+        placeholders = ", ".join("?" * len(job_ids))
+        cursor = self._connect().execute(
+            f"UPDATE jobs SET lease_until = ?, updated_at = ? "
+            f"WHERE id IN ({placeholders}) AND status = 'leased' AND lease_owner = ?",
+            (now + visibility_timeout, now, *job_ids, worker_id)
+        )
+        return cursor.rowcount
+
+    def complete(self, job_id: int, worker_id: str, result: Dict) -> bool:
+        """Marca un trabajo como terminado (solo si el lease sigue siendo de este worker)"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, result: Optional[Dict] = None) -> bool:
+        """Registra un fallo: vuelve a la cola o queda fallido si agotó los intentos"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "error = ?, result = ?, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (self.max_attempts, error, json.dumps(result, ensure_ascii=False) if result else None,
+             time.time(), job_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """Estado de un trabajo"""
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def stats(self) -> Dict[str, int]:
+        """Número de trabajos por estado"""
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+class QueueWorker:
+    """
+    Worker que toma trabajos de la cola y los clasifica con OllamaImageClassifier
+    """
+
+    def __init__(self, queue: JobQueue, classifier, prompts: Dict[str, str],
+                 max_workers: int = 1, visibility_timeout: float = 600.0,
+                 poll_interval: float = 1.0, worker_id: Optional[str] = None):
+        """
+        Args:
+            queue: Cola de trabajos
+            classifier: OllamaImageClassifier ya configurado
+            prompts: Prompts disponibles {nombre: texto}
+            max_workers: Trabajos procesados en paralelo
+            visibility_timeout: Segundos que dura un lease antes de que otro worker pueda retomarlo
+            poll_interval: Espera cuando la cola está vacía
+            worker_id: Identificador del worker (por defecto host:pid:objeto)
+        """
+        self.queue = queue
+        self.classifier = classifier
+        self.prompts = prompts
+        self.max_workers = max_workers
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{id(self)}"
+        self._stop = threading.Event()
+        self._in_flight: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        self._stop.set()
+
+    def process_job(self, job: Dict):
+        """Clasifica un trabajo y registra el resultado en la cola"""
+        prompt = self.prompts.get(job["prompt_name"])
+        if prompt is None:
+            self.queue.fail(job["id"], self.worker_id, f"Prompt desconocido: {job['prompt_name']}")
+            return
+        try:
+            result = self.classifier.classify_file(job["image_path"], prompt)
+        except Exception as e:
+            self.queue.fail(job["id"], self.worker_id, f"Error inesperado: {e}")
+            return
+        if result.get("error"):
+            self.queue.fail(job["id"], self.worker_id, result["error"], result)
+        else:
+            self.queue.complete(job["id"], self.worker_id, result)
+
+    def _run_job(self, job: Dict, slots: threading.BoundedSemaphore):
+        try:
+            self.process_job(job)
+        finally:
+            with self._lock:
+                self._in_flight.discard(job["id"])
+            slots.release()
+
+    def _heartbeat(self, done: threading.Event):
+        """Renueva los leases en curso cada tercio del tiempo de visibilidad hasta que terminen (`done`)"""
+        interval = max(0.05, self.visibility_timeout / 3)
+        while not done.wait(interval):
+            with self._lock:
+                job_ids = sorted(self._in_flight)
+            self.queue.extend(job_ids, self.worker_id, self.visibility_timeout)
+
+    def run(self):
+        """
+        Bucle principal: toma trabajos hasta que se llame a stop()
+
+        Cada hueco libre toma un trabajo nuevo en cuanto queda libre, sin esperar
+        al resto (una imagen lenta no bloquea a las demás), y un hilo de
+        heartbeat renueva los leases de los trabajos en curso para que no se
+        vuelvan a entregar a otro worker mientras se procesan.
+
+        Con stop() o Ctrl-C no se toman más trabajos y se espera a que terminen
+        los que están en curso (con el heartbeat activo); un segundo Ctrl-C deja
+        de esperar y esos trabajos se retoman al caducar su lease.
+        """
+        print(f"👷 Worker {self.worker_id} esperando trabajos...")
+        slots = threading.BoundedSemaphore(self.max_workers)
+        drained = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(drained,), name="lease-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    while not self._stop.is_set():
+                        if not slots.acquire(timeout=self.poll_interval):
+                            continue
+                        jobs = self.queue.lease(self.worker_id, 1, self.visibility_timeout)
+                        if not jobs:
+                            slots.release()
+                            self._stop.wait(self.poll_interval)
+                            continue
+                        with self._lock:
+                            self._in_flight.add(jobs[0]["id"])
+                        executor.submit(self._run_job, jobs[0], slots)
+                except KeyboardInterrupt:
+                    self._stop.set()
+                with self._lock:
+                    in_flight = len(self._in_flight)
+                if in_flight:
+                    print(f"\n⏳ Esperando a {in_flight} trabajos en curso (Ctrl-C otra vez para no esperar)...")
+        finally:
+            drained.set()
+
+
+def make_api_server(queue: JobQueue, prompts: Dict[str, str], host: str, port: int) -> ThreadingHTTPServer:
+    """Crea el servidor HTTP de envío y consulta de trabajos"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: Dict):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except json.JSONDecodeError:
+                self._send_json(400, {"error": "JSON inválido"})
+                return
+            jobs = body.get("jobs", [body]) if isinstance(body, dict) else None
+            if not isinstance(jobs, list):
+                self._send_json(400, {"error": "Se espera un objeto JSON con un trabajo o con 'jobs': [...]"})
+                return
+            for job in jobs:
+                if not isinstance(job, dict) or not job.get("path") or job.get("prompt") not in prompts:
+                    self._send_json(400, {"error": "Cada trabajo necesita 'path' y un 'prompt' válido",
+                                          "prompts": sorted(prompts)})
+                    return
+            ids = [queue.enqueue(job["path"], job["prompt"]) for job in jobs]
+            self._send_json(202, {"ids": ids})
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, queue.stats())
+            elif self.path.startswith("/jobs/"):
+                try:
+                    job = queue.get(int(self.path[len("/jobs/"):]))
+                except ValueError:
+                    job = None
+                if job is None:
+                    self._send_json(404, {"error": "Trabajo no encontrado"})
+                else:
+                    self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def load_prompts(specs: List[str]) -> Dict[str, str]:
+    """Carga prompts desde especificaciones "nombre=archivo" """
+    prompts = {}
+    for spec in specs:
+        name, _, path = spec.partition("=")
+        if not path:
+            raise ValueError(f"Prompt inválido '{spec}': se espera nombre=archivo")
+        prompts[name] = Path(path).read_text(encoding='utf-8')
+    return prompts
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from classify_images_with_ollama import add_classifier_arguments, classifier_from_args
+
+    parser = argparse.ArgumentParser(description="Servicio de clasificación con cola persistente")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Arrancar API HTTP y worker")
+    serve_parser.add_argument("--db", default="queue.db")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--prompt", action="append", default=[], required=True,
+                              help="Prompt disponible, en formato nombre=archivo (repetible)")
+    serve_parser.add_argument("--workers", type=int, default=1, help="Trabajos en paralelo")
+    serve_parser.add_argument("--visibility-timeout", type=float, default=600.0)
+    serve_parser.add_argument("--max-attempts", type=int, default=3)
+    serve_parser.add_argument("--no-worker", action="store_true", help="Solo API, sin worker")
+    add_classifier_arguments(serve_parser)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Encolar todas las imágenes de un directorio")
+    enqueue_parser.add_argument("directory")
+    enqueue_parser.add_argument("--db", default="queue.db")
+    enqueue_parser.add_argument("--prompt", required=True,
+                                help="Nombre de un prompt registrado por 'serve' en la misma --db")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "enqueue":
+        queue = JobQueue(args.db)
+        known = queue.known_prompts()
+        if args.prompt not in known:
+            print(f"❌ Prompt desconocido '{args.prompt}'. Prompts registrados en '{args.db}': "
+                  f"{', '.join(known) if known else 'ninguno (arranca antes serve con --prompt nombre=archivo)'}")
+            return 2
+        extensions = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif'}
+        paths = [p for p in Path(args.directory).iterdir() if p.is_file() and p.suffix.lower() in extensions]
+        for path in paths:
+            queue.enqueue(str(path.resolve()), args.prompt)
+        print(f"✅ {len(paths)} trabajos encolados en '{args.db}'")
+        return 0
+
+    prompts = load_prompts(args.prompt)
+    queue = JobQueue(args.db, max_attempts=args.max_attempts)
+    queue.register_prompts(sorted(prompts))
+    server = make_api_server(queue, prompts, args.host, args.port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🌐 API en http://{args.host}:{args.port} (prompts: {sorted(prompts)})")
+
+    if args.no_worker:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    classifier = classifier_from_args(args)
+    if not classifier.check_connection():
+        print("❌ No se puede continuar sin conexión con Ollama")
+        return 1
+    worker = QueueWorker(queue, classifier, prompts, max_workers=args.workers,
+                         visibility_timeout=args.visibility_timeout)
+    try:
+        worker.run()
+        print("\n👋 Worker detenido; los trabajos en curso terminaron")
+    except KeyboardInterrupt:
+        worker.stop()
+        print("\n👋 Worker detenido sin esperar; los trabajos en curso se retomarán al caducar su lease")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Grabación y reproducción de respuestas de Ollama y OpenAI
+
+En modo grabación cada request HTTP de una ejecución real se guarda en un
+archivo JSONL comprimido con gzip: huella del request (método, ruta y cuerpo
+JSON canónico), cuerpo de la respuesta y latencia medida. En modo reproducción
+un transporte sirve esas respuestas sin red, esperando la latencia original
+(o escalada), de modo que el parseo, el pipeline y la concurrencia se pueden
+probar offline con la distribución de latencias de producción.
+
+- Ollama: adaptadores de `requests` montados en la sesión del clasificador
+- OpenAI: transportes de `httpx` en el cliente (`http_client`)
+
+Uso:
+    python classify_images_with_ollama.py images_folder --record run.jsonl.gz
+    python classify_images_with_ollama.py images_folder --replay run.jsonl.gz --replay-latency-scale 0.5
+    python replay.py stats run.jsonl.gz
+"""
+
+import argparse
+import atexit
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cli_env import env_default
+
+
+def request_fingerprint(method: str, url: str, body: Optional[Union[str, bytes]]) -> str:
+    """
+    Huella de un request: método, ruta (sin host) y cuerpo
+
+    Los cuerpos JSON se descomprimen si van con gzip y se normalizan (claves
+    ordenadas) para que la huella no dependa de la codificación; el host no
+    cuenta para poder reproducir contra cualquier URL.
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    body = body or b""
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode('utf-8')
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{method.upper()} {urlsplit(url).path}\n".encode('utf-8'))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class ReplayArchive:
+    """
+    Archivo de respuestas grabadas (JSONL con gzip, una respuesta por línea)
+
+    Un mismo request puede aparecer varias veces (p. ej. muestras de
+    auto-consistencia): al reproducir se sirven en el orden en que se grabaron
+    y después se repite la última.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._entries: Dict[str, List[Dict]] = defaultdict(list)
+        self._served: Counter = Counter()
+
+    @classmethod
+    def for_recording(cls, path: Union[str, Path]) -> "ReplayArchive":
+        """Abre el archivo para añadir respuestas (se cierra al salir del proceso)"""
+        archive = cls(path)
+        archive._writer = gzip.open(archive.path, "at", encoding="utf-8")
+        atexit.register(archive.close)
+        return archive
+
+    @classmethod
+    def for_replay(cls, path: Union[str, Path]) -> "ReplayArchive":
+        archive = cls(path)
+        for entry in archive.entries():
+            archive._entries[entry["fingerprint"]].append(entry)
+        print(f"📼 {sum(len(e) for e in archive._entries.values())} respuestas grabadas en '{archive.path}'")
+        return archive
+
+    def entries(self):
+        """Recorre las respuestas grabadas (tolera un archivo cortado por una ejecución interrumpida)"""
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+            except (EOFError, json.JSONDecodeError):
+                print(f"⚠️ '{self.path}' termina de forma incompleta; se usan las respuestas anteriores")
+
+    def record(self, method: str, url: str, body, status: int, content: bytes,
+               content_type: Optional[str], latency_s: float):
+        entry = {
+            "fingerprint": request_fingerprint(method, url, body),
+            "method": method.upper(),
+            "path": urlsplit(url).path,
+            "status": status,
+            "content_type": content_type,
+            "body": content.decode('utf-8', errors='replace'),
+            "latency_s": round(latency_s, 4),
+            "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with self._lock:
+            self._writer.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._writer.flush()
+
+    def lookup(self, method: str, url: str, body) -> Optional[Dict]:
+        """Respuesta grabada para un request, o None si no se grabó"""
+        fingerprint = request_fingerprint(method, url, body)
+        with self._lock:
+            entries = self._entries.get(fingerprint)
+            if not entries:
+                return None
+            position = min(self._served[fingerprint], len(entries) - 1)
+            self._served[fingerprint] += 1
+            return entries[position]
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+def _missing(method: str, url: str) -> str:
+    return f"No hay respuesta grabada para {method.upper()} {urlsplit(url).path} con este cuerpo"
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Adaptador de requests que envía normalmente y graba cada respuesta"""
+
+    def __init__(self, archive: ReplayArchive, **kwargs):
+        self.archive = archive
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        latency = time.perf_counter() - start
+        self.archive.record(request.method, request.url, request.body, response.status_code,
+                            response.content, response.headers.get("Content-Type"), latency)
+        return response
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Adaptador de requests que responde desde un ReplayArchive sin usar la red
+
+    Args:
+        archive: Respuestas grabadas
+        latency_scale: Factor sobre la latencia grabada (0 = responder sin esperar)
+    """
+
+    def __init__(self, archive: ReplayArchive, latency_scale: float = 1.0):
+        self.archive = archive
+        self.latency_scale = latency_scale
+        super().__init__()
+
+    def send(self, request, **kwargs):
+        entry = self.archive.lookup(request.method, request.url, request.body)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(_missing(request.method, request.url), request=request)
+        if self.latency_scale > 0:
+            time.sleep(entry["latency_s"] * self.latency_scale)
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response._content = entry["body"].encode('utf-8')
+        response.headers["Content-Type"] = entry.get("content_type") or "application/json"
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+
+def install_session(session: requests.Session, mode: str, archive: ReplayArchive,
+                    latency_scale: float = 1.0):
+    """
+    Monta el adaptador de grabación ("record") o reproducción ("replay") en una sesión
+
+    El de grabación conserva la política de reintentos y el pool del adaptador que reemplaza.
+    """
+    if mode == "record":
+        current = session.get_adapter("http://")
+        adapter = RecordingAdapter(archive, max_retries=current.max_retries,
+                                   pool_connections=current._pool_connections, pool_maxsize=current._pool_maxsize)
+    else:
+        adapter = ReplayAdapter(archive, latency_scale)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def openai_transport(mode: str, archive: ReplayArchive, latency_scale: float = 1.0, **transport_kwargs):
+    """
+    Transporte httpx que graba o reproduce las respuestas (ver TransportConfig.openai_http_client)
+
+    `transport_kwargs` (pool, HTTP/2) se aplican al transporte de grabación.
+    """
+    import httpx
+
+    class RecordingTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            start = time.perf_counter()
+            response = super().handle_request(request)
+            content = response.read()
+            archive.record(request.method, str(request.url), request.content, response.status_code,
+                           content, response.headers.get("content-type"), time.perf_counter() - start)
+            return httpx.Response(response.status_code, headers=response.headers, content=content,
+                                  request=request)
+
+    class ReplayTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            entry = archive.lookup(request.method, str(request.url), request.read())
+            if entry is None:
+                raise httpx.ConnectError(_missing(request.method, str(request.url)), request=request)
+            if latency_scale > 0:
+                time.sleep(entry["latency_s"] * latency_scale)
+            return httpx.Response(entry["status"], content=entry["body"].encode('utf-8'), request=request,
+                                  headers={"content-type": entry.get("content_type") or "application/json"})
+
+    return RecordingTransport(**transport_kwargs) if mode == "record" else ReplayTransport()
+
+
+def add_replay_arguments(parser: argparse.ArgumentParser, env_prefix: str):
+    """Añade las opciones de grabación/reproducción a una línea de comandos"""
+    group = parser.add_argument_group("grabación")
+    group.add_argument("--record", default=env_default(f"{env_prefix}_RECORD"), metavar="ARCHIVO",
+                       help=f"Grabar cada respuesta y su latencia en ARCHIVO (.jsonl.gz) [{env_prefix}_RECORD]")
+    group.add_argument("--replay", default=env_default(f"{env_prefix}_REPLAY"), metavar="ARCHIVO",
+                       help=f"Responder desde una grabación, sin backend [{env_prefix}_REPLAY]")
+    group.add_argument("--replay-latency-scale", type=float,
+                       default=env_default(f"{env_prefix}_REPLAY_LATENCY_SCALE", 1.0, float),
+                       help=f"Factor sobre la latencia grabada al reproducir, 0 = sin esperas "
+                            f"[{env_prefix}_REPLAY_LATENCY_SCALE]")
+
+
+def archive_from_args(args: argparse.Namespace) -> Optional[ReplayArchive]:
+    """Abre el archivo de add_replay_arguments (None si no se graba ni se reproduce)"""
+    if args.record and args.replay:
+        raise ValueError("--record y --replay no se pueden usar a la vez")
+    if args.record:
+        print(f"⏺️ Grabando respuestas en '{args.record}'")
+        return ReplayArchive.for_recording(args.record)
+    if args.replay:
+        return ReplayArchive.for_replay(args.replay)
+    return None
+
+
+def replay_mode(args: argparse.Namespace) -> str:
+    return "record" if args.record else "replay"
+
+
+def latency_stats(path: Union[str, Path]) -> Dict[str, Dict]:
+    """Número de respuestas, estados y percentiles de latencia por ruta de una grabación"""
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+    for entry in ReplayArchive(path).entries():
+        latencies[entry["path"]].append(entry["latency_s"])
+        statuses[entry["path"]][entry["status"]] += 1
+    stats = {}
+    for route, values in latencies.items():
+        values.sort()
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        stats[route] = {
+            "requests": len(values),
+            "status": dict(statuses[route]),
+            "mean_s": round(sum(values) / len(values), 4),
+            "p50_s": pick(0.50),
+            "p90_s": pick(0.90),
+            "p99_s": pick(0.99),
+            "max_s": values[-1]
+        }
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Herramientas para grabaciones de respuestas")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="Latencias por ruta de una grabación")
+    stats_parser.add_argument("archive", help="Archivo .jsonl.gz grabado con --record")
+    args = parser.parse_args()
+
+    for route, stats in latency_stats(args.archive).items():
+        print(f"📼 {route}: {stats['requests']} requests {stats['status']} | media {stats['mean_s']:.3f}s | "
+              f"p50 {stats['p50_s']:.3f}s | p90 {stats['p90_s']:.3f}s | p99 {stats['p99_s']:.3f}s | "
+              f"máx {stats['max_s']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
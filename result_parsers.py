@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Parsers de respuestas de clasificación de imágenes
+
+Convierten el texto libre del modelo en campos tipados (puntuación 0-100,
+marca "NA" o el JSON pedido en el prompt) dentro del propio pipeline, para
+que los consumidores no tengan que volver a parsear decenas de miles de
+cadenas. Un fallo de parseo queda marcado en el registro y permite reintentar
+solo esos ítems.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from self_consistency import parse_number, parse_score
+
+JSON_BLOCK_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+
+@dataclass
+class ParsedResult:
+    """Resultado tipado y compacto de parsear una respuesta"""
+    __slots__ = ("ok", "value", "score", "is_na", "error")
+    ok: bool
+    value: Any
+    score: Optional[float]
+    is_na: bool
+    error: Optional[str]
+
+    @classmethod
+    def success(cls, value: Any, score: Optional[float] = None, is_na: bool = False) -> "ParsedResult":
+        return cls(True, value, score, is_na, None)
+
+    @classmethod
+    def failure(cls, error: str) -> "ParsedResult":
+        return cls(False, None, None, False, error)
+
+    def to_record(self) -> Dict:
+        """Campos que se añaden al registro de resultados"""
+        return {
+            "score": self.score,
+            "is_na": self.is_na,
+            "parsed": self.value,
+            "parse_error": self.error
+        }
+
+
+class NumericScoreParser:
+    """Exige una puntuación numérica dentro de [min_value, max_value]"""
+
+    name = "score"
+
+    def __init__(self, min_value: float = 0, max_value: float = 100):
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def parse(self, text: str) -> ParsedResult:
+        value = parse_number(text)
+        if not isinstance(value, float):
+            return ParsedResult.failure(f"No es una puntuación: {text[:50]!r}")
+        if not self.min_value <= value <= self.max_value:
+            return ParsedResult.failure(f"Puntuación fuera de rango: {value}")
+        return ParsedResult.success(value, score=value)
+
+
+class NAScoreParser(NumericScoreParser):
+    """Como NumericScoreParser, pero acepta "NA" como respuesta válida"""
+
+    name = "na_score"
+
+    def parse(self, text: str) -> ParsedResult:
+        if parse_score(text) == "NA":
+            return ParsedResult.success("NA", is_na=True)
+        return super().parse(text)
+
+
+class JSONParser:
+    """
+    Extrae el objeto JSON de la respuesta y valida los campos requeridos
+
+    Args:
+        required: Diccionario {campo: tipo o tupla de tipos} que debe cumplir el JSON
+        score_field: Campo numérico que se copia a `score` (opcional)
+    """
+
+    name = "json"
+
+    def __init__(self, required: Optional[Dict[str, Any]] = None, score_field: Optional[str] = None):
+        self.required = required or {}
+        self.score_field = score_field
+
+    def parse(self, text: str) -> ParsedResult:
+        match = JSON_BLOCK_PATTERN.search(text)
+        if not match:
+            return ParsedResult.failure("No se encontró JSON en la respuesta")
+        try:
+            data = json.loads(match.group(0))
+        except json.JSONDecodeError as e:
+            return ParsedResult.failure(f"JSON inválido: {e}")
+        if not isinstance(data, dict):
+            return ParsedResult.failure("El JSON no es un objeto")
+        for field, expected_type in self.required.items():
+            if field not in data:
+                return ParsedResult.failure(f"Falta el campo '{field}'")
+            if not isinstance(data[field], expected_type):
+                return ParsedResult.failure(f"Tipo inválido en '{field}'")
+
+        score = None
+        is_na = False
+        if self.score_field is not None:
+            raw = data.get(self.score_field)
+            if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+                score = float(raw)
+            elif isinstance(raw, str) and parse_score(raw) == "NA":
+                is_na = True
+        return ParsedResult.success(data, score=score, is_na=is_na)
+
+
+PARSERS = {
+    NumericScoreParser.name: NumericScoreParser,
+    NAScoreParser.name: NAScoreParser,
+    JSONParser.name: JSONParser,
+}
+
+
+def get_parser(name: str, **kwargs):
+    """Crea un parser por nombre ("score", "na_score" o "json")"""
+    if name not in PARSERS:
+        raise ValueError(f"Parser desconocido: {name}. Opciones: {sorted(PARSERS)}")
+    return PARSERS[name](**kwargs)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Reglas locales para las frases de identidad triviales, sin llamar al LLM
+
+Buena parte de las entradas son de una o dos palabras ("Estudiante", "25
+años", "Soy de Madrid", "🇪🇸") y su clasificación se deduce del propio prompt
+tridimensional. RuleEngine:
+
+- separa las frases con las reglas deterministas del prompt (puntuación,
+  saltos de línea, 2+ espacios, viñetas, emojis y mayúscula tras una palabra
+  en minúscula), con expresiones regulares precompiladas
+- reconoce cada frase completa con reglas de alta confianza: edad, lugar de
+  residencia o nacimiento ("Vivo en X", "Nací en X"), origen solo si X está
+  en la lista de lugares conocidos ("Soy de Madrid" sí, "Soy de Letras" no),
+  banderas y un trie de palabras clave por categoría de referencia (género,
+  salud, profesión, estudios, nacionalidad); el trie solo incluye las
+  categorías presentes en REFERENCE_MAPPING y SENSE_MAPPING de
+  classify_with_gpt.py, de donde salen también las etiquetas
+- solo responde si TODAS las frases de la entrada están cubiertas; cualquier
+  palabra de más (p. ej. un adjetivo evaluativo) manda la entrada al modelo,
+  así que un error de separación solo reduce la cobertura
+
+Una fracción de las entradas cubiertas (audit_rate) se envía igualmente al
+modelo para medir el acuerdo, en total y por dimensión.
+
+Uso (cobertura y acuerdo con las etiquetas _ME y, opcionalmente, con una
+ejecución anterior del modelo, sin llamar a la API):
+    python rule_engine.py clasificacion_ME_204_simple.csv --results gpt_classification_results.csv
+"""
+
+import argparse
+import random
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from label_propagation import DIMENSIONS, Labels
+
+# Separadores explícitos: puntuación final, saltos de línea, 2+ espacios y viñetas/guiones sueltos
+SEPARATOR_PATTERN = re.compile(r"[.!?;]+(?=\s|$)|\r?\n+| {2,}|\t+|\s[-–—|]+\s|[•·]+|^[-–—]\s")
+OPENING_MARKS = re.compile(r"^[¡¿\"'(]+|[\"')]+$")
+# Banderas (pares de indicadores regionales) y emojis con modificadores y secuencias ZWJ
+EMOJI_PATTERN = re.compile(
+    "((?:[\U0001F1E6-\U0001F1FF]{2})+"
+    "|[\U0001F300-\U0001FAFF\u2600-\u27BF\u2B50]"
+    "(?:[\uFE0F\U0001F3FB-\U0001F3FF]|\u200D[\U0001F300-\U0001FAFF\u2600-\u27BF])*)")
+FLAGS_ONLY = re.compile(r"^(?:[\U0001F1E6-\U0001F1FF]{2})+$")
+# Palabras tras las que una mayúscula es un nombre propio y no una frase nueva
+CONNECTORS = frozenset("de del la las los el en desde y e from in at of the and".split())
+
+FILLER_PATTERN = re.compile(r"^(?:(?:yo\s+)?soy|i\s+am|i'?m)\s+(?:(?:un|una|a|an)\s+)?")
+AGE_PATTERN = re.compile(r"^(?:tengo\s+)?\d{1,2}\s*(?:anos|years?(?:\s+old)?|y/?o|yo)$")
+PLACE = r"(?P<place>[A-ZÁÉÍÓÚÑ][\w'-]*(?:\s+(?:de\s+(?:la\s+)?|del\s+|y\s+)?[A-ZÁÉÍÓÚÑ][\w'-]*)*)"
+# Verbos que solo significan residencia o nacimiento: basta un nombre propio detrás
+RESIDENCE_PATTERN = re.compile(
+    r"^(?:(?:yo\s+)?(?:vivo|resido)|nac[ií]|i\s+live|i\s+was\s+born|born|living|lives|based)\s+(?:en|in)\s+"
+    + PLACE + "$")
+# "Soy de X", "From X", "En X"...: también "Soy de Letras" o "In Love", así que X tiene que ser un lugar conocido
+ORIGIN_PATTERN = re.compile(
+    r"^(?:(?:(?:yo\s+)?soy|i\s+am|i'?m)\s+)?(?:de|desde|en|from|in)\s+" + PLACE + "$")
+
+# Lugares que se aceptan tras "soy de", "from", "en"... (en minúsculas y sin tildes, ver fold)
+KNOWN_PLACES = frozenset(place.strip() for place in """
+    espana, spain, mexico, argentina, colombia, venezuela, chile, peru, ecuador, bolivia, paraguay,
+    uruguay, cuba, guatemala, honduras, nicaragua, panama, el salvador, costa rica, puerto rico,
+    republica dominicana, francia, france, italia, italy, alemania, germany, portugal, reino unido,
+    united kingdom, inglaterra, england, escocia, scotland, irlanda, ireland, estados unidos,
+    united states, eeuu, usa, canada, brasil, brazil, marruecos, morocco, china, japon, japan, rusia,
+    russia, ucrania, ukraine, rumania, romania, polonia, poland, holanda, paises bajos, netherlands,
+    belgica, belgium, suiza, switzerland, austria, suecia, sweden, noruega, norway, dinamarca,
+    denmark, grecia, greece, europa, europe, latinoamerica,
+    andalucia, aragon, asturias, baleares, islas baleares, canarias, islas canarias, cantabria,
+    castilla y leon, castilla-la mancha, castilla la mancha, cataluna, catalunya, comunidad valenciana,
+    extremadura, galicia, la rioja, navarra, pais vasco, euskadi, region de murcia,
+    madrid, barcelona, valencia, sevilla, zaragoza, malaga, murcia, palma, palma de mallorca,
+    las palmas, las palmas de gran canaria, bilbao, alicante, cordoba, valladolid, vigo, gijon,
+    granada, a coruna, la coruna, vitoria, elche, oviedo, santander, pamplona, almeria,
+    san sebastian, donostia, burgos, albacete, castellon, logrono, badajoz, salamanca, huelva,
+    lleida, lerida, tarragona, leon, cadiz, jaen, ourense, orense, girona, gerona, lugo, caceres,
+    guadalajara, toledo, pontevedra, palencia, ciudad real, zamora, avila, cuenca, huesca, segovia,
+    soria, teruel, ceuta, melilla, tenerife, santa cruz de tenerife, gran canaria, mallorca, ibiza,
+    menorca, jerez, cartagena, marbella, getafe, mostoles, alcala de henares, leganes, fuenlabrada,
+    alcorcon, buenos aires, rosario, mendoza, bogota, medellin, cali, barranquilla, caracas,
+    maracaibo, lima, quito, guayaquil, santiago, santiago de chile, valparaiso, la paz, montevideo,
+    asuncion, la habana, ciudad de mexico, monterrey, puebla, tijuana, san jose, san juan,
+    santo domingo, londres, london, paris, roma, rome, berlin, lisboa, lisbon, oporto, porto,
+    nueva york, new york, los angeles, miami, chicago, toronto, amsterdam, bruselas, brussels
+""".split(","))
+
+# Categoría de referencia (clave de REFERENCE_MAPPING) -> (categoría de sense de SENSE_MAPPING,
+# palabras clave en español, en inglés). En español basta la forma masculina: keyword_variants
+# añade la femenina. Atribución siempre "No"
+KEYWORD_RULES: Dict[str, Tuple[str, Sequence[str], Sequence[str]]] = {
+    "Gender": ("Physical", ("hombre", "mujer", "chico", "varon"),
+               ("man", "woman", "girl", "boy", "male", "female")),
+    "Health identity": ("Physical", ("celiaco", "diabetico"), ("celiac", "diabetic")),
+    "Job": ("Collective", (
+        "medico", "doctor", "enfermero", "ingeniero", "profesor", "maestro", "abogado", "arquitecto",
+        "programador", "desarrollador", "psicologo", "periodista", "fotografo", "dentista", "farmaceutico",
+        "veterinario", "fisioterapeuta", "bombero", "policia", "camarero", "cocinero", "administrativo",
+        "funcionario", "autonomo"), (
+        "doctor", "nurse", "engineer", "software engineer", "teacher", "lawyer", "architect", "developer",
+        "psychologist", "journalist", "photographer", "dentist", "pharmacist", "physiotherapist", "waiter",
+        "chef")),
+    "Educational role": ("Collective", (
+        "estudiante", "universitario", "estudiante universitario", "alumno", "opositor"),
+        ("student", "university student")),
+    "State identity": ("Collective", (
+        "espanol", "argentino", "mexicano", "colombiano", "venezolano", "chileno", "peruano", "frances",
+        "italiano", "portugues", "aleman", "americano"), (
+        "spanish", "mexican", "colombian", "venezuelan", "chilean", "peruvian", "french", "italian",
+        "portuguese", "german", "american")),
+}
+# Terminaciones masculinas del español -> femeninas (médico/médica, profesor/profesora, francés/francesa...)
+FEMININE_ENDINGS = (("o", "a"), ("or", "ora"), ("ol", "ola"), ("es", "esa"), ("an", "ana"))
+LOCATION_RULE = ("Local", "Collective")
+FLAG_RULE = ("State identity", "Collective")
+AGE_RULE = ("Age", "Physical")
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes, para comparar palabras clave"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char)).strip()
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Separa una entrada en frases con las reglas deterministas del prompt
+
+    Ejemplo:
+        split_sentences("25 años\\nMédico 👨‍⚕️ estudiante Trabajo en Madrid")
+        -> ["25 años", "Médico", "👨‍⚕️", "estudiante", "Trabajo en Madrid"]
+    """
+    sentences = []
+    for chunk in SEPARATOR_PATTERN.split(text):
+        for piece in EMOJI_PATTERN.split(chunk or ""):
+            piece = OPENING_MARKS.sub("", piece.strip(" ,:-–—")).strip()
+            if not piece:
+                continue
+            if EMOJI_PATTERN.fullmatch(piece):
+                sentences.append(piece)
+                continue
+            # Mayúscula tras una palabra en minúscula = frase nueva (salvo nombres propios tras "de", "en"...)
+            words = piece.split()
+            current = [words[0]]
+            for previous, word in zip(words, words[1:]):
+                if word[0].isupper() and previous[0].islower() and previous.lower() not in CONNECTORS:
+                    sentences.append(" ".join(current))
+                    current = []
+                current.append(word)
+            sentences.append(" ".join(current))
+    return sentences
+
+
+def keyword_variants(keyword: str) -> List[str]:
+    """Palabra clave en español y, si alguna palabra tiene terminación masculina, su femenino"""
+    words = keyword.split()
+    feminine = []
+    for word in words:
+        for masculine, ending in FEMININE_ENDINGS:
+            if word.endswith(masculine):
+                word = word[:len(word) - len(masculine)] + ending
+                break
+        feminine.append(word)
+    return [keyword] if feminine == words else [keyword, " ".join(feminine)]
+
+
+class KeywordTrie:
+    """Trie de palabras (no de caracteres) que reconoce frases clave completas de una o varias palabras"""
+
+    _END = object()
+
+    def __init__(self):
+        self.root: Dict = {}
+
+    def add(self, phrase: str, payload):
+        node = self.root
+        for token in fold(phrase).split():
+            node = node.setdefault(token, {})
+        node[self._END] = payload
+
+    def match(self, tokens: Sequence[str]):
+        """Payload de la frase clave que coincide con TODOS los tokens, o None"""
+        node = self.root
+        for token in tokens:
+            node = node.get(token)
+            if node is None:
+                return None
+        return node.get(self._END)
+
+
+class RuleStats:
+    """Contadores de cobertura por regla y de acuerdo en la auditoría"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = 0
+        self.answered = 0
+        self.rules: Counter = Counter()
+        self.audited = 0
+        self.audit_agreed = 0
+        self.dimension_agreed = {dimension: 0 for dimension in DIMENSIONS}
+
+    def record(self, match: Optional[Dict], answered: bool):
+        with self._lock:
+            self.items += 1
+            self.answered += int(answered)
+            if answered:
+                self.rules.update(sentence["rule"] for sentence in match["sentences"])
+
+    def record_audit(self, predicted: Labels, actual: Labels):
+        with self._lock:
+            self.audited += 1
+            self.audit_agreed += int(tuple(predicted) == tuple(actual))
+            for dimension, p, a in zip(DIMENSIONS, predicted, actual):
+                self.dimension_agreed[dimension] += int(p == a)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            audit = None
+            if self.audited:
+                audit = {"items": self.audited, "accuracy": round(self.audit_agreed / self.audited, 4)}
+                audit.update({dimension: round(agreed / self.audited, 4)
+                              for dimension, agreed in self.dimension_agreed.items()})
+            return {
+                "items": self.items,
+                "answered": self.answered,
+                "coverage": round(self.answered / self.items, 4) if self.items else 0.0,
+                "rules": dict(self.rules.most_common()),
+                "audit": audit
+            }
+
+    def print_summary(self):
+        metrics = self.metrics()
+        if not metrics["items"]:
+            return
+        print(f"\n📏 REGLAS: {metrics['answered']}/{metrics['items']} frases sin llamar al modelo "
+              f"({metrics['coverage']:.1%})")
+        if metrics["rules"]:
+            print("   Por regla: " + ", ".join(f"{rule} {count}" for rule, count in metrics["rules"].items()))
+        audit = metrics["audit"]
+        if audit:
+            per_dimension = ", ".join(f"{dimension} {audit[dimension]:.1%}" for dimension in DIMENSIONS)
+            print(f"   Auditoría: {audit['accuracy']:.1%} de acuerdo con el modelo en {audit['items']} frases "
+                  f"({per_dimension})")
+
+
+class RuleEngine:
+    """
+    Clasificador local de entradas triviales
+
+    Args:
+        reference_mapping: Categoría de referencia -> jerarquía superior (REFERENCE_MAPPING)
+        sense_mapping: Categoría de sense -> jerarquía superior (SENSE_MAPPING)
+        audit_rate: Fracción de entradas cubiertas que se envían también al modelo
+        seed: Semilla de la selección de auditoría
+    """
+
+    def __init__(self, reference_mapping: Dict[str, str], sense_mapping: Dict[str, str],
+                 audit_rate: float = 0.05, seed: Optional[int] = None):
+        self.reference_mapping = reference_mapping
+        self.sense_mapping = sense_mapping
+        self.audit_rate = audit_rate
+        self.stats = RuleStats()
+        self.trie = KeywordTrie()
+        # Solo las categorías que existen en los mapeos de normalize_categories
+        for reference in reference_mapping:
+            if reference not in KEYWORD_RULES:
+                continue
+            sense, spanish, english = KEYWORD_RULES[reference]
+            if sense not in sense_mapping:
+                continue
+            for keyword in [variant for keyword in spanish for variant in keyword_variants(keyword)] + list(english):
+                self.trie.add(keyword, (reference, sense))
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _labels(self, reference: str, sense: str) -> Labels:
+        return self.sense_mapping[sense], self.reference_mapping[reference], "No"
+
+    @staticmethod
+    def _is_location(sentence: str) -> bool:
+        if RESIDENCE_PATTERN.match(sentence):
+            return True
+        origin = ORIGIN_PATTERN.match(sentence)
+        return origin is not None and fold(origin.group("place")) in KNOWN_PLACES
+
+    def match_sentence(self, sentence: str) -> Optional[Tuple[str, Labels]]:
+        """(regla, etiquetas) de una frase ya separada, o None si ninguna regla la cubre entera"""
+        if FLAGS_ONLY.match(sentence):
+            rule = FLAG_RULE
+        elif self._is_location(sentence[:1].lower() + sentence[1:]):
+            rule = LOCATION_RULE
+        else:
+            folded = FILLER_PATTERN.sub("", fold(sentence))
+            rule = AGE_RULE if AGE_PATTERN.match(folded) else self.trie.match(folded.split())
+        if rule is None:
+            return None
+        reference, sense = rule
+        return reference, self._labels(reference, sense)
+
+    def lookup(self, text: str) -> Optional[Dict]:
+        """
+        Clasificación local de una entrada
+
+        Returns:
+            {"sentences": [{"text", "rule", "labels"}], "audit"} o None si alguna frase no está
+            cubierta; con audit=True la entrada debe clasificarse igualmente y compararse con observe()
+        """
+        sentences = []
+        for sentence in split_sentences(str(text)):
+            matched = self.match_sentence(sentence)
+            if matched is None:
+                return None
+            sentences.append({"text": sentence, "rule": matched[0], "labels": matched[1]})
+        if not sentences:
+            return None
+        with self._lock:
+            audit = self.audit_rate > 0 and self._random.random() < self.audit_rate
+        return {"sentences": sentences, "audit": audit}
+
+    def observe(self, match: Optional[Dict], labels: Labels):
+        """Compara una entrada auditada con las etiquetas del modelo (primera frase, como extract_classification)"""
+        if match is not None and "ERROR" not in labels:
+            self.stats.record_audit(match["sentences"][0]["labels"], labels)
+
+
+def coverage_report(engine: RuleEngine, sentences: Iterable[str],
+                    references: Dict[str, Sequence[Labels]]) -> Dict:
+    """
+    Cobertura de las reglas y acuerdo con cada juego de etiquetas de referencia
+
+    Args:
+        engine: Motor de reglas
+        sentences: Entradas a clasificar
+        references: Nombre -> etiquetas (sense, reference, attribution) por entrada; None si esa
+            referencia no tiene etiquetas para la entrada (no cuenta en su acuerdo)
+    """
+    sentences = list(sentences)
+    matches = [engine.lookup(sentence) for sentence in sentences]
+    covered = [i for i, match in enumerate(matches) if match is not None]
+    report = {"items": len(sentences), "answered": len(covered),
+              "coverage": round(len(covered) / len(sentences), 4) if sentences else 0.0,
+              "rules": dict(Counter(matches[i]["sentences"][0]["rule"] for i in covered).most_common()),
+              "agreement": {}}
+    for name, labels in references.items():
+        pairs = [(tuple(matches[i]["sentences"][0]["labels"]), tuple(labels[i])) for i in covered
+                 if labels[i] is not None]
+        if pairs:
+            agreement = {"items": len(pairs), "accuracy": round(sum(p == a for p, a in pairs) / len(pairs), 4)}
+            for position, dimension in enumerate(DIMENSIONS):
+                agreement[dimension] = round(sum(p[position] == a[position] for p, a in pairs) / len(pairs), 4)
+            report["agreement"][name] = agreement
+    return report
+
+
+def main():
+    import pandas as pd
+
+    from classify_with_gpt import REFERENCE_MAPPING, SENSE_MAPPING, normalize_categories, read_results_csv, row_key
+
+    parser = argparse.ArgumentParser(description="Cobertura y acuerdo de las reglas locales")
+    parser.add_argument("input", help="CSV con la columna 'frase' (y las etiquetas _ME si las hay)")
+    parser.add_argument("--results", default=None,
+                        help="CSV de resultados de classify_with_gpt.py para medir el acuerdo con el modelo")
+    parser.add_argument("--show", type=int, default=10, help="Ejemplos cubiertos a mostrar")
+    args = parser.parse_args()
+
+    engine = RuleEngine(REFERENCE_MAPPING, SENSE_MAPPING, audit_rate=0.0)
+    df = pd.read_csv(args.input)
+    references = {}
+    if {"sense_ME", "reference_ME", "attribution_ME"} <= set(df.columns):
+        references["etiquetas _ME"] = [
+            (normalize_categories(row['sense_ME'], 'sense'), normalize_categories(row['reference_ME'], 'reference'),
+             str(row['attribution_ME']) if pd.notna(row['attribution_ME']) else "NA")
+            for _, row in df.iterrows()]
+    if args.results:
+        # Las entradas sin resultado o con ERROR no cuentan en el acuerdo con el modelo
+        predicted = {row_key(row): (row['sense_predicted'], row['reference_predicted'], row['attribution_predicted'])
+                     for _, row in read_results_csv(args.results).iterrows()}
+        references["modelo"] = [None if "ERROR" in predicted.get(row_key(row), ("ERROR",))
+                                else predicted[row_key(row)] for _, row in df.iterrows()]
+
+    report = coverage_report(engine, df['frase'].astype(str), references)
+    print(f"📏 {report['answered']}/{report['items']} frases cubiertas por las reglas ({report['coverage']:.1%})")
+    if report["rules"]:
+        print("   Por regla: " + ", ".join(f"{rule} {count}" for rule, count in report["rules"].items()))
+    for name, agreement in report["agreement"].items():
+        per_dimension = ", ".join(f"{dimension} {agreement[dimension]:.1%}" for dimension in DIMENSIONS)
+        print(f"   Acuerdo con {name}: {agreement['accuracy']:.1%} en {agreement['items']} frases ({per_dimension})")
+    shown = 0
+    for sentence in df['frase'].astype(str):
+        match = engine.lookup(sentence)
+        if match is not None and shown < args.show:
+            labels = " | ".join(f"{s['text']} -> {s['rule']} {'/'.join(s['labels'])}" for s in match["sentences"])
+            print(f"   • {labels}")
+            shown += 1
+
+
+if __name__ == "__main__":
+    main()
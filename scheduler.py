@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Planificador de requests con prioridades y plazos, del lado del cliente
+
+El mismo Ollama atiende clasificaciones interactivas (`classify_single_image`)
+y lotes enormes (`process_directory`). Sin planificador, un request interactivo
+espera detrás de todos los del lote. PriorityScheduler limita los requests en
+vuelo (`capacity`) y:
+
+- atiende primero la clase interactiva y, dentro de cada clase, el plazo más
+  próximo (EDF) y después el orden de llegada
+- reserva `reserved` huecos que el lote no puede ocupar, para que un request
+  interactivo no tenga que esperar a que termine uno del lote
+- descarta con DeadlineExpired los requests cuyo plazo vence mientras esperan
+- mide la espera en cola de cada clase
+
+La clase y el plazo de los requests de un hilo se fijan con `request_class()`,
+así no hace falta pasarlos por todas las capas del clasificador. El
+planificador coordina los hilos de un proceso, no varios procesos.
+
+Uso (simulación de un lote con consultas interactivas intercaladas):
+    python scheduler.py --capacity 4 --reserved 1 --latency 0.2
+"""
+
+import argparse
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+_context = threading.local()
+
+
+class DeadlineExpired(Exception):
+    """El plazo del request venció antes de que hubiera un hueco libre"""
+
+
+@contextmanager
+def request_class(priority: str = BATCH, deadline: Optional[float] = None):
+    """
+    Fija la clase y el plazo (instante de time.monotonic()) de los requests de este hilo
+
+    Ejemplo:
+        with request_class(INTERACTIVE):
+            classifier.classify_image(image, prompt)
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Prioridad desconocida '{priority}'. Disponibles: {', '.join(PRIORITIES)}")
+    previous = getattr(_context, "value", None)
+    _context.value = (priority, deadline)
+    try:
+        yield
+    finally:
+        _context.value = previous
+
+
+def current_request_class() -> Tuple[str, Optional[float]]:
+    """Clase y plazo vigentes en este hilo (por defecto lote sin plazo)"""
+    return getattr(_context, "value", None) or (BATCH, None)
+
+
+class PriorityScheduler:
+    """
+    Semáforo de requests en vuelo con prioridades, plazos y huecos reservados
+
+    Args:
+        capacity: Requests en vuelo como máximo (normalmente los que Ollama procesa en paralelo)
+        reserved: Huecos que solo puede usar la clase interactiva
+        window: Esperas recientes por clase usadas para los percentiles
+    """
+
+    def __init__(self, capacity: int, reserved: int = 1, window: int = 10000):
+        self.capacity = max(1, capacity)
+        self.reserved = max(0, min(reserved, self.capacity - 1))
+        self.in_flight: Counter = Counter()
+        self.expired: Counter = Counter()
+        self._waits: Dict[str, deque] = {priority: deque(maxlen=window) for priority in PRIORITIES}
+        self._waiting = []
+        self._sequence = 0
+        self._cond = threading.Condition()
+
+    def _can_start(self, priority: str) -> bool:
+        if sum(self.in_flight.values()) >= self.capacity:
+            return False
+        return priority == INTERACTIVE or self.in_flight[BATCH] < self.capacity - self.reserved
+
+    def _next_eligible(self) -> Optional[Tuple]:
+        eligible = [entry for entry in self._waiting if self._can_start(entry[3])]
+        return min(eligible) if eligible else None
+
+    def acquire(self, priority: str = BATCH, deadline: Optional[float] = None):
+        """
+        Espera un hueco para un request
+
+        Raises:
+            DeadlineExpired: si `deadline` (time.monotonic()) pasa antes de conseguirlo
+        """
+        start = time.monotonic()
+        with self._cond:
+            self._sequence += 1
+            entry = (PRIORITIES[priority], deadline if deadline is not None else float("inf"),
+                     self._sequence, priority)
+            self._waiting.append(entry)
+            while self._next_eligible() is not entry:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(entry)
+                    self.expired[priority] += 1
+                    self._cond.notify_all()
+                    raise DeadlineExpired(f"Plazo vencido tras {time.monotonic() - start:.1f}s en cola")
+                self._cond.wait(remaining)
+            self._waiting.remove(entry)
+            self.in_flight[priority] += 1
+            self._waits[priority].append(time.monotonic() - start)
+
+    def release(self, priority: str = BATCH):
+        with self._cond:
+            self.in_flight[priority] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Ocupa un hueco con la clase y el plazo de request_class() durante el bloque"""
+        priority, deadline = current_request_class()
+        self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def metrics(self) -> Dict:
+        """Espera en cola por clase (media, p50, p95 y máximo en segundos) y requests descartados"""
+        with self._cond:
+            metrics = {"capacity": self.capacity, "reserved": self.reserved, "classes": {}}
+            for priority, waits in self._waits.items():
+                values = sorted(waits)
+                if not values and not self.expired[priority]:
+                    continue
+                pick = lambda q: round(values[min(len(values) - 1, int(q * len(values)))], 4) if values else None
+                metrics["classes"][priority] = {
+                    "requests": len(values),
+                    "expired": self.expired[priority],
+                    "mean_wait_s": round(sum(values) / len(values), 4) if values else None,
+                    "p50_wait_s": pick(0.50),
+                    "p95_wait_s": pick(0.95),
+                    "max_wait_s": round(values[-1], 4) if values else None
+                }
+            return metrics
+
+    def print_summary(self):
+        metrics = self.metrics()
+        if not metrics["classes"]:
+            return
+        print(f"\n🚦 PLANIFICADOR: {metrics['capacity']} huecos, {metrics['reserved']} reservados para interactivos")
+        for priority, stats in metrics["classes"].items():
+            if stats["requests"]:
+                print(f"   {priority}: {stats['requests']} requests | espera media {stats['mean_wait_s']:.3f}s | "
+                      f"p95 {stats['p95_wait_s']:.3f}s | máx {stats['max_wait_s']:.3f}s | "
+                      f"{stats['expired']} con plazo vencido")
+            else:
+                print(f"   {priority}: {stats['expired']} con plazo vencido")
+
+
+def main():
+    """Simula un lote que satura el servidor con consultas interactivas intercaladas"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from classify_images_with_ollama import OllamaImageClassifier
+    from ollama_stub import StubOllamaServer
+
+    parser = argparse.ArgumentParser(description="Simulación del planificador con prioridades")
+    parser.add_argument("--requests", type=int, default=100, help="Requests del lote")
+    parser.add_argument("--workers", type=int, default=16, help="Hilos del lote")
+    parser.add_argument("--capacity", type=int, default=4, help="Requests en paralelo del servidor")
+    parser.add_argument("--reserved", type=int, default=1, help="Huecos reservados para interactivos")
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos por request del servidor")
+    parser.add_argument("--interactive-every", type=float, default=0.5,
+                        help="Segundos entre consultas interactivas")
+    parser.add_argument("--batch-deadline", type=float, default=None,
+                        help="Plazo en segundos de cada request del lote")
+    args = parser.parse_args()
+
+    scheduler = PriorityScheduler(args.capacity, args.reserved)
+    with StubOllamaServer(base_latency=args.latency, capacity=args.capacity) as server:
+        classifier = OllamaImageClassifier(ollama_url=server.url, scheduler=scheduler, max_retries=1)
+        done = threading.Event()
+
+        def batch_item(_):
+            deadline = time.monotonic() + args.batch_deadline if args.batch_deadline else None
+            with request_class(BATCH, deadline):
+                try:
+                    classifier.classify_image("AAAA", "test")
+                except DeadlineExpired:
+                    pass
+
+        def interactive():
+            while not done.wait(args.interactive_every):
+                with request_class(INTERACTIVE):
+                    classifier.classify_image("AAAA", "test")
+
+        thread = threading.Thread(target=interactive, daemon=True)
+        thread.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(batch_item, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        thread.join()
+
+    print(f"\n📊 Lote de {args.requests} requests en {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)")
+    scheduler.print_summary()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Utilidades de auto-consistencia (self-consistency) para clasificaciones ruidosas
+
+Se piden varias muestras del mismo ítem en paralelo y se agregan: voto por
+mayoría para categorías y mediana / media recortada para puntuaciones 0-100.
+El muestreo se detiene antes si las primeras muestras ya coinciden, de modo que
+solo los ítems ambiguos consumen las k muestras completas.
+"""
+
+import re
+import statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple, Union
+
+NA_PATTERN = re.compile(r'^\W*N\s*/?\s*A\W*$', re.IGNORECASE)
+SCORE_PATTERN = re.compile(r'(?<![\d.])(\d{1,3}(?:[.,]\d+)?)(?![\d])')
+NUMBER_PATTERN = re.compile(r'(?<![\d.])(-?\d+(?:[.,]\d+)?)(?![\d])')
+
+
+def parse_score(text: Optional[str]) -> Union[float, str, None]:
+    """
+    Interpreta una respuesta de puntuación
+
+    Returns:
+        "NA" si la respuesta es NA, la puntuación (0-100) como float,
+        o None si no se puede interpretar
+    """
+    if text is None:
+        return None
+    text = text.strip().strip('"\'')
+    if NA_PATTERN.match(text):
+        return "NA"
+    match = SCORE_PATTERN.search(text)
+    if not match:
+        return None
+    value = float(match.group(1).replace(',', '.'))
+    if 0 <= value <= 100:
+        return value
+    return None
+
+
+def parse_number(text: Optional[str]) -> Union[float, str, None]:
+    """
+    Como parse_score, pero con cualquier número (sin exigir el rango 0-100)
+
+    Returns:
+        "NA" si la respuesta es NA, el primer número como float, o None si no hay ninguno
+    """
+    if text is None:
+        return None
+    text = text.strip().strip('"\'')
+    if NA_PATTERN.match(text):
+        return "NA"
+    match = NUMBER_PATTERN.search(text)
+    return float(match.group(1).replace(',', '.')) if match else None
+
+
+def majority_vote(values: Sequence[Hashable]) -> Tuple[Hashable, float]:
+    """
+    Voto por mayoría (en caso de empate gana el primero en aparecer)
+
+    Returns:
+        (valor ganador, fracción de muestras que lo respaldan)
+    """
+    counts = Counter(values)
+    winner = max(counts, key=lambda v: (counts[v], -values.index(v)))
+    return winner, counts[winner] / len(values)
+
+
+def aggregate_scores(scores: Sequence[float], method: str = "median", trim: float = 0.2) -> float:
+    """
+    Agrega puntuaciones numéricas con mediana o media recortada
+
+    Args:
+        scores: Puntuaciones a agregar
+        method: "median" o "trimmed_mean"
+        trim: Fracción a descartar en cada extremo para la media recortada
+    """
+    if method == "median":
+        return float(statistics.median(scores))
+    if method == "trimmed_mean":
+        ordered = sorted(scores)
+        cut = int(len(ordered) * trim)
+        kept = ordered[cut:len(ordered) - cut] or ordered
+        return float(sum(kept) / len(kept))
+    raise ValueError(f"Método de agregación desconocido: {method}")
+
+
+def format_score(value: float) -> str:
+    """Formatea una puntuación agregada como texto (entero si no tiene decimales)"""
+    return str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+
+
+def answers_agree(answers: Sequence[Optional[str]], tolerance: float = 5.0) -> bool:
+    """
+    Indica si un conjunto de respuestas de texto coincide
+
+    Coinciden si todas son NA, todas son puntuaciones a menos de `tolerance`
+    puntos entre sí, o todas son el mismo texto (ignorando mayúsculas/espacios).
+    """
+    if not answers or any(a is None for a in answers):
+        return False
+    parsed = [parse_score(a) for a in answers]
+    if all(p == "NA" for p in parsed):
+        return True
+    if all(isinstance(p, float) for p in parsed):
+        return max(parsed) - min(parsed) <= tolerance
+    normalized = {a.strip().lower() for a in answers}
+    return len(normalized) == 1
+
+
+def aggregate_text_answers(answers: Sequence[Optional[str]], method: str = "median") -> Optional[str]:
+    """
+    Agrega respuestas de texto de un modelo de puntuación
+
+    Si predomina "NA" devuelve "NA"; si hay puntuaciones devuelve su agregado;
+    para respuestas libres devuelve la más votada.
+    """
+    valid = [a for a in answers if a is not None]
+    if not valid:
+        return None
+    parsed = [parse_score(a) for a in valid]
+    na_count = sum(1 for p in parsed if p == "NA")
+    scores = [p for p in parsed if isinstance(p, float)]
+    if scores or na_count:
+        if na_count >= len(scores):
+            return "NA"
+        return format_score(aggregate_scores(scores, method))
+    winner, _ = majority_vote([a.strip() for a in valid])
+    return winner
+
+
+def sample_with_early_stopping(sample_fn: Callable[[], object], k: int = 5,
+                               initial: int = 2,
+                               agree_fn: Optional[Callable[[List], bool]] = None) -> List:
+    """
+    Obtiene hasta k muestras en paralelo, parando tras las primeras si coinciden
+
+    Args:
+        sample_fn: Función sin argumentos que devuelve una muestra
+        k: Número máximo de muestras
+        initial: Muestras que se piden en la primera ronda
+        agree_fn: Función que decide si las muestras coinciden
+
+    Returns:
+        Lista de muestras obtenidas (entre `initial` y `k`)
+    """
+    initial = max(1, min(initial, k))
+    with ThreadPoolExecutor(max_workers=k) as executor:
+        samples = list(executor.map(lambda _: sample_fn(), range(initial)))
+        if len(samples) >= k or (agree_fn is not None and agree_fn(samples)):
+            return samples
+        samples.extend(executor.map(lambda _: sample_fn(), range(k - initial)))
+    return samples
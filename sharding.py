@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Ejecución fragmentada (sharding) de corpus grandes de imágenes
+
+Permite repartir un directorio entre varios procesos o nodos sin servicio
+coordinador: cada imagen pertenece a un fragmento determinado por el hash de
+su ruta relativa, así que todos los nodos que vean el mismo directorio (p. ej.
+en un sistema de archivos compartido) calculan el mismo reparto. Cada
+fragmento escribe su propio JSONL y `merge` los une en un único archivo de
+resultados detectando duplicados.
+
+Uso:
+    # En cada nodo (i = 0..N-1)
+    python sharding.py run images_folder --shard 0/4 --prompt-file prompt_capital-erotico.txt \
+        --model gemma3:27b-it-qat --max-image-size 1024
+    # Al terminar
+    python sharding.py merge -o results.json results_shard_*_of_4.jsonl
+"""
+
+import argparse
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """
+    Interpreta una especificación "i/N" (0 <= i < N)
+
+    Returns:
+        Tupla (i, N)
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Fragmento inválido '{spec}': se espera el formato i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Fragmento inválido '{spec}': debe cumplirse 0 <= i < N")
+    return index, count
+
+
+def shard_of(key: str, count: int) -> int:
+    """Fragmento al que pertenece una clave (estable entre máquinas y ejecuciones)"""
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_key(path: Union[str, Path], root: Union[str, Path]) -> str:
+    """
+    Clave de reparto de una imagen: su ruta relativa a `root` en formato POSIX
+
+    No depende de dónde esté montado el directorio en cada nodo; se guarda en
+    cada registro (campo "shard_key") para que `merge` detecte los duplicados.
+    """
+    return Path(path).relative_to(root).as_posix()
+
+
+def select_shard(files: List[Path], root: Union[str, Path], index: int, count: int) -> List[Path]:
+    """Filtra las imágenes que pertenecen al fragmento `index` de `count` (según su shard_key)"""
+    return [f for f in files if shard_of(shard_key(f, root), count) == index]
+
+
+def merge_results(input_files: List[Union[str, Path]], output_file: Union[str, Path]) -> Dict[str, int]:
+    """
+    Une los resultados de varios fragmentos en un único archivo
+
+    Las imágenes se identifican por su shard_key (la ruta absoluta solo en
+    registros antiguos sin ese campo), así que los nodos pueden montar el
+    directorio en rutas distintas. Si una imagen aparece en más de un fragmento
+    se conserva el registro sin error (y, entre varios válidos, el más reciente)
+    y se informa del duplicado.
+
+    Returns:
+        Estadísticas: {"records": n, "duplicates": n, "conflicts": n}
+    """
+    from classify_images_with_ollama import read_results, write_results
+
+    merged: Dict[str, Dict] = {}
+    stats = {"records": 0, "duplicates": 0, "conflicts": 0}
+    for input_file in input_files:
+        for record in read_results(input_file):
+            key = record.get("shard_key") or record["path"]
+            previous = merged.get(key)
+            if previous is None:
+                merged[key] = record
+                continue
+            stats["duplicates"] += 1
+            if previous.get("classification") != record.get("classification"):
+                stats["conflicts"] += 1
+                print(f"⚠️ Resultado distinto para '{key}' en {input_file}")
+            previous_failed = previous.get("classification") == "ERROR"
+            record_failed = record.get("classification") == "ERROR"
+            if (previous_failed and not record_failed) or (
+                    previous_failed == record_failed and record.get("timestamp", "") > previous.get("timestamp", "")):
+                merged[key] = record
+
+    results = [merged[key] for key in sorted(merged)]
+    stats["records"] = len(results)
+    write_results(results, output_file)
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    from classify_images_with_ollama import add_classifier_arguments, classifier_from_args
+
+    parser = argparse.ArgumentParser(description="Ejecución fragmentada de clasificación de imágenes")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Procesar un fragmento de un directorio")
+    run_parser.add_argument("directory", help="Directorio con imágenes")
+    run_parser.add_argument("--shard", required=True, help="Fragmento a procesar, en formato i/N")
+    run_parser.add_argument("--prompt-file", default="prompt_capital-erotico.txt")
+    run_parser.add_argument("--output", default=None,
+                            help="Archivo JSONL de salida (por defecto results_shard_<i>_of_<N>.jsonl)")
+    run_parser.add_argument("--workers", type=int, default=1, help="Requests en paralelo")
+    run_parser.add_argument("--processes", type=int, default=0,
+                            help="Procesos para decodificar/codificar imágenes (0 = en el hilo principal)")
+    add_classifier_arguments(run_parser)
+
+    merge_parser = subparsers.add_parser("merge", help="Unir los resultados de varios fragmentos")
+    merge_parser.add_argument("inputs", nargs="+", help="Archivos JSONL/JSON de los fragmentos")
+    merge_parser.add_argument("-o", "--output", required=True, help="Archivo de resultados unido")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        index, count = parse_shard(args.shard)
+        output = args.output or f"results_shard_{index}_of_{count}.jsonl"
+        prompt = Path(args.prompt_file).read_text(encoding='utf-8')
+        classifier = classifier_from_args(args)
+        classifier.process_directory(args.directory, prompt, output_file=output,
+                                     max_workers=args.workers, shard=(index, count),
+                                     preprocess_processes=args.processes)
+    else:
+        stats = merge_results(args.inputs, args.output)
+        print(f"✅ {stats['records']} registros en '{args.output}' "
+              f"({stats['duplicates']} duplicados, {stats['conflicts']} con resultado distinto)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Parada ordenada y contrapresión para las ejecuciones largas
+
+Con Ctrl-C o SIGTERM (kill, fin de un trabajo de SLURM, parada de un
+contenedor) el proceso moría a mitad de un request y se perdía todo lo que no
+estuviera guardado. GracefulShutdown instala manejadores de SIGINT y SIGTERM
+que solo piden la parada:
+
+- no se empieza ningún ítem nuevo
+- los requests en vuelo terminan, como mucho durante `grace` segundos
+- el pipeline guarda lo ya clasificado en su checkpoint y escribe un
+  marcador de reanudación con las entradas pendientes
+- una segunda señal corta en el acto (KeyboardInterrupt)
+
+run_stages conecta las etapas de carga, inferencia y escritura con colas
+acotadas: si el servidor se ralentiza, la carga se bloquea en lugar de
+acumular imágenes codificadas en memoria, y la escritura se hace siempre en
+el hilo que llama (el principal, el único que recibe las señales).
+"""
+
+import argparse
+import json
+import queue
+import signal
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+from cli_env import env_default
+
+# Código de salida convencional de un proceso interrumpido por SIGINT
+EXIT_INTERRUPTED = 130
+
+_DONE = object()
+
+
+class GracefulShutdown:
+    """
+    Petición de parada compartida por las etapas de un pipeline
+
+    Uso:
+        with GracefulShutdown(grace=30) as shutdown:
+            run_stages(items, infer, write, workers=8, shutdown=shutdown)
+        if shutdown.requested:
+            ...  # guardar checkpoint y marcador de reanudación
+
+    Args:
+        grace: Segundos que se espera a los requests en vuelo tras la señal
+    """
+
+    def __init__(self, grace: float = 30.0):
+        self.grace = grace
+        self.reason: Optional[str] = None
+        self.deadline: Optional[float] = None
+        self._event = threading.Event()
+        self._previous: Dict[int, Any] = {}
+
+    @property
+    def requested(self) -> bool:
+        return self._event.is_set()
+
+    def request(self, reason: str = "Parada solicitada"):
+        """Pide la parada (lo hacen los manejadores de señal; también se puede llamar a mano)"""
+        if self._event.is_set():
+            return
+        self.reason = reason
+        self.deadline = time.monotonic() + self.grace
+        self._event.set()
+        print(f"\n🛑 {reason}: no se empiezan más ítems, se espera a los que están en vuelo "
+              f"(hasta {self.grace:g}s; otra señal corta en el acto)")
+
+    def expired(self) -> bool:
+        """True si se pidió la parada y ya pasó el plazo de gracia"""
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _handle(self, signum, frame):
+        if self.requested:
+            self.restore()
+            raise KeyboardInterrupt
+        self.request(f"Recibida {signal.Signals(signum).name}")
+
+    def install(self) -> "GracefulShutdown":
+        """Instala los manejadores de SIGINT y SIGTERM (fuera del hilo principal no hace nada)"""
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._previous[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def restore(self):
+        """Vuelve a dejar los manejadores anteriores"""
+        for signum, handler in self._previous.items():
+            signal.signal(signum, handler if handler is not None else signal.SIG_DFL)
+        self._previous = {}
+
+    def __enter__(self) -> "GracefulShutdown":
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.restore()
+
+
+def ignore_interrupts(*_):
+    """Inicializador de procesos auxiliares: la señal la gestiona el proceso principal"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class StageStats:
+    """Contadores de una ejecución de run_stages"""
+
+    def __init__(self):
+        self.written = 0
+        self.abandoned = 0
+        self.peak_loaded = 0
+        self.peak_finished = 0
+        self.interrupted = False
+
+
+def run_stages(items: Iterable, infer: Callable[[Any], Any], write: Callable[[Any, Any], None],
+               workers: int = 1, load: Optional[Callable[[Any], Any]] = None,
+               queue_size: Optional[int] = None, shutdown: Optional[GracefulShutdown] = None) -> StageStats:
+    """
+    Carga, inferencia y escritura en etapas conectadas por colas acotadas
+
+    - carga: un hilo recorre `items` y aplica `load` (si se indica)
+    - inferencia: `workers` hilos aplican `infer` a cada ítem cargado
+    - escritura: el hilo que llama ejecuta write(ítem, resultado) según terminan
+
+    Cada cola admite `queue_size` ítems (por defecto 2 por worker): como mucho hay
+    queue_size ítems cargados esperando, `workers` en vuelo y queue_size resultados
+    por escribir, vaya como vaya el servidor. Con la parada pedida los ítems
+    cargados se descartan sin empezar y, si vence el plazo de gracia, los que
+    siguen en vuelo se abandonan (sus resultados no se escriben). Una excepción
+    de `load` o `infer` detiene las etapas y se relanza aquí.
+    """
+    workers = max(1, workers)
+    size = max(1, queue_size or workers * 2)
+    loaded: queue.Queue = queue.Queue(maxsize=size)
+    finished: queue.Queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    closed = threading.Event()
+    errors: List[BaseException] = []
+    stats = StageStats()
+    lock = threading.Lock()
+    in_flight = 0
+
+    def stopping() -> bool:
+        return stop.is_set() or (shutdown is not None and shutdown.requested)
+
+    def put(target: queue.Queue, value) -> bool:
+        # Bloquea mientras la cola está llena, salvo que el hilo que escribe ya se haya ido
+        while not closed.is_set():
+            try:
+                target.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load_stage():
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if stopping():
+                    break
+                if not put(loaded, load(item) if load is not None else item):
+                    break
+                stats.peak_loaded = max(stats.peak_loaded, loaded.qsize())
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+            for _ in range(workers):
+                put(loaded, _DONE)
+
+    def infer_stage():
+        nonlocal in_flight
+        while True:
+            item = loaded.get()
+            if item is _DONE:
+                break
+            if stopping():
+                continue
+            with lock:
+                in_flight += 1
+            try:
+                result = infer(item)
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+                continue
+            finally:
+                with lock:
+                    in_flight -= 1
+            put(finished, (item, result))
+            stats.peak_finished = max(stats.peak_finished, finished.qsize())
+        put(finished, _DONE)
+
+    # Hilos daemon: al vencer el plazo de gracia no hay que esperar a los requests abandonados
+    threads = [threading.Thread(target=load_stage, name="stage-load", daemon=True)]
+    threads += [threading.Thread(target=infer_stage, name=f"stage-infer-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    running = workers
+    try:
+        while running:
+            if shutdown is not None and shutdown.expired():
+                break
+            try:
+                entry = finished.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                running -= 1
+                continue
+            write(*entry)
+            stats.written += 1
+    finally:
+        stop.set()
+        closed.set()
+
+    stats.interrupted = shutdown is not None and shutdown.requested
+    if running:
+        with lock:
+            stats.abandoned = in_flight
+        print(f"⚠️ Plazo de gracia vencido: {stats.abandoned} requests en vuelo abandonados")
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def resume_marker_path(output_stem: Union[str, Path]) -> str:
+    """Marcador de reanudación de una salida"""
+    return f"{output_stem}.resume.json"
+
+
+def write_resume_marker(path: Union[str, Path], shutdown: GracefulShutdown, completed: int,
+                        pending: List[str], checkpoint: Union[str, Path]):
+    """Guarda por qué se paró la ejecución, dónde está lo clasificado y qué quedó pendiente"""
+    marker = {
+        "reason": shutdown.reason,
+        "interrupted_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "completed": completed,
+        "pending": len(pending),
+        "checkpoint": str(checkpoint),
+        "pending_items": pending
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(marker, f, ensure_ascii=False, indent=2)
+    print(f"📌 Ejecución interrumpida: {completed} clasificadas guardadas en '{checkpoint}', "
+          f"{len(pending)} pendientes (marcador en '{path}'). Relanza con --resume para continuar")
+
+
+def read_resume_marker(path: Union[str, Path]) -> Optional[Dict]:
+    """Marcador de una ejecución interrumpida, o None si no hay"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def clear_resume_marker(path: Union[str, Path]):
+    Path(path).unlink(missing_ok=True)
+
+
+def add_shutdown_arguments(parser: argparse.ArgumentParser, env_prefix: str):
+    """Añade las opciones de parada ordenada y colas entre etapas a una línea de comandos"""
+    group = parser.add_argument_group("parada y colas")
+    group.add_argument("--shutdown-grace", type=float,
+                       default=env_default(f"{env_prefix}_SHUTDOWN_GRACE", 30.0, float),
+                       help=f"Segundos que se espera a los requests en vuelo tras Ctrl-C o SIGTERM "
+                            f"[{env_prefix}_SHUTDOWN_GRACE]")
+    group.add_argument("--queue-size", type=int, default=env_default(f"{env_prefix}_QUEUE_SIZE", 0, int),
+                       help=f"Ítems en cola entre carga, inferencia y escritura; 0 = 2 por worker "
+                            f"[{env_prefix}_QUEUE_SIZE]")
@@ -0,0 +1,59 @@
+"""
+Configuración común de las pruebas: los módulos del repositorio son scripts en
+la raíz, así que se añade al path; y un cliente OpenAI falso para no salir a la red
+"""
+
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+class FakeChatClient:
+    """
+    Imita client.chat.completions.create de OpenAI
+
+    `labels(sentence)` devuelve (sense, reference, attribution) para cada frase;
+    si lanza una excepción el request falla como un error de la API. El modelo de
+    cada request queda en `models` (el último ya está anotado al llamar a labels).
+    """
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.calls = []
+        self.models = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        sentence = kwargs["messages"][-1]["content"].split('"')[-2]
+        self.calls.append(sentence)
+        self.models.append(kwargs.get("model"))
+        sense, reference, attribution = self.labels(sentence)
+        body = {"sentences": [{"text": sentence, "sense": sense, "reference": reference,
+                               "attribution": attribution}]}
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(body)))],
+                               usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Sustituye el cliente de classify_with_gpt (también el que crea main) por un FakeChatClient"""
+    import classify_with_gpt
+
+    def install(labels=lambda sentence: ("Physical", "NA", "NA")):
+        fake = FakeChatClient(labels)
+        monkeypatch.setattr(classify_with_gpt, "client", fake)
+        monkeypatch.setattr(classify_with_gpt, "API_KEY", "test")
+        monkeypatch.setattr(classify_with_gpt, "OpenAI", lambda **kwargs: fake)
+        # main cambia el modelo y el contador de uso globales
+        monkeypatch.setattr(classify_with_gpt, "MODEL", classify_with_gpt.MODEL)
+        monkeypatch.setattr(classify_with_gpt, "usage_tracker", classify_with_gpt.usage_tracker)
+        return fake
+
+    return install
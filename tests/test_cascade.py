@@ -0,0 +1,100 @@
+"""
+Cascada barato -> caro: motivos de escalado, auditoría y acuerdo entre niveles
+"""
+
+import pytest
+from PIL import Image
+
+from cascade import Cascade
+from classify_images_with_ollama import OllamaImageClassifier
+from ollama_stub import StubOllamaServer
+
+MAIN = "gemma3:27b-it-qat"
+CHEAP = "gemma3:4b"
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "a.png"
+    Image.new("RGB", (32, 32), "red").save(path)
+    return path
+
+
+@pytest.mark.parametrize("answers, reason", [
+    (["50"], None),
+    ([None], "sin_respuesta"),
+    (["NA"], "na"),
+    (["20", "80"], "desacuerdo"),
+    (["50", "52"], None),
+])
+def test_image_escalation_reasons(answers, reason):
+    assert Cascade(CHEAP).image_escalation(answers) == reason
+
+
+def test_labels_escalation_reasons():
+    cascade = Cascade(CHEAP, min_confidence=0.9)
+    physical = ("Physical", "NA", "NA")
+    assert cascade.labels_escalation([physical, physical], [0.95, 0.97]) is None
+    assert cascade.labels_escalation([("ERROR", "ERROR", "ERROR")]) == "parseo"
+    assert cascade.labels_escalation([("NA", "NA", "NA")]) == "na"
+    assert cascade.labels_escalation([physical, ("Preference", "NA", "NA")]) == "desacuerdo"
+    assert cascade.labels_escalation([physical], [0.5]) == "logprobs"
+    assert Cascade(CHEAP, escalate_na=False).labels_escalation([("NA", "NA", "NA")]) is None
+
+
+def classify(server, image, cascade):
+    classifier = OllamaImageClassifier(ollama_url=server.url, model_name=MAIN, cascade=cascade)
+    return classifier.classify_file(str(image), "prompt")
+
+
+def test_confident_cheap_answer_is_not_escalated(image):
+    cascade = Cascade(CHEAP)
+    with StubOllamaServer(base_latency=0.0, responses={CHEAP: "40", MAIN: "50"}) as server:
+        result = classify(server, image, cascade)
+        assert server.requests == 1
+    assert result["classification"] == "40"
+    assert result["cascade"]["tier"] == "cheap"
+    assert cascade.stats.metrics()["escalated"] == 0
+
+
+def test_na_from_the_cheap_model_escalates(image):
+    cascade = Cascade(CHEAP)
+    with StubOllamaServer(base_latency=0.0, responses={CHEAP: "NA", MAIN: "50"}) as server:
+        result = classify(server, image, cascade)
+        assert server.requests == 2
+    assert result["classification"] == "50"
+    assert result["cascade"]["escalation_reason"] == "na"
+    metrics = cascade.stats.metrics()
+    assert (metrics["escalated"], metrics["reasons"]) == (1, {"na": 1})
+
+
+def test_audit_keeps_the_cheap_answer_and_measures_agreement(image):
+    cascade = Cascade(CHEAP, audit_rate=1.0)
+    with StubOllamaServer(base_latency=0.0, responses={CHEAP: "20", MAIN: "80"}) as server:
+        result = classify(server, image, cascade)
+        assert server.requests == 2
+    assert result["classification"] == "20"
+    assert result["cascade"]["audit_answer"] == "80"
+    metrics = cascade.stats.metrics()
+    assert metrics["escalated"] == 0
+    assert metrics["tier_agreement"] == {"audit": 0.0}
+
+
+def test_sentence_cascade_escalates_na_to_the_main_model(fake_openai):
+    import classify_with_gpt
+
+    fake = None
+
+    def labels(sentence):
+        if fake.models[-1] == "gpt-barato":
+            return "NA", "NA", "NA"
+        return "Physical", "NA", "NA"
+
+    fake = fake_openai(labels)
+    cascade = Cascade("gpt-barato")
+    result = classify_with_gpt.classify_sentence_cascade("Soy de Madrid", "prompt", cascade, max_retries=1)
+
+    assert fake.models == ["gpt-barato", classify_with_gpt.MODEL]
+    assert classify_with_gpt.extract_classification(result, "Soy de Madrid")[0] == "Physical"
+    assert result["cascade"]["tier"] == "expensive"
+    assert result["usage"]["prompt_tokens"] == 20
@@ -0,0 +1,120 @@
+"""
+Clasificación de imágenes contra el servidor Ollama simulado (ollama_stub)
+"""
+
+import json
+
+import pytest
+from PIL import Image
+
+from classify_images_with_ollama import OllamaImageClassifier, parse_indexed_answers
+from image_store import ImageStore
+from ollama_stub import StubOllamaServer
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "imgs"
+    directory.mkdir()
+    for i, color in enumerate(("red", "green", "blue", "white")):
+        Image.new("RGB", (32 + i, 32), color).save(directory / f"{i}.png")
+    return directory
+
+
+@pytest.fixture
+def server():
+    with StubOllamaServer(base_latency=0.0) as stub:
+        yield stub
+
+
+def test_resume_and_incremental_reuse_previous_results(tmp_path, images, server):
+    classifier = OllamaImageClassifier(ollama_url=server.url)
+    output = str(tmp_path / "results.json")
+
+    results = classifier.process_directory(images, "prompt", output_file=output, max_workers=2)
+    assert len(results) == 4
+    assert all(r["input_fingerprint"] and r["input_stat"] for r in results)
+
+    sent = server.requests
+    classifier.process_directory(images, "prompt", output_file=output, resume=True)
+    classifier.process_directory(images, "prompt", output_file=output, incremental=True)
+    assert server.requests == sent
+
+    Image.new("RGB", (10, 10), "black").save(images / "nueva.png")
+    classifier.process_directory(images, "prompt", output_file=output, incremental=True)
+    report = json.loads((tmp_path / "results.diff.json").read_text(encoding="utf-8"))
+    assert report["reasons"] == {"new": 1}
+
+
+def test_sharded_records_carry_the_relative_key(tmp_path, images, server):
+    classifier = OllamaImageClassifier(ollama_url=server.url)
+    keys = []
+    for index in range(2):
+        output = str(tmp_path / f"shard_{index}.jsonl")
+        classifier.process_directory(images, "prompt", output_file=output, shard=(index, 2))
+        keys += [json.loads(line)["shard_key"] for line in open(output, encoding="utf-8")]
+    assert sorted(keys) == ["0.png", "1.png", "2.png", "3.png"]
+
+
+def test_image_store_settings_must_match(tmp_path):
+    store = ImageStore(tmp_path / "store", max_image_size=512, jpeg_quality=80)
+    OllamaImageClassifier(max_image_size=512, jpeg_quality=80, image_store=store)
+    with pytest.raises(ValueError, match="ImageStore"):
+        OllamaImageClassifier(max_image_size=1024, jpeg_quality=80, image_store=store)
+
+
+def test_samples_option_reaches_each_image(tmp_path, images, server, monkeypatch):
+    from classify_images_with_ollama import build_arg_parser
+
+    monkeypatch.setenv("OLLAMA_SAMPLES", "5")
+    args = build_arg_parser().parse_args([str(images), "--initial-samples", "3"])
+    classifier = OllamaImageClassifier(ollama_url=server.url, samples=args.samples,
+                                       initial_samples=args.initial_samples, images_per_request=4)
+
+    results = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "results.json"))
+    # Las 3 muestras iniciales coinciden: no se piden más, y no se agrupan imágenes en un request
+    assert server.requests == 4 * 3
+    assert [r["classification"] for r in results] == ["50"] * 4
+
+
+def test_multi_prompt_sends_every_prompt_once_per_image(tmp_path, images, server):
+    classifier = OllamaImageClassifier(ollama_url=server.url)
+    prompts = {"capital": "prompt A", "valor": "prompt B", "zona": "prompt C"}
+
+    results = classifier.process_directory_multi(images, prompts, output_file=str(tmp_path / "multi.json"))
+
+    assert server.requests == 4 * 3
+    assert len(results) == 4
+    for record in results:
+        assert [record[f"classification_{name}"] for name in prompts] == ["50"] * 3
+        assert record["error"] is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1: 40\n2: 60", ["40", "60"]),
+    ("**Imagen 2:** 60\nImagen 1: 40\n", ["40", "60"]),
+    ("1: 40", None),
+    ("1: 40\n1: 45\n2: 60", None),
+    ("1: 40\n2: 60\n3: 10", None),
+])
+def test_parse_indexed_answers(text, expected):
+    assert parse_indexed_answers(text, 2) == expected
+
+
+def test_images_per_request_packs_images_and_splits_usage(tmp_path, images, server):
+    classifier = OllamaImageClassifier(ollama_url=server.url, images_per_request=2)
+
+    results = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "results.json"))
+
+    assert server.requests == 2
+    assert len(server.last_request["messages"][-1]["images"]) == 2
+    assert [r["classification"] for r in results] == ["50"] * 4
+    assert all(r["usage"]["batch_size"] == 2 for r in results)
+
+
+def test_unmatched_batch_answer_falls_back_to_single_requests(tmp_path, images):
+    with StubOllamaServer(base_latency=0.0, response_text="") as stub:
+        classifier = OllamaImageClassifier(ollama_url=stub.url, images_per_request=4, max_retries=1)
+        results = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "results.json"))
+        assert stub.requests == 1 + 4
+    assert [r["classification"] for r in results] == ["ERROR"] * 4
@@ -0,0 +1,147 @@
+"""
+Ida y vuelta de los CSV de resultados: la etiqueta "NA" tiene que sobrevivir a
+reintentos, reanudaciones y ejecuciones incrementales
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+import classify_with_gpt as gpt
+
+INPUT_CSV = """bio_num,frase_num,frase,sense_ME,reference_ME,attribution_ME
+1,0,Soy de Madrid,Physical,NA,NA
+1,1,Me gusta el cine,Preference,NA,NA
+2,0,Trabajo de profesora,Activity,Job,Positive
+2,1,Tengo dos hermanos,Collective,NA,NA
+"""
+
+RESULT_COLUMNS = ("bio_num,frase_num,frase,sense_true,sense_predicted,reference_true,reference_predicted,"
+                  "attribution_true,attribution_predicted,gpt_response,prompt_tokens,completion_tokens")
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "input.csv").write_text(INPUT_CSV, encoding="utf-8")
+    (tmp_path / "prompt.txt").write_text("Clasifica la frase", encoding="utf-8")
+    return tmp_path
+
+
+def classify(*extra):
+    return gpt.main(["-i", "input.csv", "--prompt-file", "prompt.txt", "--pause", "0", *extra])
+
+
+def reject_nan(token):
+    raise AssertionError(f"Token {token} en el JSON")
+
+
+def test_read_results_csv_keeps_na_labels(tmp_path):
+    path = tmp_path / "results.csv"
+    path.write_text(f"{RESULT_COLUMNS}\n1,0,Hola,Consensual,Consensual,NA,NA,NA,NA,{{}},1,1\n", encoding="utf-8")
+    row = gpt.read_results_csv(str(path)).iloc[0]
+    assert row["reference_predicted"] == "NA"
+    assert row["attribution_true"] == "NA"
+    assert row["bio_num"] == "1"
+
+
+def test_retry_failures_keeps_na_labels_of_untouched_rows(tmp_path, fake_openai):
+    path = tmp_path / "results.csv"
+    path.write_text(f"{RESULT_COLUMNS}\n"
+                    f"1,0,Soy de Madrid,Consensual,Consensual,NA,NA,NA,NA,{{}},1,1\n"
+                    f"1,1,Me gusta el cine,Subconsensual,ERROR,NA,ERROR,NA,ERROR,{{}},0,0\n", encoding="utf-8")
+    fake = fake_openai()
+
+    gpt.retry_failures(str(path), "prompt")
+
+    assert fake.calls == ["Me gusta el cine"]
+    rows = list(pd.read_csv(path, dtype=str, keep_default_na=False).itertuples())
+    assert [(r.reference_true, r.reference_predicted, r.attribution_true, r.attribution_predicted)
+            for r in rows] == [("NA", "NA", "NA", "NA")] * 2
+
+
+def test_resume_matches_uninterrupted_run(workspace, fake_openai):
+    fake = fake_openai()
+    assert classify("-o", "full.csv") == 0
+    full = (workspace / "full.csv").read_text(encoding="utf-8")
+
+    # Una ejecución que solo llegó a las dos primeras frases
+    (workspace / "partial.csv").write_text("\n".join(full.splitlines()[:3]) + "\n", encoding="utf-8")
+    fake.calls.clear()
+    assert classify("-o", "partial.csv", "--resume") == 0
+
+    assert len(fake.calls) == 2
+    assert (workspace / "partial.csv").read_text(encoding="utf-8") == full
+
+
+def test_incremental_run_reports_no_phantom_changes(workspace, fake_openai):
+    fake_openai()
+    classify("-o", "results.csv")
+    before = (workspace / "results.csv").read_text(encoding="utf-8")
+
+    # Sin cambios: todo se reutiliza y el CSV queda igual
+    classify("-o", "results.csv", "--incremental")
+    assert (workspace / "results.csv").read_text(encoding="utf-8") == before
+
+    # Otro prompt con las mismas respuestas: se reclasifica todo, pero ninguna etiqueta cambia
+    (workspace / "prompt.txt").write_text("Clasifica la frase con cuidado", encoding="utf-8")
+    classify("-o", "results.csv", "--incremental")
+    report = json.loads((workspace / "results.diff.json").read_text(encoding="utf-8"), parse_constant=reject_nan)
+    assert report["reclassified"] == 4
+    assert report["changed_labels"] == 0
+    assert "NA" in pd.read_csv(workspace / "results.csv", keep_default_na=False)["reference_predicted"].tolist()
+
+
+def test_incremental_report_is_valid_json_with_blank_previous_labels(workspace, fake_openai):
+    fake_openai()
+    classify("-o", "results.csv")
+    # Resultados escritos por una versión que guardaba "NA" como celda vacía
+    pd.read_csv(workspace / "results.csv").to_csv(workspace / "results.csv", index=False)
+
+    (workspace / "prompt.txt").write_text("Otro prompt", encoding="utf-8")
+    classify("-o", "results.csv", "--incremental")
+
+    report = json.loads((workspace / "results.diff.json").read_text(encoding="utf-8"), parse_constant=reject_nan)
+    assert report["changed_labels"] == 0
+
+
+def test_row_key_normalizes_numeric_identifiers():
+    assert gpt.row_key({"bio_num": 12.0, "frase_num": "3"}) == gpt.row_key({"bio_num": "12", "frase_num": 3})
+    assert gpt.key_part("A-7") == "A-7"
+
+
+def test_failed_samples_are_not_consensus():
+    ok = {"sentences": [{"text": "x", "sense": "Physical", "reference": "NA", "attribution": "NA"}]}
+    failed = gpt.create_error_response("x", "API error")
+    assert gpt.samples_agree([ok, json.loads(json.dumps(ok))], "x")
+    assert not gpt.samples_agree([failed, failed], "x")
+    assert not gpt.samples_agree([ok, failed], "x")
+
+
+def test_samples_option_classifies_each_sentence_with_self_consistency(workspace, fake_openai, monkeypatch):
+    calls = {}
+
+    def labels(sentence):
+        # "Me gusta el cine" alterna de etiqueta en cada muestra; el resto siempre coincide
+        calls[sentence] = calls.get(sentence, 0) + 1
+        if sentence == "Me gusta el cine" and calls[sentence] % 2 == 0:
+            return "Collective", "NA", "NA"
+        return "Physical", "NA", "NA"
+
+    fake_openai(labels=labels)
+    monkeypatch.setenv("GPT_INITIAL_SAMPLES", "2")
+    assert classify("--samples", "3") == 0
+
+    assert calls["Soy de Madrid"] == 2
+    assert calls["Me gusta el cine"] == 3
+    df = gpt.read_results_csv("gpt_classification_results.csv")
+    detail = json.loads(df.loc[df['frase'] == "Me gusta el cine", 'gpt_response'].iloc[0])["self_consistency"]
+    assert detail["samples"] == 3
+    assert df.loc[df['frase'] == "Me gusta el cine", 'sense_predicted'].iloc[0] == "Physical"
+
+
+def test_samples_option_falls_back_to_environment(monkeypatch):
+    monkeypatch.setenv("GPT_SAMPLES", "5")
+    args = gpt.build_arg_parser().parse_args([])
+    assert (args.samples, args.initial_samples) == (5, 2)
@@ -0,0 +1,54 @@
+"""
+Limitador adaptativo de concurrencia contra el servidor Ollama simulado (ollama_stub)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from classify_images_with_ollama import OllamaImageClassifier
+from concurrency import AdaptiveConcurrencyLimiter
+from ollama_stub import StubOllamaServer
+
+
+def classify_many(server: StubOllamaServer, limiter: AdaptiveConcurrencyLimiter, requests: int):
+    classifier = OllamaImageClassifier(ollama_url=server.url, concurrency_limiter=limiter, max_retries=5)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        return list(executor.map(lambda _: classifier.classify_image("AAAA", "test"), range(requests)))
+
+
+def test_limit_rises_while_latency_is_flat():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=4)
+    with StubOllamaServer(base_latency=0.02, capacity=8) as server:
+        classify_many(server, limiter, 40)
+    metrics = limiter.metrics()
+    assert metrics["limit"] == 4
+    assert metrics["limit_history"] == [1, 2, 3, 4]
+    assert server.max_in_flight <= 4
+
+
+def test_server_overload_backs_off_the_limit():
+    # Solo la saturación del servidor (503 con la cola llena) puede bajar el límite
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=16, queue_low=100, queue_high=100)
+    with StubOllamaServer(base_latency=0.02, capacity=2, max_queue=2) as server:
+        answers = classify_many(server, limiter, 60)
+    metrics = limiter.metrics()
+    history = metrics["limit_history"]
+    peak = history.index(max(history))
+
+    assert server.rejected > 0
+    assert metrics["overloads"] == server.rejected
+    assert max(history) > 2
+    assert min(history[peak:]) < max(history)
+    assert max(history) <= 2 + 2 + 2
+    assert all(answer == "50" for answer in answers)
+
+
+def test_connection_errors_back_off_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=8)
+    classifier = OllamaImageClassifier(ollama_url="http://127.0.0.1:9", concurrency_limiter=limiter,
+                                       max_retries=1)
+    classifier.session = classifier.transport.build_session(retries=0)
+    for _ in range(2):
+        assert classifier.classify_image("AAAA", "test") is None
+    metrics = limiter.metrics()
+    assert metrics["overloads"] == 2
+    assert metrics["limit_history"] == [2, 1]
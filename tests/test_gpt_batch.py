@@ -0,0 +1,123 @@
+"""
+Modo batch contra un endpoint falso de la Batch API: reanudación y huella del estado
+"""
+
+import json
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+import gpt_batch
+
+
+class FakeBatchAPI:
+    """Imita client.files y client.batches; cada batch termina en cuanto se consulta"""
+
+    def __init__(self, labels=("Physical", "NA", "NA")):
+        self.labels = labels
+        self.uploads = {}
+        self.created = []
+        self.files = SimpleNamespace(create=self.upload, content=self.content)
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve)
+
+    def upload(self, file, purpose):
+        file_id = f"file-{len(self.uploads)}"
+        self.uploads[file_id] = file.read().decode("utf-8")
+        return SimpleNamespace(id=file_id)
+
+    def create_batch(self, input_file_id, **kwargs):
+        self.created.append(input_file_id)
+        return SimpleNamespace(id=f"batch-{input_file_id}", status="validating")
+
+    def retrieve(self, batch_id):
+        return SimpleNamespace(status="completed", output_file_id=f"out-{batch_id[len('batch-'):]}",
+                               error_file_id=None, request_counts=None)
+
+    def content(self, file_id):
+        sense, reference, attribution = self.labels
+        lines = []
+        for line in self.uploads[file_id[len("out-"):]].splitlines():
+            request = json.loads(line)
+            sentence = request["body"]["messages"][-1]["content"].split('"')[-2]
+            body = {"sentences": [{"text": sentence, "sense": sense, "reference": reference,
+                                   "attribution": attribution}]}
+            lines.append(json.dumps({
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": {
+                    "choices": [{"message": {"content": json.dumps(body)}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 5}}}
+            }))
+        return SimpleNamespace(text="\n".join(lines))
+
+
+@pytest.fixture
+def sentences():
+    return pd.DataFrame({
+        "bio_num": [1, 1, 2],
+        "frase_num": [0, 1, 0],
+        "frase": ["Soy de Madrid", "Me gusta el cine", "Trabajo de profesora"],
+        "sense_ME": ["Physical", "Preference", "Activity"],
+        "reference_ME": ["NA", "NA", "Job"],
+        "attribution_ME": ["NA", "NA", "Positive"],
+    })
+
+
+def test_run_batch_splits_and_merges_results(tmp_path, sentences):
+    api = FakeBatchAPI()
+    df_results = gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api,
+                                     poll_interval=0, max_requests=2)
+    assert len(api.created) == 2
+    assert df_results["frase"].tolist() == sentences["frase"].tolist()
+    assert df_results["sense_predicted"].tolist() == ["Physical"] * 3
+    assert df_results["sense_true"].tolist() == ["Consensual", "Subconsensual", "Consensual"]
+    assert df_results["reference_predicted"].tolist() == ["NA"] * 3
+
+
+def test_resume_does_not_resubmit(tmp_path, sentences):
+    api = FakeBatchAPI()
+    gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api, poll_interval=0)
+    df_results = gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api, poll_interval=0)
+    assert len(api.uploads) == 1
+    assert len(api.created) == 1
+    assert len(df_results) == 3
+
+
+def test_resume_after_interrupted_upload(tmp_path, sentences):
+    api = FakeBatchAPI()
+    state_path = tmp_path / "batch_state.json"
+    original = api.create_batch
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    api.batches.create = interrupted
+    with pytest.raises(KeyboardInterrupt):
+        gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api, poll_interval=0)
+    assert json.loads(state_path.read_text())["jobs"][0]["input_file_id"] == "file-0"
+
+    api.batches.create = original
+    gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api, poll_interval=0)
+    assert len(api.uploads) == 1
+    assert api.created == ["file-0"]
+
+
+@pytest.mark.parametrize("change", ["prompt", "model", "input"])
+def test_resume_refuses_state_of_another_run(tmp_path, sentences, change):
+    api = FakeBatchAPI()
+    gpt_batch.run_batch(sentences, "prompt", work_dir=tmp_path, client=api, poll_interval=0)
+
+    prompt, model, df = "prompt", gpt_batch.MODEL, sentences
+    if change == "prompt":
+        prompt = "otro prompt"
+    elif change == "model":
+        model = "otro-modelo"
+    else:
+        df = sentences.assign(frase=sentences["frase"].str.upper())
+    with pytest.raises(ValueError, match="otras frases"):
+        gpt_batch.run_batch(df, prompt, work_dir=tmp_path, model=model, client=api, poll_interval=0)
+    assert len(api.created) == 1
+
+
+def test_custom_id_round_trip():
+    assert gpt_batch.parse_custom_id(gpt_batch.make_custom_id(12, "3")) == ("12", "3")
@@ -0,0 +1,107 @@
+"""
+Topes de descarga, presupuesto de píxeles y memoria de decodificación
+"""
+
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from image_limits import DecodeMemoryGate, ImageLimits, ImageTooLarge, fetch_limited, open_bounded
+
+
+class FakeResponse:
+    """Respuesta en streaming mínima para fetch_limited"""
+
+    def __init__(self, chunks, headers=None):
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, timeout, stream):
+        assert stream
+        return self.response
+
+
+def test_fetch_limited_checks_content_length_before_reading():
+    response = FakeResponse([b"x" * 10], {"Content-Length": "100"})
+    with pytest.raises(ImageTooLarge):
+        fetch_limited("http://img", max_bytes=50, session=FakeSession(response))
+    assert response.read == 0
+
+
+def test_fetch_limited_stops_streaming_past_the_cap():
+    response = FakeResponse([b"x" * 30] * 10)
+    with pytest.raises(ImageTooLarge):
+        fetch_limited("http://img", max_bytes=50, session=FakeSession(response))
+    assert response.read == 2
+    assert fetch_limited("http://img", max_bytes=None, session=FakeSession(FakeResponse([b"ab", b"c"]))) == b"abc"
+
+
+def test_large_jpeg_is_draft_decoded_within_budget(tmp_path):
+    path = tmp_path / "big.jpg"
+    Image.new("RGB", (800, 600), "red").save(path)
+    with open_bounded(path, ImageLimits(max_pixels=100_000)) as img:
+        assert img.size == (200, 150)
+    with pytest.raises(ImageTooLarge):
+        open_bounded(path, ImageLimits(max_pixels=100_000, draft=False))
+
+
+def test_large_png_is_rejected_before_decoding(tmp_path):
+    path = tmp_path / "big.png"
+    Image.new("RGB", (800, 600), "red").save(path)
+    with pytest.raises(ImageTooLarge):
+        open_bounded(path, ImageLimits(max_pixels=100_000))
+    with open_bounded(path, ImageLimits(max_pixels=None)) as img:
+        assert img.size == (800, 600)
+
+
+def test_animated_image_uses_the_first_frame(tmp_path):
+    path = tmp_path / "anim.gif"
+    frames = [Image.new("RGB", (16, 16), color) for color in ("red", "blue", "green")]
+    frames[0].save(path, save_all=True, append_images=frames[1:])
+    with open_bounded(path) as img:
+        assert img.tell() == 0
+
+
+def test_decode_gate_limits_concurrent_reservations():
+    gate = DecodeMemoryGate(100)
+    peak = []
+    lock = threading.Lock()
+
+    def decode():
+        with gate.reserve(60):
+            with lock:
+                peak.append(gate.in_use)
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=decode) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 60
+    # Una imagen mayor que el tope completo se decodifica sola
+    with gate.reserve(500):
+        assert gate.in_use == 100
+    assert gate.in_use == 0
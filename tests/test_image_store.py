@@ -0,0 +1,84 @@
+"""
+Almacén de payloads pre-codificados: aciertos, invalidación y compactado
+"""
+
+import os
+
+import pytest
+from PIL import Image
+
+from classify_images_with_ollama import encode_image_to_base64
+from image_store import ImageStore
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "imgs"
+    directory.mkdir()
+    paths = []
+    for i, color in enumerate(("red", "green", "blue")):
+        path = directory / f"{i}.png"
+        Image.new("RGB", (40, 30), color).save(path)
+        paths.append(path)
+    return paths
+
+
+def expected_payload(store, path):
+    with Image.open(path) as img:
+        return encode_image_to_base64(img, store.max_image_size, store.jpeg_quality)
+
+
+def test_build_then_hit_from_a_new_instance(tmp_path, images):
+    store = ImageStore(tmp_path / "store", jpeg_quality=85)
+    assert store.build(images) == {"added": 3, "fresh": 0, "failed": 0}
+    store.close()
+
+    store = ImageStore(tmp_path / "store", jpeg_quality=85)
+    assert store.build(images) == {"added": 0, "fresh": 3, "failed": 0}
+    for path in images:
+        view = store.get(path)
+        assert bytes(view) == expected_payload(store, path)
+        view.release()
+    store.close()
+
+
+def test_modified_source_is_invalidated(tmp_path, images):
+    store = ImageStore(tmp_path / "store")
+    store.build(images)
+
+    Image.new("RGB", (40, 30), "black").save(images[0])
+    stat = os.stat(images[0])
+    os.utime(images[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.get(images[0]) is None
+    assert store.get(images[1]) is not None
+
+    assert store.build(images) == {"added": 1, "fresh": 2, "failed": 0}
+    view = store.get(images[0])
+    assert bytes(view) == expected_payload(store, images[0])
+    view.release()
+    store.close()
+
+
+def test_other_settings_do_not_reuse_payloads(tmp_path, images):
+    ImageStore(tmp_path / "store", max_image_size=1024, jpeg_quality=85).build(images)
+    store = ImageStore(tmp_path / "store", max_image_size=16, jpeg_quality=85)
+    assert all(store.get(path) is None for path in images)
+    assert store.build(images)["added"] == 3
+    store.close()
+
+
+def test_compact_drops_replaced_entries(tmp_path, images):
+    store = ImageStore(tmp_path / "store")
+    store.build(images)
+    ImageStore(tmp_path / "store", max_image_size=16).build(images[:1])
+    store.close()
+
+    store = ImageStore(tmp_path / "store", max_image_size=16)
+    before = store.pack_path.stat().st_size
+    payload = bytes(store.get(images[0]))
+    store.compact()
+    assert store.pack_path.stat().st_size < before
+    view = store.get(images[0])
+    assert bytes(view) == payload
+    view.release()
+    store.close()
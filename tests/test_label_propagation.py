@@ -0,0 +1,78 @@
+"""
+Propagación de etiquetas: índice de vecinos, umbral y auditoría
+"""
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from label_propagation import HashingEncoder, LabelPropagator, NeighborIndex
+
+PHYSICAL = ("Physical", "NA", "NA")
+PREFERENCE = ("Preference", "NA", "NA")
+
+
+@pytest.fixture(scope="module")
+def encoder():
+    return HashingEncoder(n_features=2 ** 12)
+
+
+@pytest.mark.parametrize("to_matrix", [np.asarray, sparse.csr_matrix])
+def test_index_grows_in_place_and_finds_each_row(to_matrix):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((300, 8)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = NeighborIndex(initial_capacity=4)
+    reallocations = 0
+    buffer = None
+    for i, vector in enumerate(vectors):
+        index.add(to_matrix(vector[None, :]), [i])
+        current = index._dense if index._dense is not None else index._data
+        reallocations += current is not buffer
+        buffer = current
+        similarity, position = index.nearest(to_matrix(vector[None, :]))
+        assert position == i or similarity == pytest.approx(1.0)
+    # Capacidad doble: las copias del índice son logarítmicas en el número de filas
+    assert reallocations <= 10
+    assert len(index) == 300
+    assert all(index.nearest(to_matrix(v[None, :]))[1] == i for i, v in enumerate(vectors))
+
+
+def test_empty_index_has_no_neighbor(encoder):
+    assert NeighborIndex().nearest(encoder.encode(["Soy de Madrid"])) is None
+
+
+def test_propagation_respects_threshold(encoder):
+    propagator = LabelPropagator(encoder, threshold=0.9, audit_rate=0.0)
+    propagator.add(["Soy de Madrid", "Me gusta el cine"], [PHYSICAL, PREFERENCE])
+
+    match = propagator.lookup("soy de Madrid")
+    assert match["labels"] == PHYSICAL and match["source"] == "Soy de Madrid"
+    assert match["similarity"] >= 0.9
+    # Con la puntuación la similitud baja de 0.9: solo se propaga con un umbral menor
+    assert propagator.lookup("Soy de Madrid!") is None
+    propagator.threshold = 0.8
+    assert propagator.lookup("Soy de Madrid!")["labels"] == PHYSICAL
+    assert propagator.lookup("Trabajo de profesora en un instituto") is None
+
+
+def test_errors_are_not_indexed(encoder):
+    propagator = LabelPropagator(encoder, audit_rate=0.0)
+    propagator.add(["Soy de Madrid"], [("ERROR", "ERROR", "ERROR")])
+    assert propagator.lookup("Soy de Madrid") is None
+
+
+def test_audit_compares_propagated_labels_with_the_model(encoder):
+    propagator = LabelPropagator(encoder, threshold=0.9, audit_rate=1.0, seed=0)
+    propagator.add(["Soy de Madrid"], [PHYSICAL])
+
+    match = propagator.lookup("Soy de Madrid")
+    assert match["audit"]
+    propagator.observe("Soy de Madrid", ("Physical", "Local", "NA"), match)
+
+    audit = propagator.stats.metrics()["audit"]
+    assert audit["items"] == 1
+    assert audit["accuracy"] == 0.0
+    assert (audit["sense"], audit["reference"], audit["attribution"]) == (1.0, 0.0, 1.0)
+    # La frase auditada entra en el índice con la etiqueta del modelo
+    assert len(propagator.index) == 2
@@ -0,0 +1,78 @@
+"""
+Opciones de inferencia de Ollama y reutilización del prefijo del prompt
+"""
+
+import pytest
+from PIL import Image
+
+from classify_images_with_ollama import OllamaImageClassifier
+from ollama_options import OllamaOptions, PrefixCacheStats, parse_keep_alive
+from ollama_stub import StubOllamaServer
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "imgs"
+    directory.mkdir()
+    for i, color in enumerate(("red", "green", "blue")):
+        Image.new("RGB", (32, 32), color).save(directory / f"{i}.png")
+    return directory
+
+
+def test_apply_sends_only_the_given_options():
+    options = OllamaOptions(num_ctx=4096, temperature=0.0, keep_alive=-1, extra={"top_k": 20})
+    assert options.apply({"model": "m"}) == {"model": "m", "keep_alive": -1,
+                                              "options": {"num_ctx": 4096, "temperature": 0.0, "top_k": 20}}
+    assert OllamaOptions().apply({"model": "m"}) == {"model": "m"}
+
+
+@pytest.mark.parametrize("kwargs", [{"num_ctx": 0}, {"num_thread": -2}, {"num_predict": 0},
+                                    {"temperature": -0.1}])
+def test_invalid_options_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        OllamaOptions(**kwargs)
+
+
+def test_parse_keep_alive():
+    assert parse_keep_alive("300") == 300
+    assert parse_keep_alive("-1") == -1
+    assert parse_keep_alive("30m") == "30m"
+    assert parse_keep_alive("") is None
+
+
+def test_options_reach_the_server(tmp_path, images):
+    with StubOllamaServer(base_latency=0.0) as server:
+        classifier = OllamaImageClassifier(ollama_url=server.url,
+                                           options=OllamaOptions(num_predict=8, seed=7, keep_alive="1h"))
+        classifier.process_directory(images, "prompt", output_file=str(tmp_path / "results.json"))
+        request = server.last_request
+    assert request["options"] == {"num_predict": 8, "seed": 7}
+    assert request["keep_alive"] == "1h"
+
+
+def test_prefix_reuse_sends_the_prompt_as_a_shared_system_message(tmp_path, images):
+    prompt = "Rate the image from 0 to 100. " * 40
+    with StubOllamaServer(base_latency=0.01) as server:
+        classifier = OllamaImageClassifier(ollama_url=server.url, prefix_reuse=True)
+        results = classifier.process_directory(images, prompt, output_file=str(tmp_path / "results.json"),
+                                               max_workers=1)
+        request = server.last_request
+    assert request["messages"][0] == {"role": "system", "content": prompt}
+    assert "images" in request["messages"][1]
+    assert [r["classification"] for r in results] == ["50"] * 3
+
+    metrics = classifier.prefix_stats.metrics()
+    assert (metrics["cold_requests"], metrics["warm_requests"]) == (1, 2)
+    assert metrics["reused_tokens"] > 0
+
+
+def test_prefix_stats_estimate_the_saving():
+    stats = PrefixCacheStats()
+    for usage in ({"prompt_tokens": 1000, "prompt_eval_duration_s": 1.0},
+                  {"prompt_tokens": 200, "prompt_eval_duration_s": 0.2},
+                  {"prompt_tokens": 200, "prompt_eval_duration_s": 0.4}):
+        stats.record(usage)
+    metrics = stats.metrics()
+    assert metrics["reused_tokens"] == 1600
+    assert metrics["saved_s"] == pytest.approx(1.4)
+    assert PrefixCacheStats().metrics() == {"requests": 0}
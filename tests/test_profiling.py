@@ -0,0 +1,73 @@
+"""
+Perfilado de una ejecución: pilas plegadas, cProfile y checkpoints de memoria
+"""
+
+import argparse
+import threading
+import time
+
+import pytest
+
+import profiling
+from profiling import RunProfiler, add_profile_arguments, checkpoint, run_profiled
+
+
+def busy_worker(seconds: float):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def workload():
+    blocks = [bytearray(1024) for _ in range(100)]
+    checkpoint("a_mitad")
+    thread = threading.Thread(target=busy_worker, args=(0.2,))
+    thread.start()
+    thread.join()
+    return len(blocks)
+
+
+def parse(argv):
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser, "TEST")
+    return parser.parse_args(argv)
+
+
+def test_without_profile_the_function_just_runs(tmp_path):
+    assert run_profiled(parse(["--profile-dir", str(tmp_path / "p")]), workload) == 100
+    assert not (tmp_path / "p").exists()
+    assert profiling._active is None
+
+
+def test_sampling_profile_writes_folded_stacks_and_memory_report(tmp_path):
+    args = parse(["--profile", "--profile-dir", str(tmp_path), "--profile-interval", "0.002"])
+    assert args.profile == "sampling"
+    assert run_profiled(args, workload) == 100
+    assert profiling._active is None
+
+    folded = (tmp_path / "stacks.folded").read_text(encoding="utf-8")
+    assert "test_profiling.py:busy_worker" in folded
+    summary = (tmp_path / "summary.txt").read_text(encoding="utf-8")
+    assert "FUNCIONES POR TIEMPO PROPIO" in summary
+    assert "a_mitad" in summary and "MEMORIA POR CHECKPOINT" in summary
+    assert not (tmp_path / "profile.pstats").exists()
+
+
+def test_cprofile_mode_sees_worker_threads(tmp_path):
+    import pstats
+
+    profiler = RunProfiler("cprofile", str(tmp_path), trace_memory=False)
+    profiler.start()
+    try:
+        workload()
+    finally:
+        paths = profiler.stop()
+    functions = {name for (_, _, name) in pstats.Stats(str(paths["pstats"])).stats}
+    assert "busy_worker" in functions
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        RunProfiler("perf")
@@ -0,0 +1,95 @@
+"""
+Evaluación de variantes del prompt: caché de respuestas, modo mock y recomendación
+"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from prompt_profiler import ResponseCache, TokenCounter, evaluate_variant, mock_responder, recommend
+
+MODEL = "gpt-test"
+
+
+@pytest.fixture
+def dataset():
+    return pd.DataFrame({
+        "frase": ["Soy de Madrid", "Me gusta el cine"],
+        "sense_ME": ["Physical", "Preference"],
+        "reference_ME": [None, None],
+        "attribution_ME": [None, None],
+    })
+
+
+def real_answer(sense: str) -> dict:
+    body = {"sentences": [{"text": "x", "sense": sense, "reference": "NA", "attribution": "NA"}]}
+    return {"response": json.dumps(body), "prompt_tokens": 100, "completion_tokens": 10}
+
+
+def test_mock_mode_neither_reads_nor_writes_the_cache(tmp_path, dataset):
+    cache = ResponseCache(str(tmp_path / "cache.jsonl"))
+    cache.put(cache.make_key(MODEL, "prompt", "Soy de Madrid"), real_answer("Physical"))
+    mock = mock_responder({"sense": "Preference", "reference": "NA", "attribution": "NA"})
+
+    result = evaluate_variant("original", "prompt", dataset, MODEL, cache, mock, TokenCounter(), use_cache=False)
+
+    # Las dos frases reciben la respuesta fija (la entrada real no se usa)...
+    assert result["accuracy"]["sense"] == 0.5
+    assert result["api_prompt_tokens"] is None
+    # ...y la caché solo conserva la respuesta real
+    lines = (tmp_path / "cache.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 1
+    assert len(ResponseCache(str(tmp_path / "cache.jsonl"))._entries) == 1
+
+
+def test_replay_uses_only_cached_answers(tmp_path, dataset):
+    cache = ResponseCache(str(tmp_path / "cache.jsonl"))
+    cache.put(cache.make_key(MODEL, "prompt", "Soy de Madrid"), real_answer("Physical"))
+
+    result = evaluate_variant("original", "prompt", dataset, MODEL, cache, None, TokenCounter())
+
+    assert result["answered"] == 1
+    assert result["coverage"] == 0.5
+    assert result["accuracy"]["sense"] == 1.0
+    assert result["api_prompt_tokens"] == 100
+
+
+def test_live_answers_are_cached(tmp_path, dataset):
+    cache = ResponseCache(str(tmp_path / "cache.jsonl"))
+    calls = []
+
+    def live(prompt, sentence):
+        calls.append(sentence)
+        return real_answer("Physical")
+
+    evaluate_variant("original", "prompt", dataset, MODEL, cache, live, TokenCounter())
+    evaluate_variant("original", "prompt", dataset, MODEL, ResponseCache(str(tmp_path / "cache.jsonl")),
+                     live, TokenCounter())
+    assert calls == ["Soy de Madrid", "Me gusta el cine"]
+
+
+def test_api_error_leaves_only_that_sentence_unanswered(tmp_path, dataset):
+    cache = ResponseCache(str(tmp_path / "cache.jsonl"))
+
+    def flaky(prompt, sentence):
+        if sentence == "Me gusta el cine":
+            raise RuntimeError("HTTP 500")
+        return real_answer("Physical")
+
+    result = evaluate_variant("original", "prompt", dataset, MODEL, cache, flaky, TokenCounter(), max_workers=2)
+    assert result["answered"] == 1
+    assert result["coverage"] == 0.5
+
+
+def variant(name, tokens, coverage, accuracy):
+    return {"variant": name, "prompt_tokens": tokens, "coverage": coverage, "mean_accuracy": accuracy}
+
+
+def test_recommend_requires_baseline_coverage():
+    results = [variant("original", 1000, 1.0, 0.80),
+               variant("poca_cobertura", 300, 0.1, 0.95),
+               variant("sin_decoracion", 700, 1.0, 0.795),
+               variant("peor", 500, 1.0, 0.70)]
+    assert recommend(results, tolerance=0.01)["variant"] == "sin_decoracion"
+    assert recommend([variant("original", 1000, 1.0, None)]) is None
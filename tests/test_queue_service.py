@@ -0,0 +1,198 @@
+"""
+Cola persistente: leases, confirmación, caducidad, heartbeat y API HTTP
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from queue_service import JobQueue, QueueWorker, make_api_server
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue.db"), max_attempts=2)
+
+
+def test_lease_and_complete(queue):
+    job_id = queue.enqueue("a.jpg", "capital")
+    jobs = queue.lease("w1", 10, 60)
+    assert [job["id"] for job in jobs] == [job_id]
+    assert jobs[0]["attempts"] == 1
+    assert queue.lease("w2", 10, 60) == []
+
+    assert not queue.complete(job_id, "w2", {"classification": "50"})
+    assert queue.complete(job_id, "w1", {"classification": "50"})
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"classification": "50"}
+
+
+def test_expired_lease_is_redelivered_until_max_attempts(queue):
+    job_id = queue.enqueue("a.jpg", "capital")
+    assert queue.lease("w1", 1, 0.01)
+    time.sleep(0.02)
+
+    jobs = queue.lease("w2", 1, 0.01)
+    assert [(job["id"], job["attempts"]) for job in jobs] == [(job_id, 2)]
+    # El worker original ya no puede confirmar un trabajo que perdió
+    assert not queue.complete(job_id, "w1", {})
+
+    time.sleep(0.02)
+    assert queue.lease("w3", 1, 60) == []
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_fail_requeues_until_max_attempts(queue):
+    job_id = queue.enqueue("a.jpg", "capital")
+    queue.lease("w1", 1, 60)
+    assert queue.fail(job_id, "w1", "timeout")
+    assert queue.get(job_id)["status"] == "queued"
+
+    queue.lease("w1", 1, 60)
+    queue.fail(job_id, "w1", "timeout")
+    assert queue.get(job_id)["status"] == "failed"
+    assert queue.stats() == {"failed": 1}
+
+
+def test_extend_keeps_lease_alive(queue):
+    job_id = queue.enqueue("a.jpg", "capital")
+    queue.lease("w1", 1, 0.05)
+    assert queue.extend([job_id], "w2", 60) == 0
+    assert queue.extend([job_id], "w1", 60) == 1
+    time.sleep(0.1)
+    assert queue.lease("w2", 1, 60) == []
+
+
+class SlowClassifier:
+    """Clasificador falso: "slow.jpg" tarda `slow` segundos y el resto casi nada"""
+
+    def __init__(self, slow: float):
+        self.slow = slow
+        self.calls = []
+
+    def classify_file(self, path, prompt):
+        self.calls.append(path)
+        time.sleep(self.slow if path == "slow.jpg" else 0.01)
+        return {"classification": "50", "error": None}
+
+
+def test_worker_has_no_head_of_line_blocking_and_renews_leases(queue):
+    slow_id = queue.enqueue("slow.jpg", "capital")
+    for i in range(8):
+        queue.enqueue(f"{i}.jpg", "capital")
+    classifier = SlowClassifier(slow=1.0)
+    # El lease dura menos que la imagen lenta: sin heartbeat se entregaría otra vez
+    worker = QueueWorker(queue, classifier, {"capital": "prompt"}, max_workers=2,
+                         visibility_timeout=0.3, poll_interval=0.02)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        time.sleep(0.6)
+        stats = queue.stats()
+        assert stats.get("done") == 8
+        assert stats.get("leased") == 1
+        deadline = time.monotonic() + 5
+        while queue.get(slow_id)["status"] != "done" and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+        thread.join()
+    assert queue.get(slow_id)["status"] == "done"
+    assert queue.get(slow_id)["attempts"] == 1
+    assert classifier.calls.count("slow.jpg") == 1
+
+
+def test_worker_fails_unknown_prompt(queue):
+    job_id = queue.enqueue("a.jpg", "otro")
+    worker = QueueWorker(queue, SlowClassifier(0), {"capital": "prompt"}, poll_interval=0.02)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.3)
+    worker.stop()
+    thread.join()
+    assert "Prompt desconocido" in queue.get(job_id)["error"]
+
+
+@pytest.fixture
+def api(queue):
+    server = make_api_server(queue, {"capital": "prompt"}, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def post(url: str, body: bytes):
+    request = urllib.request.Request(f"{url}/jobs", data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_api_enqueue_and_status(api, queue):
+    status, body = post(api, json.dumps({"jobs": [{"path": "a.jpg", "prompt": "capital"},
+                                                  {"path": "b.jpg", "prompt": "capital"}]}).encode())
+    assert status == 202
+    assert len(body["ids"]) == 2
+    with urllib.request.urlopen(f"{api}/jobs/{body['ids'][0]}") as response:
+        assert json.loads(response.read())["status"] == "queued"
+
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b'"texto"', b"{no json", b'{"jobs": 3}', b'{"jobs": [1]}',
+                                  b'{"path": "a.jpg", "prompt": "otro"}'])
+def test_api_rejects_invalid_bodies(api, queue, body):
+    status, _ = post(api, body)
+    assert status == 400
+    assert queue.stats() == {}
+
+
+def test_stop_waits_for_in_flight_jobs_with_live_leases(queue):
+    job_id = queue.enqueue("slow.jpg", "capital")
+    worker = QueueWorker(queue, SlowClassifier(slow=0.5), {"capital": "prompt"},
+                         visibility_timeout=0.15, poll_interval=0.02)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.1)
+    worker.stop()
+    # Tras stop() el heartbeat sigue renovando el lease hasta que el trabajo termina
+    time.sleep(0.25)
+    assert queue.lease("otro", 1, 60) == []
+    thread.join()
+    assert queue.get(job_id)["status"] == "done"
+    assert queue.get(job_id)["attempts"] == 1
+
+
+def test_enqueue_rejects_prompts_unknown_to_serve(tmp_path, capsys):
+    import queue_service
+
+    images = tmp_path / "imgs"
+    images.mkdir()
+    (images / "a.jpg").write_bytes(b"")
+    db = str(tmp_path / "queue.db")
+
+    assert queue_service.main(["enqueue", str(images), "--db", db, "--prompt", "capital"]) == 2
+    JobQueue(db).register_prompts(["capital"])
+    assert queue_service.main(["enqueue", str(images), "--db", db, "--prompt", "otro"]) == 2
+    assert "capital" in capsys.readouterr().out
+    assert queue_service.main(["enqueue", str(images), "--db", db, "--prompt", "capital"]) == 0
+    assert JobQueue(db).stats() == {"queued": 1}
+
+
+def test_classifier_options_shared_with_serve(monkeypatch):
+    import argparse
+
+    from classify_images_with_ollama import add_classifier_arguments, classifier_from_args
+
+    monkeypatch.setenv("OLLAMA_URL", "http://gpu01:11434")
+    parser = argparse.ArgumentParser()
+    add_classifier_arguments(parser)
+    classifier = classifier_from_args(parser.parse_args(["--model", "llava", "--max-image-size", "512",
+                                                         "--timeout", "30"]))
+    assert (classifier.model_name, classifier.ollama_url) == ("llava", "http://gpu01:11434")
+    assert (classifier.max_image_size, classifier.request_timeout) == (512, 30.0)
@@ -0,0 +1,79 @@
+"""
+Grabación y reproducción de respuestas del backend
+"""
+
+import gzip
+import json
+
+import httpx
+import pytest
+from PIL import Image
+
+from classify_images_with_ollama import OllamaImageClassifier
+from ollama_stub import StubOllamaServer
+from replay import ReplayArchive, install_session, latency_stats, openai_transport, request_fingerprint
+
+
+@pytest.fixture
+def images(tmp_path):
+    directory = tmp_path / "imgs"
+    directory.mkdir()
+    for i, color in enumerate(("red", "green", "blue")):
+        Image.new("RGB", (32, 32), color).save(directory / f"{i}.png")
+    return directory
+
+
+def test_fingerprint_ignores_host_key_order_and_gzip():
+    body = json.dumps({"model": "m", "prompt": "p"})
+    fingerprint = request_fingerprint("post", "http://a:11434/api/generate", body)
+    assert fingerprint == request_fingerprint("POST", "http://b:1/api/generate",
+                                              gzip.compress(b'{"prompt": "p", "model": "m"}'))
+    assert fingerprint != request_fingerprint("POST", "http://a:11434/api/chat", body)
+    assert fingerprint != request_fingerprint("POST", "http://a:11434/api/generate", body.replace("p", "q"))
+
+
+def test_recorded_run_replays_without_the_backend(tmp_path, images):
+    path = tmp_path / "run.jsonl.gz"
+    with StubOllamaServer(base_latency=0.0, responses={"gemma3:27b-it-qat": "70"}) as server:
+        url = server.url
+        classifier = OllamaImageClassifier(ollama_url=url)
+        archive = ReplayArchive.for_recording(path)
+        install_session(classifier.session, "record", archive)
+        recorded = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "a.json"))
+        archive.close()
+
+    # El servidor ya no existe: todo sale de la grabación
+    classifier = OllamaImageClassifier(ollama_url=url, max_retries=1)
+    install_session(classifier.session, "replay", ReplayArchive.for_replay(path), latency_scale=0)
+    replayed = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "b.json"))
+
+    assert [r["classification"] for r in replayed] == [r["classification"] for r in recorded] == ["70"] * 3
+    stats = latency_stats(path)
+    assert stats["/api/generate"]["requests"] == 3
+    assert stats["/api/generate"]["status"] == {200: 3}
+
+
+def test_unrecorded_request_fails_like_a_connection_error(tmp_path, images):
+    path = tmp_path / "empty.jsonl.gz"
+    ReplayArchive.for_recording(path).close()
+    classifier = OllamaImageClassifier(ollama_url="http://127.0.0.1:9", max_retries=1)
+    install_session(classifier.session, "replay", ReplayArchive.for_replay(path), latency_scale=0)
+
+    results = classifier.process_directory(images, "prompt", output_file=str(tmp_path / "b.json"))
+    assert [r["classification"] for r in results] == ["ERROR"] * 3
+
+
+def test_repeated_requests_are_served_in_recorded_order(tmp_path):
+    path = tmp_path / "run.jsonl.gz"
+    archive = ReplayArchive.for_recording(path)
+    for answer in ("a", "b"):
+        archive.record("POST", "https://api.openai.com/v1/chat/completions", b'{"x": 1}', 200,
+                       json.dumps({"answer": answer}).encode(), "application/json", 0.5)
+    archive.close()
+
+    client = httpx.Client(transport=openai_transport("replay", ReplayArchive.for_replay(path), latency_scale=0))
+    answers = [client.post("https://otro-host/v1/chat/completions", content=b'{"x":1}').json()["answer"]
+               for _ in range(3)]
+    assert answers == ["a", "b", "b"]
+    with pytest.raises(httpx.ConnectError):
+        client.post("https://otro-host/v1/chat/completions", content=b'{"x": 2}')
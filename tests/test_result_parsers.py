@@ -0,0 +1,74 @@
+"""
+Parsers de respuestas de clasificación de imágenes
+"""
+
+import pytest
+
+from result_parsers import JSONParser, NAScoreParser, NumericScoreParser, get_parser
+
+
+@pytest.mark.parametrize("text, score", [("75", 75.0), ("Puntuación: 42.5", 42.5), ("0", 0.0)])
+def test_numeric_score(text, score):
+    parsed = NumericScoreParser().parse(text)
+    assert parsed.ok
+    assert parsed.score == score
+    assert not parsed.is_na
+
+
+@pytest.mark.parametrize("text", ["NA", "sin puntuación", "150"])
+def test_numeric_score_failures(text):
+    parsed = NumericScoreParser().parse(text)
+    assert not parsed.ok
+    assert parsed.error
+    assert parsed.to_record()["parse_error"] == parsed.error
+
+
+def test_na_score_accepts_na():
+    parsed = NAScoreParser().parse("NA")
+    assert parsed.ok and parsed.is_na
+    assert parsed.value == "NA"
+    assert parsed.score is None
+    assert NAScoreParser().parse("60").score == 60.0
+
+
+def test_json_parser_extracts_and_validates():
+    parser = JSONParser(required={"label": str}, score_field="score")
+    parsed = parser.parse('Respuesta: {"label": "capital", "score": 80} fin')
+    assert parsed.ok
+    assert parsed.value == {"label": "capital", "score": 80}
+    assert parsed.score == 80.0
+
+    na = parser.parse('{"label": "capital", "score": "NA"}')
+    assert na.ok and na.is_na and na.score is None
+
+
+@pytest.mark.parametrize("text, error", [
+    ("sin json", "No se encontró JSON"),
+    ("{no es json}", "JSON inválido"),
+    ('{"score": 3}', "Falta el campo 'label'"),
+    ('{"label": 3}', "Tipo inválido en 'label'"),
+])
+def test_json_parser_failures(text, error):
+    parsed = JSONParser(required={"label": str}).parse(text)
+    assert not parsed.ok
+    assert error in parsed.error
+
+
+def test_get_parser():
+    assert isinstance(get_parser("na_score"), NAScoreParser)
+    assert get_parser("score", max_value=10).max_value == 10
+    with pytest.raises(ValueError):
+        get_parser("desconocido")
+
+
+@pytest.mark.parametrize("text, score", [("750", 750.0), ("Puntuación: 1000", 1000.0), ("0,5", 0.5)])
+def test_numeric_score_uses_the_configured_range(text, score):
+    assert NumericScoreParser(max_value=1000).parse(text).score == score
+    assert NAScoreParser(max_value=1000).parse(text).score == score
+
+
+def test_numeric_score_range_errors():
+    assert "fuera de rango" in NumericScoreParser(max_value=1000).parse("1500").error
+    assert "fuera de rango" in NumericScoreParser().parse("150").error
+    assert NumericScoreParser(min_value=-10, max_value=10).parse("-5").score == -5.0
+    assert not NumericScoreParser().parse("-5").ok
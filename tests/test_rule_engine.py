@@ -0,0 +1,106 @@
+"""
+Reglas locales: separación de frases, lugares, palabras clave, auditoría y cobertura
+"""
+
+import pytest
+
+from classify_with_gpt import REFERENCE_MAPPING, SENSE_MAPPING
+from rule_engine import RuleEngine, coverage_report, keyword_variants, split_sentences
+
+
+@pytest.fixture
+def engine():
+    return RuleEngine(REFERENCE_MAPPING, SENSE_MAPPING, audit_rate=0.0)
+
+
+def rules(match):
+    return [sentence["rule"] for sentence in match["sentences"]]
+
+
+@pytest.mark.parametrize("text", ["Soy de Izquierdas", "Soy de Acuario", "Soy de Letras", "Soy de Dios",
+                                  "In Love", "Soy de Madrid y me encanta", "Me gusta el cine"])
+def test_uncovered_inputs_go_to_the_model(engine, text):
+    assert engine.lookup(text) is None
+
+
+@pytest.mark.parametrize("text", ["Soy de Madrid", "Vivo en Sevilla", "Nací en Rosario", "I live in London",
+                                  "From Mexico", "Soy de Santa Cruz de Tenerife"])
+def test_location_needs_residence_verb_or_known_place(engine, text):
+    assert rules(engine.lookup(text)) == ["Local"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Estudiante", ["Educational role"]),
+    ("25 años", ["Age"]),
+    ("Médica", ["Job"]),
+    ("Soy profesora", ["Job"]),
+    ("🇪🇸", ["State identity"]),
+    ("Ingeniera - Española", ["Job", "State identity"]),
+])
+def test_keyword_age_and_flag_rules(engine, text, expected):
+    assert rules(engine.lookup(text)) == expected
+
+
+def test_labels_come_from_the_mappings(engine):
+    match = engine.lookup("Estudiante")
+    assert match["sentences"][0]["labels"] == (SENSE_MAPPING["Collective"], REFERENCE_MAPPING["Educational role"],
+                                               "No")
+    # Sin la categoría en los mapeos, la regla no existe
+    reduced = {key: value for key, value in REFERENCE_MAPPING.items() if key != "Educational role"}
+    assert RuleEngine(reduced, SENSE_MAPPING, audit_rate=0.0).lookup("Estudiante") is None
+
+
+def test_keyword_variants():
+    assert keyword_variants("profesor") == ["profesor", "profesora"]
+    assert keyword_variants("estudiante universitario") == ["estudiante universitario",
+                                                            "estudiante universitaria"]
+    assert keyword_variants("estudiante") == ["estudiante"]
+
+
+def test_split_sentences():
+    assert split_sentences("25 años\nMédico 👨‍⚕️ estudiante Trabajo en Madrid") == \
+        ["25 años", "Médico", "👨‍⚕️", "estudiante", "Trabajo en Madrid"]
+
+
+def test_audit_rate_selects_a_fraction_of_covered_inputs():
+    engine = RuleEngine(REFERENCE_MAPPING, SENSE_MAPPING, audit_rate=0.5, seed=1)
+    audited = sum(engine.lookup("Estudiante")["audit"] for _ in range(200))
+    assert 60 < audited < 140
+
+    match = engine.lookup("Estudiante")
+    engine.observe(match, match["sentences"][0]["labels"])
+    engine.observe(match, ("ERROR", "ERROR", "ERROR"))
+    assert engine.stats.metrics()["audit"]["items"] == 1
+    assert engine.stats.metrics()["audit"]["accuracy"] == 1.0
+
+
+def test_coverage_report(engine):
+    labels = engine.lookup("Estudiante")["sentences"][0]["labels"]
+    report = coverage_report(engine, ["Estudiante", "Me gusta el cine"],
+                             {"ref": [labels, ("NA", "NA", "NA")]})
+    assert report["items"] == 2 and report["answered"] == 1
+    assert report["coverage"] == 0.5
+    assert report["agreement"]["ref"]["accuracy"] == 1.0
+
+
+def test_agreement_skips_entries_without_reference(engine):
+    labels = engine.lookup("Estudiante")["sentences"][0]["labels"]
+    report = coverage_report(engine, ["Estudiante", "Médico"], {"modelo": [labels, None]})
+    assert report["agreement"]["modelo"]["items"] == 1
+    assert report["agreement"]["modelo"]["accuracy"] == 1.0
+
+
+def test_main_ignores_missing_and_error_model_results(tmp_path, monkeypatch, capsys):
+    import sys
+
+    import rule_engine
+
+    (tmp_path / "input.csv").write_text("bio_num,frase_num,frase\n1,1,Estudiante\n1,2,Médico\n2,1,25 años\n",
+                                        encoding="utf-8")
+    (tmp_path / "results.csv").write_text(
+        "bio_num,frase_num,sense_predicted,reference_predicted,attribution_predicted\n"
+        "1,1,Consensual,Anclaje,No\n1,2,ERROR,ERROR,ERROR\n", encoding="utf-8")
+    monkeypatch.setattr(sys, "argv", ["rule_engine.py", str(tmp_path / "input.csv"),
+                                      "--results", str(tmp_path / "results.csv")])
+    rule_engine.main()
+    assert "Acuerdo con modelo: 100.0% en 1 frases" in capsys.readouterr().out
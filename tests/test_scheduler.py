@@ -0,0 +1,77 @@
+"""
+Planificador con prioridades: huecos reservados, orden de servicio y plazos
+"""
+
+import threading
+import time
+
+import pytest
+
+from scheduler import (BATCH, INTERACTIVE, DeadlineExpired, PriorityScheduler, current_request_class,
+                       request_class)
+
+
+def wait_for_waiting(scheduler, count):
+    deadline = time.monotonic() + 2
+    while len(scheduler._waiting) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert len(scheduler._waiting) == count
+
+
+def test_reserved_slot_is_only_for_interactive_requests():
+    scheduler = PriorityScheduler(capacity=2, reserved=1)
+    scheduler.acquire(BATCH)
+    with pytest.raises(DeadlineExpired):
+        scheduler.acquire(BATCH, deadline=time.monotonic() + 0.05)
+    scheduler.acquire(INTERACTIVE, deadline=time.monotonic() + 0.05)
+    assert scheduler.in_flight == {BATCH: 1, INTERACTIVE: 1}
+    assert scheduler.metrics()["classes"][BATCH]["expired"] == 1
+
+
+def test_interactive_first_then_earliest_deadline_then_arrival():
+    scheduler = PriorityScheduler(capacity=1, reserved=0)
+    scheduler.acquire(BATCH)
+    started = []
+    now = time.monotonic()
+
+    def request(name, priority, deadline=None):
+        scheduler.acquire(priority, deadline)
+        started.append(name)
+        scheduler.release(priority)
+
+    arrivals = [("lote", BATCH, None), ("lote_urgente", BATCH, now + 30), ("lote_2", BATCH, None),
+                ("interactivo", INTERACTIVE, None)]
+    threads = []
+    for count, args in enumerate(arrivals, 1):
+        threads.append(threading.Thread(target=request, args=args))
+        threads[-1].start()
+        wait_for_waiting(scheduler, count)
+
+    scheduler.release(BATCH)
+    for thread in threads:
+        thread.join()
+    assert started == ["interactivo", "lote_urgente", "lote", "lote_2"]
+
+
+def test_request_class_binds_priority_and_deadline_per_thread():
+    assert current_request_class() == (BATCH, None)
+    with request_class(INTERACTIVE, 12.0):
+        assert current_request_class() == (INTERACTIVE, 12.0)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(current_request_class()))
+        thread.start()
+        thread.join()
+        assert seen == [(BATCH, None)]
+    assert current_request_class() == (BATCH, None)
+    with pytest.raises(ValueError):
+        with request_class("urgente"):
+            pass
+
+
+def test_slot_uses_the_bound_class_and_records_waits():
+    scheduler = PriorityScheduler(capacity=2, reserved=1)
+    with request_class(INTERACTIVE):
+        with scheduler.slot():
+            assert scheduler.in_flight[INTERACTIVE] == 1
+    assert scheduler.in_flight[INTERACTIVE] == 0
+    assert scheduler.metrics()["classes"][INTERACTIVE]["requests"] == 1
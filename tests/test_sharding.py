@@ -0,0 +1,98 @@
+"""
+Reparto en fragmentos y unión de sus resultados
+"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from sharding import merge_results, parse_shard, select_shard, shard_key
+
+
+def write_jsonl(path: Path, records):
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+
+
+def record(root: str, name: str, classification="50", timestamp="2024-01-01 10:00:00"):
+    return {"file": name, "path": f"{root}/{name}", "shard_key": name,
+            "classification": classification, "timestamp": timestamp}
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for spec in ("4/4", "-1/4", "1/0", "uno/dos", "3"):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+
+
+def test_shards_partition_the_directory_independently_of_its_root(tmp_path):
+    names = [f"sub/img_{i}.jpg" for i in range(40)]
+    files_a = [tmp_path / "nodo_a" / name for name in names]
+    files_b = [Path("/mnt/otro/montaje") / name for name in names]
+
+    shards_a = [select_shard(files_a, tmp_path / "nodo_a", i, 3) for i in range(3)]
+    shards_b = [select_shard(files_b, "/mnt/otro/montaje", i, 3) for i in range(3)]
+
+    assert sorted(f for shard in shards_a for f in shard) == sorted(files_a)
+    assert [[shard_key(f, tmp_path / "nodo_a") for f in shard] for shard in shards_a] == \
+           [[shard_key(f, "/mnt/otro/montaje") for f in shard] for shard in shards_b]
+
+
+def test_merge_detects_duplicates_across_mount_roots(tmp_path):
+    write_jsonl(tmp_path / "s0.jsonl", [record("/data/a", "x.jpg"), record("/data/a", "y.jpg")])
+    write_jsonl(tmp_path / "s1.jsonl", [record("/mnt/b", "y.jpg"), record("/mnt/b", "z.jpg")])
+
+    stats = merge_results([tmp_path / "s0.jsonl", tmp_path / "s1.jsonl"], tmp_path / "merged.json")
+
+    assert stats == {"records": 3, "duplicates": 1, "conflicts": 0}
+    merged = json.loads((tmp_path / "merged.json").read_text(encoding="utf-8"))
+    assert [r["shard_key"] for r in merged] == ["x.jpg", "y.jpg", "z.jpg"]
+
+
+def test_merge_prefers_valid_then_most_recent(tmp_path):
+    write_jsonl(tmp_path / "s0.jsonl", [record("/a", "x.jpg", "70", "2024-01-01 10:00:00"),
+                                        record("/a", "y.jpg", "40")])
+    write_jsonl(tmp_path / "s1.jsonl", [record("/b", "x.jpg", "80", "2024-01-02 10:00:00"),
+                                        record("/b", "y.jpg", "ERROR", "2024-01-03 10:00:00")])
+
+    stats = merge_results([tmp_path / "s0.jsonl", tmp_path / "s1.jsonl"], tmp_path / "merged.json")
+
+    assert stats == {"records": 2, "duplicates": 2, "conflicts": 2}
+    merged = {r["shard_key"]: r for r in json.loads((tmp_path / "merged.json").read_text(encoding="utf-8"))}
+    assert merged["x.jpg"]["classification"] == "80"
+    assert merged["y.jpg"]["classification"] == "40"
+
+
+def test_merge_falls_back_to_path_for_records_without_shard_key(tmp_path):
+    old = {"file": "x.jpg", "path": "/data/x.jpg", "classification": "50", "timestamp": "2024-01-01 10:00:00"}
+    write_jsonl(tmp_path / "s0.jsonl", [old])
+    write_jsonl(tmp_path / "s1.jsonl", [old])
+
+    stats = merge_results([tmp_path / "s0.jsonl", tmp_path / "s1.jsonl"], tmp_path / "merged.json")
+
+    assert stats["records"] == 1 and stats["duplicates"] == 1
+
+
+def test_run_uses_the_classifier_options(tmp_path):
+    from PIL import Image
+
+    from ollama_stub import StubOllamaServer
+    from sharding import main
+
+    images = tmp_path / "imgs"
+    images.mkdir()
+    for i in range(4):
+        Image.new("RGB", (16, 16), "red").save(images / f"{i}.png")
+    (tmp_path / "prompt.txt").write_text("prompt", encoding="utf-8")
+
+    keys = []
+    with StubOllamaServer(base_latency=0.0, responses={"llava": "77"}) as server:
+        for index in range(2):
+            output = tmp_path / f"shard_{index}.jsonl"
+            main(["run", str(images), "--shard", f"{index}/2", "--prompt-file", str(tmp_path / "prompt.txt"),
+                  "--output", str(output), "--url", server.url, "--model", "llava", "--max-image-size", "8"])
+            records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+            assert all(r["classification"] == "77" and r["model"] == "llava" for r in records)
+            keys += [r["shard_key"] for r in records]
+    assert sorted(keys) == ["0.png", "1.png", "2.png", "3.png"]
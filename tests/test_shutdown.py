@@ -0,0 +1,118 @@
+"""
+Etapas con colas acotadas y parada ordenada
+"""
+
+import threading
+import time
+
+import pytest
+
+from shutdown import (GracefulShutdown, clear_resume_marker, read_resume_marker, resume_marker_path, run_stages,
+                      write_resume_marker)
+
+
+def test_run_stages_writes_every_item_in_the_calling_thread():
+    written = {}
+    writer_threads = set()
+
+    def write(item, result):
+        writer_threads.add(threading.current_thread())
+        written[item] = result
+
+    stats = run_stages(range(50), lambda x: x * x, write, workers=4, load=lambda x: x + 1, queue_size=3)
+
+    assert written == {x + 1: (x + 1) ** 2 for x in range(50)}
+    assert writer_threads == {threading.current_thread()}
+    assert stats.written == 50
+    assert stats.peak_loaded <= 3 and stats.peak_finished <= 3
+    assert not stats.interrupted
+
+
+def test_load_stage_is_bounded_by_the_queue():
+    loaded = []
+    release = threading.Event()
+
+    def infer(item):
+        release.wait()
+        return item
+
+    def load(item):
+        loaded.append(item)
+        return item
+
+    worker = threading.Thread(target=run_stages, args=(range(100), infer, lambda *_: None),
+                              kwargs={"workers": 2, "load": load, "queue_size": 2})
+    worker.start()
+    time.sleep(0.3)
+    # 2 en vuelo + 2 en la cola + 1 bloqueado esperando hueco
+    assert len(loaded) <= 5
+    release.set()
+    worker.join()
+    assert len(loaded) == 100
+
+
+def test_shutdown_stops_new_items_and_finishes_in_flight():
+    shutdown = GracefulShutdown(grace=5)
+    started = []
+
+    def infer(item):
+        started.append(item)
+        if item == 3:
+            shutdown.request("Prueba")
+        time.sleep(0.05)
+        return item
+
+    written = []
+    stats = run_stages(range(100), infer, lambda item, result: written.append(item), workers=2,
+                       shutdown=shutdown)
+
+    assert stats.interrupted
+    assert stats.abandoned == 0
+    assert 3 in written
+    assert sorted(written) == sorted(started)
+    assert len(written) < 100
+
+
+def test_grace_expiry_abandons_in_flight_items():
+    shutdown = GracefulShutdown(grace=0.1)
+    release = threading.Event()
+
+    def infer(item):
+        if item == 0:
+            shutdown.request("Prueba")
+            release.wait(5)
+        return item
+
+    started = time.monotonic()
+    stats = run_stages(range(10), infer, lambda *_: None, workers=1, shutdown=shutdown)
+    release.set()
+
+    assert time.monotonic() - started < 2
+    assert stats.interrupted
+    assert stats.abandoned == 1
+    assert stats.written == 0
+
+
+def test_errors_are_raised_in_the_caller():
+    def infer(item):
+        if item == 5:
+            raise RuntimeError("fallo en el worker")
+        return item
+
+    with pytest.raises(RuntimeError, match="fallo en el worker"):
+        run_stages(range(20), infer, lambda *_: None, workers=3)
+
+
+def test_resume_marker_round_trip(tmp_path):
+    shutdown = GracefulShutdown()
+    shutdown.request("Recibida SIGTERM")
+    path = resume_marker_path(tmp_path / "results")
+
+    write_resume_marker(path, shutdown, 7, ["a.jpg", "b.jpg"], tmp_path / "results.partial.jsonl")
+    marker = read_resume_marker(path)
+
+    assert marker["reason"] == "Recibida SIGTERM"
+    assert marker["completed"] == 7
+    assert marker["pending_items"] == ["a.jpg", "b.jpg"]
+    clear_resume_marker(path)
+    assert read_resume_marker(path) is None
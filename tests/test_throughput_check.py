@@ -0,0 +1,57 @@
+"""
+Diagnóstico de rendimiento de check_installation contra el servidor simulado
+"""
+
+import pytest
+
+from classify_images_with_ollama import OllamaImageClassifier
+from ollama_stub import StubOllamaServer
+from throughput_check import measure_latency, measure_saturation, recommend
+
+TYPICAL = "2048x1536"
+
+
+def test_saturation_stops_once_throughput_no_longer_rises():
+    with StubOllamaServer(base_latency=0.05, capacity=2) as server:
+        classifier = OllamaImageClassifier(ollama_url=server.url, max_retries=1)
+        rows = measure_saturation(classifier, b"AAAA", "prompt", max_concurrency=16, requests_per_level=8)
+        latency = measure_latency(classifier, b"AAAA", "prompt")
+
+    assert [row["concurrency"] for row in rows] == [1, 2, 4]
+    assert rows[1]["requests_per_s"] > 1.5 * rows[0]["requests_per_s"]
+    assert all(row["errors"] == 0 for row in rows)
+    assert latency["server_s"] == pytest.approx(0.05, abs=0.02)
+    assert latency["overhead_s"] < latency["p50_s"]
+
+
+def measurements(rate_by_concurrency, encode_rate, load_s=0.0):
+    saturation = [{"concurrency": c, "requests_per_s": r, "p50_s": 1.0, "p95_s": 1.0, "errors": 0}
+                  for c, r in rate_by_concurrency]
+    encode = [{"source": TYPICAL, "max_image_size": size, "images_per_s": rate, "payload_kb": 100.0}
+              for size, rate in encode_rate.items()]
+    rtt = {"first_ms": 1.0, "p50_ms": 0.5, "p95_ms": 0.8}
+    latency = {"p50_s": 1.0, "server_s": 0.99, "overhead_s": 0.01}
+    return encode, rtt, {"wall_s": load_s, "load_s": load_s}, latency, saturation
+
+
+def test_recommend_workers_processes_pool_and_keep_alive():
+    data = measurements([(1, 4.0), (2, 6.0), (4, 8.0), (8, 8.1)], {None: 3.0, 1024: 20.0}, load_s=5.0)
+    lines = recommend(*data, max_image_size=None, pool_size=2, cores=8)
+    text = "\n".join(lines)
+
+    assert "--workers 4" in text
+    assert "--processes 3" in text
+    assert "--keep-alive 30m" in text
+    assert "--pool-size 4" in text
+
+
+def test_recommend_smaller_images_when_encoding_needs_every_core():
+    data = measurements([(1, 8.0), (2, 8.0)], {None: 1.0, 1024: 5.0, 512: 12.0})
+    text = "\n".join(recommend(*data, max_image_size=None, pool_size=None, cores=2))
+    assert "--max-image-size 512" in text
+    assert "✅ Pool de conexiones suficiente" in text
+
+
+def test_recommend_reports_failed_runs():
+    data = measurements([(1, 0.0)], {None: 3.0})
+    assert recommend(*data, max_image_size=None, pool_size=None, cores=4)[0].startswith("❌")
@@ -0,0 +1,71 @@
+"""
+Contabilidad de tokens y parada por presupuesto
+"""
+
+import threading
+import time
+
+import pytest
+
+from usage import Budget, BudgetExceeded, UsageTracker
+
+
+def run_requests(tracker: UsageTracker, workers: int, tokens: int = 100):
+    """Lanza `workers` requests simultáneos de `tokens` tokens; devuelve cuántos se enviaron"""
+    sent = []
+    stopped = []
+    start = threading.Barrier(workers)
+
+    def request():
+        start.wait()
+        try:
+            tracker.acquire()
+        except BudgetExceeded:
+            stopped.append(True)
+            return
+        time.sleep(0.05)
+        sent.append(True)
+        tracker.record("gpt-4o-mini", tokens, 0)
+
+    threads = [threading.Thread(target=request) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(sent), len(stopped)
+
+
+def test_budget_stops_before_exceeding_token_cap_from_the_first_request():
+    tracker = UsageTracker(Budget(max_tokens=250))
+    sent, stopped = run_requests(tracker, workers=8)
+    # Sin medida previa solo sale un request; con su estimación cabe uno más (200 <= 250)
+    assert sent == 2 and stopped == 6
+    assert tracker.summary()["gpt-4o-mini"]["total_tokens"] <= 250
+    assert tracker.exhausted
+
+
+def test_cost_cap_counts_requests_in_flight():
+    tracker = UsageTracker(Budget(max_cost=0.0001))
+    tracker.acquire()
+    tracker.record("gpt-4o-mini", 200, 0)  # $0.00003
+    tracker.acquire()
+    tracker.acquire()
+    with pytest.raises(BudgetExceeded):
+        tracker.acquire()
+
+
+def test_failed_first_request_lets_the_next_one_measure():
+    tracker = UsageTracker(Budget(max_tokens=1000))
+    tracker.acquire()
+    waiter = threading.Thread(target=tracker.acquire)
+    waiter.start()
+    time.sleep(0.1)
+    assert waiter.is_alive()
+    tracker.release()
+    waiter.join(2)
+    assert not waiter.is_alive()
+
+
+def test_without_budget_requests_are_not_limited():
+    tracker = UsageTracker()
+    assert run_requests(tracker, workers=8) == (8, 0)
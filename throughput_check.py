@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Diagnóstico de rendimiento de una instalación (check_installation.py --throughput)
+
+Que los paquetes importen y Ollama responda no dice si la máquina llega al
+ritmo que necesitamos. Este módulo mide, con la misma capa HTTP y el mismo
+formato de request que classify_images_with_ollama.py:
+
+- codificación local: imágenes/s por núcleo al decodificar, reducir y
+  codificar en base64 fotos de tamaños típicos, para cada --max-image-size
+- ida y vuelta HTTP con Ollama (/api/version), con y sin conexión reutilizada
+- carga del modelo (request vacío a /api/generate, `load_duration`)
+- latencia de un request de clasificación, separando la parte del servidor
+  (`total_duration`) de la de red y cliente
+- rendimiento a concurrencia creciente (1, 2, 4...) hasta que deja de subir
+
+y con todo ello recomienda --workers, --max-image-size, --processes y
+--keep-alive, y comprueba si el pool de conexiones basta. Con el servidor
+simulado de ollama_stub.py se ejecuta sin red ni GPU.
+"""
+
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from classify_images_with_ollama import (DEFAULT_JPEG_QUALITY, OllamaImageClassifier, encode_image_file,
+                                         encode_json_payload)
+from transport import DEFAULT_POOL_SIZE, TransportConfig
+
+# Fotos típicas del corpus: web, cámara compacta y móvil de 12 MP
+SOURCE_SIZES: Tuple[Tuple[int, int], ...] = ((1280, 960), (2048, 1536), (4032, 3024))
+TYPICAL_SOURCE = (2048, 1536)
+TARGET_SIZES: Tuple[Optional[int], ...] = (None, 1536, 1024, 768, 512)
+SATURATION_GAIN = 1.1  # un nivel de concurrencia cuenta si sube el rendimiento al menos un 10%
+
+
+def synthetic_photo(width: int, height: int, quality: int = 90) -> bytes:
+    """JPEG con textura parecida a una foto (un color liso se codifica demasiado rápido)"""
+    base = Image.effect_noise((max(1, width // 16), max(1, height // 16)), 64).convert("RGB")
+    base = base.resize((width, height), Image.BICUBIC)
+    grain = Image.effect_noise((width, height), 24).convert("RGB")
+    with BytesIO() as buffer:
+        Image.blend(base, grain, 0.3).save(buffer, format="JPEG", quality=quality)
+        return buffer.getvalue()
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def measure_encode_rate(target_sizes: Sequence[Optional[int]] = TARGET_SIZES,
+                        source_sizes: Sequence[Tuple[int, int]] = SOURCE_SIZES,
+                        quality: int = DEFAULT_JPEG_QUALITY, seconds: float = 0.5) -> List[Dict]:
+    """
+    Imágenes/s en un núcleo (un hilo) para cada tamaño de origen y cada --max-image-size
+
+    Cada combinación se repite durante `seconds` (al menos dos veces).
+    """
+    rows = []
+    for width, height in source_sizes:
+        data = synthetic_photo(width, height)
+        for target in target_sizes:
+            count, payload = 0, b""
+            start = time.perf_counter()
+            while count < 2 or time.perf_counter() - start < seconds:
+                payload = encode_image_file(BytesIO(data), target, quality) or b""
+                count += 1
+            elapsed = time.perf_counter() - start
+            rows.append({"source": f"{width}x{height}", "max_image_size": target,
+                         "images_per_s": round(count / elapsed, 2), "payload_kb": round(len(payload) / 1024, 1)})
+    return rows
+
+
+def measure_rtt(classifier: OllamaImageClassifier, count: int = 20) -> Dict:
+    """Ida y vuelta de un GET ligero: el primero abre conexión, el resto la reutiliza"""
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        classifier.session.get(f"{classifier.ollama_url}/api/version", timeout=classifier.transport.timeouts(10))
+        timings.append(time.perf_counter() - start)
+    reused = timings[1:] or timings
+    return {"first_ms": round(timings[0] * 1000, 2), "p50_ms": round(percentile(reused, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(reused, 0.95) * 1000, 2)}
+
+
+def measure_model_load(classifier: OllamaImageClassifier) -> Dict:
+    """
+    Request sin prompt a /api/generate: Ollama solo carga el modelo (si no lo estaba ya)
+
+    `load_s` es el load_duration del servidor; cerca de 0 si el modelo ya estaba en memoria.
+    """
+    body = encode_json_payload(classifier.options.apply({"model": classifier.model_name, "prompt": "",
+                                                         "stream": False}))
+    start = time.perf_counter()
+    response = classifier._post("/api/generate", body, timeout=classifier.request_timeout)
+    wall = time.perf_counter() - start
+    response.raise_for_status()
+    return {"wall_s": round(wall, 3), "load_s": round(response.json().get("load_duration", 0) / 1e9, 3)}
+
+
+def _classify_once(classifier: OllamaImageClassifier, payload: bytes, prompt: str) -> Tuple[float, float, bool]:
+    """(latencia observada, total_duration del servidor, ok) de un request de clasificación"""
+    endpoint, body = classifier._build_request(classifier.model_name, prompt, [payload])
+    start = time.perf_counter()
+    try:
+        response = classifier._post(endpoint, body, timeout=classifier.request_timeout)
+    except Exception:
+        return time.perf_counter() - start, 0.0, False
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        return elapsed, 0.0, False
+    return elapsed, response.json().get("total_duration", 0) / 1e9, True
+
+
+def measure_latency(classifier: OllamaImageClassifier, payload: bytes, prompt: str, count: int = 3) -> Dict:
+    """Latencia de requests de uno en uno y la parte que se va fuera del servidor"""
+    samples = [_classify_once(classifier, payload, prompt) for _ in range(count)]
+    ok = [(wall, server) for wall, server, success in samples if success]
+    if not ok:
+        return {"p50_s": None, "server_s": None, "overhead_s": None, "errors": count}
+    wall = percentile([w for w, _ in ok], 0.5)
+    server = percentile([s for _, s in ok], 0.5)
+    return {"p50_s": round(wall, 3), "server_s": round(server, 3), "overhead_s": round(max(0.0, wall - server), 3),
+            "errors": count - len(ok)}
+
+
+def measure_saturation(classifier: OllamaImageClassifier, payload: bytes, prompt: str,
+                       max_concurrency: int = 16, requests_per_level: int = 0) -> List[Dict]:
+    """
+    Rendimiento con 1, 2, 4... requests en vuelo
+
+    Cada nivel envía requests_per_level requests (por defecto 2 por hilo, mínimo 8) y se
+    para en cuanto un nivel no mejora al anterior en un 10%: a partir de ahí solo crece la cola.
+    """
+    rows = []
+    concurrency = 1
+    while concurrency <= max_concurrency:
+        total = requests_per_level or max(8, concurrency * 2)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda _: _classify_once(classifier, payload, prompt), range(total)))
+        elapsed = time.perf_counter() - start
+        latencies = [wall for wall, _, success in samples if success]
+        rows.append({"concurrency": concurrency, "requests_per_s": round(len(latencies) / elapsed, 2),
+                     "p50_s": round(percentile(latencies, 0.5), 3), "p95_s": round(percentile(latencies, 0.95), 3),
+                     "errors": total - len(latencies)})
+        print(f"   {concurrency:3d} en vuelo: {rows[-1]['requests_per_s']:7.2f} req/s | "
+              f"p50 {rows[-1]['p50_s']:.2f}s | p95 {rows[-1]['p95_s']:.2f}s | {rows[-1]['errors']} errores")
+        if len(rows) > 1 and rows[-1]["requests_per_s"] < rows[-2]["requests_per_s"] * SATURATION_GAIN:
+            break
+        concurrency *= 2
+    return rows
+
+
+def recommend(encode: List[Dict], rtt: Dict, load: Dict, latency: Dict, saturation: List[Dict],
+              max_image_size: Optional[int], pool_size: Optional[int], cores: int) -> List[str]:
+    """Recomendaciones de configuración a partir de las medidas"""
+    lines = []
+    best = max(saturation, key=lambda row: row["requests_per_s"]) if saturation else None
+    if best is None or not best["requests_per_s"]:
+        return ["❌ Ningún request de clasificación terminó bien: revisa el modelo y los logs de Ollama"]
+
+    # Menor concurrencia que da el 90% del mejor rendimiento: más solo alarga la cola del servidor
+    workers = next(row["concurrency"] for row in saturation if row["requests_per_s"] >= 0.9 * best["requests_per_s"])
+    target_rate = best["requests_per_s"]
+    lines.append(f"⚙️ --workers {workers}: {target_rate:.2f} imágenes/s como máximo "
+                 f"(más requests en vuelo solo suben la latencia)")
+    if any(row["errors"] for row in saturation):
+        lines.append("⚠️ Hubo errores con concurrencia alta: sube --timeout o usa --adaptive")
+
+    # Codificación: procesos necesarios para alimentar ese ritmo con fotos típicas
+    typical = f"{TYPICAL_SOURCE[0]}x{TYPICAL_SOURCE[1]}"
+    by_size = {row["max_image_size"]: row for row in encode if row["source"] == typical}
+    current = by_size.get(max_image_size)
+    if current is not None:
+        needed = math.ceil(target_rate / current["images_per_s"])
+        size_name = max_image_size or "sin reducir"
+        if needed <= 1:
+            lines.append(f"✅ Codificación ({size_name}): {current['images_per_s']:.1f} imágenes/s por núcleo, "
+                         f"no hace falta --processes")
+        elif needed < cores:
+            lines.append(f"⚙️ --processes {needed}: un núcleo codifica {current['images_per_s']:.1f} imágenes/s "
+                         f"({size_name}) y el servidor acepta {target_rate:.2f}")
+        else:
+            fits = [size for size, row in by_size.items()
+                    if size is not None and math.ceil(target_rate / row["images_per_s"]) < cores]
+            if fits:
+                advice = f"usa --max-image-size {max(fits)}"
+            else:
+                fastest = max((size for size in by_size if size is not None),
+                              key=lambda size: by_size[size]["images_per_s"])
+                advice = (f"el ritmo lo marcará la CPU, ~{by_size[fastest]['images_per_s'] * cores:.0f} imágenes/s "
+                          f"con --max-image-size {fastest} y --processes {cores}")
+            lines.append(f"❌ La codificación ({size_name}) necesitaría {needed} núcleos y hay {cores}: {advice}")
+    if max_image_size is None and 1024 in by_size:
+        lines.append(f"💡 Sin --max-image-size se envían ~{by_size[None]['payload_kb']:.0f} KB por foto "
+                     f"típica; con 1024 ~{by_size[1024]['payload_kb']:.0f} KB")
+
+    # Red y carga del modelo
+    if latency.get("p50_s") and rtt["p50_ms"] / 1000 > 0.1 * latency["p50_s"]:
+        lines.append(f"⚠️ La ida y vuelta HTTP ({rtt['p50_ms']:.0f} ms) supera el 10% de la latencia: acerca el "
+                     f"cliente al servidor o prueba --gzip-requests")
+    if rtt["first_ms"] > 3 * max(rtt["p50_ms"], 0.1):
+        lines.append(f"💡 Abrir conexión cuesta {rtt['first_ms']:.1f} ms frente a {rtt['p50_ms']:.1f} ms "
+                     f"reutilizada: el pool de conexiones importa")
+    if load["load_s"] > 1:
+        lines.append(f"⚙️ --keep-alive 30m: cargar el modelo tarda {load['load_s']:.1f}s y Ollama lo descarga "
+                     f"tras 5 minutos sin requests")
+
+    # Pool de conexiones: la CLI lo ajusta a --workers salvo que se fije --pool-size
+    pool = pool_size or workers
+    if pool < workers:
+        lines.append(f"❌ Pool de conexiones insuficiente ({pool} < {workers} requests en vuelo): "
+                     f"--pool-size {workers} (sin fijarlo se ajusta a --workers)")
+    else:
+        lines.append(f"✅ Pool de conexiones suficiente ({pool} para {workers} requests en vuelo"
+                     f"{'' if pool_size else ', se ajusta a --workers'}; el TransportConfig por defecto "
+                     f"tiene {DEFAULT_POOL_SIZE})")
+    return lines
+
+
+def run_diagnostics(url: str, model: str, prompt: str, max_image_size: Optional[int] = None,
+                    jpeg_quality: int = DEFAULT_JPEG_QUALITY, max_concurrency: int = 16,
+                    requests_per_level: int = 0, encode_seconds: float = 0.5,
+                    pool_size: Optional[int] = None) -> Dict:
+    """
+    Ejecuta todas las medidas contra `url` y muestra las recomendaciones
+
+    Returns:
+        Diccionario con las medidas y las recomendaciones
+    """
+    cores = os.cpu_count() or 1
+    print(f"   🖼️ Codificación de imágenes (un núcleo de {cores}):")
+    targets = TARGET_SIZES if max_image_size in TARGET_SIZES else TARGET_SIZES + (max_image_size,)
+    encode = measure_encode_rate(targets, quality=jpeg_quality, seconds=encode_seconds)
+    for row in encode:
+        size = row["max_image_size"] or "original"
+        print(f"      {row['source']:>9} → {str(size):>8}: {row['images_per_s']:7.1f} imágenes/s, "
+              f"{row['payload_kb']:7.1f} KB")
+
+    classifier = OllamaImageClassifier(model_name=model, ollama_url=url, max_image_size=max_image_size,
+                                       jpeg_quality=jpeg_quality, max_retries=1,
+                                       transport=TransportConfig(pool_size=max_concurrency))
+    rtt = measure_rtt(classifier)
+    print(f"   🌐 Ida y vuelta HTTP: {rtt['first_ms']:.1f} ms con conexión nueva, "
+          f"p50 {rtt['p50_ms']:.1f} ms / p95 {rtt['p95_ms']:.1f} ms reutilizada")
+    load = measure_model_load(classifier)
+    print(f"   📦 Carga del modelo {model}: {load['load_s']:.2f}s ({load['wall_s']:.2f}s en total)")
+
+    payload = encode_image_file(BytesIO(synthetic_photo(*TYPICAL_SOURCE)), max_image_size, jpeg_quality)
+    latency = measure_latency(classifier, payload, prompt)
+    if latency["p50_s"] is not None:
+        print(f"   ⏱️ Latencia de un request: {latency['p50_s']:.2f}s ({latency['server_s']:.2f}s en el servidor, "
+              f"{latency['overhead_s']:.3f}s de red y cliente)")
+    print("   📈 Rendimiento a concurrencia creciente:")
+    saturation = measure_saturation(classifier, payload, prompt, max_concurrency, requests_per_level)
+
+    recommendations = recommend(encode, rtt, load, latency, saturation, max_image_size, pool_size, cores)
+    print("\n   RECOMENDACIONES")
+    for line in recommendations:
+        print(f"   {line}")
+    return {"encode": encode, "rtt": rtt, "model_load": load, "latency": latency, "saturation": saturation,
+            "recommendations": recommendations}
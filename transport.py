@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Configuración de la capa HTTP de los clientes de Ollama y OpenAI
+
+Por defecto `requests` guarda como mucho 10 conexiones por host: con más
+workers las que no caben se cierran al volver al pool y hay que reabrirlas
+cada vez que la concurrencia sube (p. ej. con el limitador adaptativo), sin
+aprovechar el keep-alive. TransportConfig ajusta el pool a la concurrencia, separa los
+timeouts de conexión y de lectura y permite:
+
+- comprimir con gzip los cuerpos grandes (base64 de imágenes) cuando el
+  servidor, o un proxy delante de él, acepta `Content-Encoding: gzip`
+- HTTP/2 en el cliente OpenAI (httpx, requiere el paquete `h2`): un solo
+  socket multiplexa todos los requests concurrentes
+
+Ollama sirve HTTP/1.1 sin TLS, así que para él se usa `requests` con keep-alive.
+"""
+
+import gzip
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_GZIP_MIN_BYTES = 64 * 1024
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+GZIP_LEVEL = 1  # el base64 de un JPEG comprime ~25% ya con el nivel más rápido
+
+
+class TransportConfig:
+    """
+    Parámetros de conexión de un cliente HTTP
+
+    Args:
+        pool_size: Conexiones reutilizables por host; debe cubrir los requests concurrentes
+        connect_timeout: Segundos máximos para establecer la conexión
+        read_timeout: Segundos máximos esperando la respuesta (None = el de cada llamada)
+        gzip_requests: Comprimir los cuerpos de al menos gzip_min_bytes
+        gzip_min_bytes: Tamaño mínimo de cuerpo que se comprime
+        http2: Usar HTTP/2 en el cliente OpenAI
+        keepalive_expiry: Segundos que una conexión ociosa sigue abierta (httpx)
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: Optional[float] = None,
+                 gzip_requests: bool = False,
+                 gzip_min_bytes: int = DEFAULT_GZIP_MIN_BYTES,
+                 http2: bool = False,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY):
+        self.pool_size = max(1, pool_size)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.gzip_requests = gzip_requests
+        self.gzip_min_bytes = gzip_min_bytes
+        self.http2 = http2
+        self.keepalive_expiry = keepalive_expiry
+
+    def timeouts(self, read_timeout: Optional[float] = None) -> Tuple[float, Optional[float]]:
+        """Timeout (conexión, lectura) para requests; read_timeout es el de la llamada"""
+        return self.connect_timeout, self.read_timeout if self.read_timeout is not None else read_timeout
+
+    def encode_body(self, body: bytes) -> Tuple[bytes, Dict[str, str]]:
+        """
+        Cuerpo y cabeceras de un request JSON, comprimido si corresponde
+
+        La compresión es determinista (mtime=0) para que la huella de las
+        grabaciones de replay.py sea estable.
+        """
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_requests and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def build_session(self, retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
+        """Sesión de requests con reintentos y un pool del tamaño de la concurrencia"""
+        session = requests.Session()
+        retry = Retry(
+            total=retries,
+            read=retries,
+            connect=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[500, 502, 503, 504]
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def httpx_transport_kwargs(self) -> Dict:
+        """Argumentos de httpx.HTTPTransport (pool, keep-alive y HTTP/2)"""
+        import httpx
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("⚠️ HTTP/2 requiere el paquete 'h2' (pip install 'httpx[http2]'); se usa HTTP/1.1")
+                http2 = False
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                              keepalive_expiry=self.keepalive_expiry)
+        return {"http2": http2, "limits": limits}
+
+    def httpx_timeout(self, default_read: float = 600.0):
+        import httpx
+
+        read = self.read_timeout if self.read_timeout is not None else default_read
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+    def openai_http_client(self, transport=None):
+        """
+        Cliente httpx para `OpenAI(http_client=...)`
+
+        Args:
+            transport: Transporte httpx ya construido (p. ej. el de grabación de
+                replay.py, creado con httpx_transport_kwargs()); por defecto uno HTTP normal
+        """
+        import httpx
+
+        if transport is None:
+            transport = httpx.HTTPTransport(**self.httpx_transport_kwargs())
+        return httpx.Client(transport=transport, timeout=self.httpx_timeout())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Contabilidad de tokens y coste con presupuesto
+
+Registra los tokens de cada request (usage de OpenAI, prompt_eval_count /
+eval_count de Ollama), agrega por modelo tokens/s y coste por cada 1000 ítems,
+y aplica un presupuesto: un ritmo máximo de tokens por minuto frena la
+ejecución y un tope de tokens o dólares la detiene antes de superarlo.
+"""
+
+import argparse
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from cli_env import env_default
+
+# Precios en dólares por millón de tokens (entrada, salida)
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+
+class BudgetExceeded(Exception):
+    """El siguiente request superaría el presupuesto de tokens o de dinero"""
+
+
+def model_price(model: str, prices: Optional[Dict[str, Tuple[float, float]]] = None) -> Tuple[float, float]:
+    """
+    Precio (entrada, salida) por millón de tokens de un modelo
+
+    Se usa el prefijo más largo que coincida ("gpt-4o-mini-2024-07-18" -> "gpt-4o-mini");
+    los modelos sin precio (p. ej. los locales de Ollama) cuestan 0.
+    """
+    prices = MODEL_PRICES if prices is None else prices
+    matches = [name for name in prices if model.startswith(name)]
+    if not matches:
+        return 0.0, 0.0
+    return prices[max(matches, key=len)]
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int,
+                  prices: Optional[Dict[str, Tuple[float, float]]] = None) -> float:
+    """Coste en dólares de un request"""
+    input_price, output_price = model_price(model, prices)
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1e6
+
+
+class Budget:
+    """
+    Límites de una ejecución
+
+    Args:
+        max_tokens: Tope de tokens totales (entrada + salida)
+        max_cost: Tope de gasto en dólares
+        tokens_per_minute: Ritmo máximo; al alcanzarlo se espera en lugar de fallar
+    """
+
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None,
+                 tokens_per_minute: Optional[int] = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.tokens_per_minute = tokens_per_minute
+
+
+class UsageTracker:
+    """
+    Acumula el uso por modelo y hace cumplir un Budget opcional
+
+    Cada request llama a acquire() antes de enviarse y después a record() con
+    su uso (o a release() si falló sin consumir). acquire() estima lo que
+    costará el request con la media de los anteriores, contando también los
+    que están en vuelo, y lanza BudgetExceeded si el total lo superaría. Con
+    un tope de tokens o de dinero y aún sin ninguna medida, solo va un request
+    en vuelo: los demás esperan a que el primero dé la estimación.
+    """
+
+    def __init__(self, budget: Optional[Budget] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.budget = budget
+        self.prices = prices
+        self.exhausted = False
+        self._models: Dict[str, Dict] = {}
+        self._in_flight = 0
+        self._window = deque()  # (instante, tokens) del último minuto
+        self._start: Optional[float] = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def _totals(self) -> Tuple[int, float, int]:
+        tokens = sum(m["prompt_tokens"] + m["completion_tokens"] for m in self._models.values())
+        cost = sum(m["cost_usd"] for m in self._models.values())
+        items = sum(m["items"] for m in self._models.values())
+        return tokens, cost, items
+
+    def acquire(self):
+        """
+        Reserva un request; espera si se supera el ritmo de tokens por minuto
+
+        Raises:
+            BudgetExceeded: si el request (más los que están en vuelo) superaría el tope
+        """
+        with self._changed:
+            if self._start is None:
+                self._start = time.perf_counter()
+            while True:
+                self._check_limits()
+                wait = 1.0 if self._awaiting_estimate() else self._rate_wait()
+                if wait <= 0:
+                    self._in_flight += 1
+                    return
+                # record() y release() despiertan a los que esperan la primera medida
+                self._changed.wait(min(wait, 1.0))
+
+    def _awaiting_estimate(self) -> bool:
+        """Hay un tope de tokens o de dinero, ningún request medido y ya hay uno en vuelo"""
+        budget = self.budget
+        if budget is None or (budget.max_tokens is None and budget.max_cost is None):
+            return False
+        return self._in_flight > 0 and not self._totals()[2]
+
+    def _check_limits(self):
+        budget = self.budget
+        if budget is None:
+            return
+        tokens, cost, items = self._totals()
+        if items:
+            pending = self._in_flight + 1
+            if budget.max_tokens is not None and tokens + pending * tokens / items > budget.max_tokens:
+                self.exhausted = True
+            if budget.max_cost is not None and cost + pending * cost / items > budget.max_cost:
+                self.exhausted = True
+        if self.exhausted:
+            raise BudgetExceeded(f"Presupuesto agotado ({tokens} tokens, ${cost:.4f})")
+
+    def _rate_wait(self) -> float:
+        """Segundos que hay que esperar para no superar tokens_per_minute"""
+        if self.budget is None or self.budget.tokens_per_minute is None:
+            return 0.0
+        now = time.monotonic()
+        while self._window and now - self._window[0][0] >= 60:
+            self._window.popleft()
+        if sum(tokens for _, tokens in self._window) < self.budget.tokens_per_minute:
+            return 0.0
+        return 60 - (now - self._window[0][0])
+
+    def release(self):
+        """Libera un request que terminó sin consumir tokens"""
+        with self._changed:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._changed.notify_all()
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int,
+               duration_s: Optional[float] = None) -> float:
+        """
+        Registra el uso de un request terminado (y libera su reserva)
+
+        Args:
+            model: Modelo usado
+            prompt_tokens: Tokens de entrada
+            completion_tokens: Tokens generados
+            duration_s: Segundos de inferencia, si el servidor los informa
+
+        Returns:
+            Coste estimado del request en dólares
+        """
+        cost = estimate_cost(model, prompt_tokens, completion_tokens, self.prices)
+        with self._changed:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._changed.notify_all()
+            stats = self._models.setdefault(model, {
+                "items": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "cost_usd": 0.0, "inference_s": 0.0
+            })
+            stats["items"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost_usd"] += cost
+            stats["inference_s"] += duration_s or 0.0
+            self._window.append((time.monotonic(), prompt_tokens + completion_tokens))
+        return cost
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Uso agregado por modelo
+
+        tokens_per_s se calcula sobre el tiempo real transcurrido (rendimiento de
+        la ejecución); cost_per_1k_items es el coste medio de 1000 ítems.
+        """
+        with self._lock:
+            elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+            summary = {}
+            for model, stats in self._models.items():
+                total = stats["prompt_tokens"] + stats["completion_tokens"]
+                summary[model] = dict(
+                    stats,
+                    total_tokens=total,
+                    cost_usd=round(stats["cost_usd"], 6),
+                    inference_s=round(stats["inference_s"], 3),
+                    tokens_per_s=round(total / elapsed, 1) if elapsed > 0 else None,
+                    cost_per_1k_items=round(1000 * stats["cost_usd"] / stats["items"], 4)
+                )
+            return summary
+
+    def print_summary(self):
+        """Muestra el uso por modelo"""
+        summary = self.summary()
+        if not summary:
+            return
+        print("\n💰 USO DE TOKENS")
+        for model, stats in summary.items():
+            print(f"   {model}: {stats['items']} ítems | {stats['prompt_tokens']} entrada + "
+                  f"{stats['completion_tokens']} salida = {stats['total_tokens']} tokens | "
+                  f"{stats['tokens_per_s']} tokens/s | ${stats['cost_usd']:.4f} "
+                  f"(${stats['cost_per_1k_items']:.4f} por 1000 ítems)")
+        if self.exhausted:
+            print("   ⛔ La ejecución se detuvo al agotar el presupuesto")
+
+
+def add_budget_arguments(parser: argparse.ArgumentParser, env_prefix: str):
+    """Añade las opciones de presupuesto a una línea de comandos (variables <env_prefix>_BUDGET_...)"""
+    group = parser.add_argument_group("presupuesto")
+    group.add_argument("--budget-tokens", type=int, default=env_default(f"{env_prefix}_BUDGET_TOKENS", None, int),
+                       help=f"Detener antes de superar este total de tokens [{env_prefix}_BUDGET_TOKENS]")
+    group.add_argument("--budget-usd", type=float, default=env_default(f"{env_prefix}_BUDGET_USD", None, float),
+                       help=f"Detener antes de superar este gasto en dólares [{env_prefix}_BUDGET_USD]")
+    group.add_argument("--tokens-per-minute", type=int,
+                       default=env_default(f"{env_prefix}_TOKENS_PER_MINUTE", None, int),
+                       help=f"Frenar la ejecución para no superar este ritmo [{env_prefix}_TOKENS_PER_MINUTE]")
+    group.add_argument("--price", type=float, nargs=2, metavar=("ENTRADA", "SALIDA"),
+                       default=env_default(f"{env_prefix}_PRICE", None,
+                                           lambda value: [float(v) for v in value.split(",")]),
+                       help=f"Precio por millón de tokens del modelo, p. ej. coste de GPU de un modelo local "
+                            f"[{env_prefix}_PRICE=entrada,salida]")
+
+
+def tracker_from_args(args: argparse.Namespace, model: str) -> UsageTracker:
+    """Crea el UsageTracker de una ejecución a partir de las opciones de add_budget_arguments"""
+    prices = None
+    if args.price:
+        prices = dict(MODEL_PRICES)
+        prices[model] = tuple(args.price)
+    budget = None
+    if args.budget_tokens or args.budget_usd or args.tokens_per_minute:
+        budget = Budget(args.budget_tokens, args.budget_usd, args.tokens_per_minute)
+    return UsageTracker(budget, prices)